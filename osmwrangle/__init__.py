@@ -0,0 +1,35 @@
+"""
+Wrangle OpenStreetMap data: audit, clean and export an OSM XML file.
+
+The modules are imported on first use (import osmwrangle only loads this
+file), and the heavy dependencies are imported by the functions that need
+them: cerberus when validating, sqlite3 when a database is opened, numpy
+for the area filter and the columnar reader.
+
+    import osmwrangle
+    osmwrangle.mapparser.count_tags('example.osm')
+    osmwrangle.data.process_map('mapBend2.osm', validate=False, rules=True)
+
+The command line interface is `python -m osmwrangle` (see cli.py).
+"""
+import importlib
+
+
+__all__ = [
+    'activity', 'address', 'analysis', 'audit', 'benchmark', 'cache', 'cli', 'clip', 'columnar',
+    'data', 'database', 'fastscan', 'graph', 'integrity', 'mapparser', 'osmindex', 'pipeline',
+    'quarantine', 'regions', 'regression', 'reports', 'rules', 'sample', 'schema', 'search',
+    'sinks', 'tags', 'tiles', 'users',
+]
+
+
+def __getattr__(name):
+    if name in __all__:
+        module = importlib.import_module('.' + name, __name__)
+        globals()[name] = module
+        return module
+    raise AttributeError("module {0!r} has no attribute {1!r}".format(__name__, name))
+
+
+def __dir__():
+    return sorted(set(globals()) | set(__all__))
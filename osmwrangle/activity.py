@@ -0,0 +1,318 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Changeset and contributor activity tables, built while exporting.
+
+Every shaped node and way carries its changeset, uid, user and timestamp,
+but the only question the notebook asks of them is the top 10 contributors,
+a GROUP BY over a UNION ALL of both element tables.  An ActivityIndex is a
+sink (see sinks.py): fed every exported element, it keeps one running
+record per changeset
+
+    changesets      (id, uid) -> user, nodes, ways, bbox of its nodes,
+                    first and last timestamp
+
+and on close writes it to the database, then derives from it
+
+    user_activity   uid -> user (the name of their latest changeset), nodes,
+                    ways, changesets, first and last timestamp
+
+Both tables are indexed (SQL_ACTIVITY_INDEXES), so "what did this user
+touch" (user_changesets), "largest changesets" and "top contributors" are
+index lookups over tables with one row per changeset or user instead of
+scans of nodes and ways.  An index saves its records under its source (the
+exported file) in source_changesets, replacing those of an earlier export
+of the same source, and changesets is merged from all the sources: the
+index of several regional exports can be written into one database, and
+exporting a file again does not count it twice.  A changeset belongs to
+one user, but the key includes the uid so that the per-user totals stay
+exact in an extract where it does not.  build_from_tables builds the same
+tables from an existing database.
+
+Usage:
+    python -m osmwrangle export mapBend2.osm --to sqlite --activity
+    python -m osmwrangle report BendOR.db changesets --limit 10
+    python -m osmwrangle.activity BendOR.db           # build it from the nodes and ways tables
+"""
+import sys
+
+from . import database
+
+
+TABLES_SOURCE = 'nodes, ways'  # the source of build_from_tables
+
+SQL_ACTIVITY = '''
+CREATE TABLE IF NOT EXISTS source_changesets (
+    source TEXT NOT NULL,
+    id INTEGER NOT NULL,
+    uid INTEGER NOT NULL,
+    user TEXT,
+    nodes INTEGER NOT NULL,
+    ways INTEGER NOT NULL,
+    minlat REAL,
+    minlon REAL,
+    maxlat REAL,
+    maxlon REAL,
+    first_timestamp INTEGER,
+    last_timestamp INTEGER,
+    PRIMARY KEY (id, uid, source)
+) WITHOUT ROWID;
+
+CREATE INDEX IF NOT EXISTS source_changesets_source ON source_changesets (source);
+
+CREATE TABLE IF NOT EXISTS changesets (
+    id INTEGER NOT NULL,
+    uid INTEGER NOT NULL,
+    user TEXT,
+    nodes INTEGER NOT NULL,
+    ways INTEGER NOT NULL,
+    minlat REAL,
+    minlon REAL,
+    maxlat REAL,
+    maxlon REAL,
+    first_timestamp INTEGER,
+    last_timestamp INTEGER,
+    PRIMARY KEY (id, uid)
+) WITHOUT ROWID;
+
+CREATE TABLE IF NOT EXISTS user_activity (
+    uid INTEGER PRIMARY KEY NOT NULL,
+    user TEXT,
+    nodes INTEGER NOT NULL,
+    ways INTEGER NOT NULL,
+    changesets INTEGER NOT NULL,
+    first_timestamp INTEGER,
+    last_timestamp INTEGER
+);
+'''
+
+SQL_ACTIVITY_INDEXES = '''
+CREATE INDEX IF NOT EXISTS changesets_uid ON changesets (uid, first_timestamp);
+CREATE INDEX IF NOT EXISTS changesets_size ON changesets (nodes + ways);
+CREATE INDEX IF NOT EXISTS user_activity_edits ON user_activity (nodes + ways);
+'''
+
+SQL_INSERT_SOURCE_CHANGESET = '''
+INSERT INTO source_changesets VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+'''
+
+# MIN and MAX skip the NULL bbox of a changeset of ways only; the user is
+# the one of the source that saw the changeset last
+SQL_CHANGESETS = '''
+DELETE FROM changesets;
+INSERT INTO changesets
+SELECT id, uid,
+       (SELECT user FROM source_changesets AS latest
+        WHERE latest.id = merged.id AND latest.uid = merged.uid
+        ORDER BY last_timestamp DESC, source LIMIT 1),
+       SUM(nodes), SUM(ways), MIN(minlat), MIN(minlon), MAX(maxlat), MAX(maxlon),
+       MIN(first_timestamp), MAX(last_timestamp)
+FROM source_changesets AS merged
+GROUP BY id, uid;
+'''
+
+# the user is the name of the latest changeset (the later id on a tie)
+SQL_USER_ACTIVITY = '''
+DELETE FROM user_activity;
+INSERT INTO user_activity
+SELECT uid,
+       (SELECT user FROM changesets AS latest WHERE latest.uid = merged.uid
+        ORDER BY last_timestamp DESC, id DESC LIMIT 1),
+       SUM(nodes), SUM(ways), COUNT(*), MIN(first_timestamp), MAX(last_timestamp)
+FROM changesets AS merged
+GROUP BY uid;
+'''
+
+# latest_user is the same on every row of a changeset; MAX only picks it
+SQL_CHANGESETS_FROM_TABLES = '''
+INSERT INTO source_changesets
+SELECT ?, changeset, uid, MAX(latest_user), SUM(node), SUM(1 - node),
+       MIN(lat), MIN(lon), MAX(lat), MAX(lon), MIN(timestamp), MAX(timestamp)
+FROM (SELECT changeset, uid, node, lat, lon, timestamp,
+             FIRST_VALUE(user) OVER (PARTITION BY changeset, uid
+                                     ORDER BY timestamp DESC) AS latest_user
+      FROM (SELECT changeset, uid, user, 1 AS node, lat, lon, timestamp FROM nodes
+            UNION ALL
+            SELECT changeset, uid, user, 0, NULL, NULL, timestamp FROM ways))
+GROUP BY changeset, uid;
+'''
+
+# changesets record field positions
+USER, NODES, WAYS, MINLAT, MINLON, MAXLAT, MAXLON, FIRST, LAST = range(9)
+
+
+class ActivityIndex(object):
+    """Aggregates the exported elements per changeset; writes the activity tables on close
+
+    db is a database path (opened and closed by the index) or an open
+    connection; with None, close only aggregates and save(db) writes.
+    source names the exported file; saving replaces the records of an
+    earlier index with the same source.
+    """
+
+    def __init__(self, db=None, source=''):
+        self.db = db
+        self.source = source
+        self.changesets = {}
+
+    def write(self, el):
+        if 'node' in el:
+            attributes = el['node']
+            lat, lon = attributes['lat'], attributes['lon']
+        else:
+            attributes = el['way']
+            lat = lon = None
+        key = (attributes['changeset'], attributes['uid'])
+        changeset = self.changesets.get(key)
+        timestamp = attributes['timestamp']
+        if changeset is None:
+            changeset = self.changesets[key] = [attributes['user'], 0, 0, lat, lon, lat, lon,
+                                                 timestamp, timestamp]
+        elif timestamp > changeset[LAST]:
+            changeset[LAST] = timestamp
+            changeset[USER] = attributes['user']
+        elif timestamp < changeset[FIRST]:
+            changeset[FIRST] = timestamp
+        if lat is None:
+            changeset[WAYS] += 1
+            return
+        changeset[NODES] += 1
+        if changeset[MINLAT] is None:
+            changeset[MINLAT:] = [lat, lon, lat, lon] + changeset[FIRST:]
+            return
+        if lat < changeset[MINLAT]:
+            changeset[MINLAT] = lat
+        elif lat > changeset[MAXLAT]:
+            changeset[MAXLAT] = lat
+        if lon < changeset[MINLON]:
+            changeset[MINLON] = lon
+        elif lon > changeset[MAXLON]:
+            changeset[MAXLON] = lon
+
+    def rows(self):
+        """Yield the changesets rows, by changeset id and uid"""
+        for key in sorted(self.changesets):
+            yield key + tuple(self.changesets[key])
+
+    def save(self, db):
+        """Replace the changesets of the source and rebuild changesets and user_activity"""
+        db.executescript(SQL_ACTIVITY)
+        db.execute('DELETE FROM source_changesets WHERE source = ?', (self.source,))
+        db.executemany(SQL_INSERT_SOURCE_CHANGESET, ((self.source,) + row for row in self.rows()))
+        finish(db)
+
+    def close(self):
+        if self.db is None:
+            return
+        if isinstance(self.db, str):
+            db = database.open_db(self.db)
+            self.save(db)
+            db.close()
+        else:
+            self.save(self.db)
+
+    def abort(self):
+        """Save nothing for a failed export"""
+
+    def report(self):
+        return {'changesets': len(self.changesets),
+                'users': len(set(uid for _, uid in self.changesets))}
+
+
+def finish(db):
+    db.executescript(SQL_CHANGESETS)
+    db.executescript(SQL_USER_ACTIVITY)
+    db.executescript(SQL_ACTIVITY_INDEXES)
+    db.commit()
+
+
+# ================================================== #
+#               Queries                              #
+# ================================================== #
+def build_from_tables(db):
+    """(Re)build the activity tables of a database from its nodes and ways tables"""
+    db.executescript(SQL_ACTIVITY)
+    db.execute('DELETE FROM source_changesets')
+    db.execute(SQL_CHANGESETS_FROM_TABLES, (TABLES_SOURCE,))
+    finish(db)
+
+
+def largest_changesets(db, limit=10):
+    """Return [(changeset, user, nodes, ways)] of the changesets with the most elements"""
+    return db.execute('SELECT id, user, nodes, ways FROM changesets '
+                      'ORDER BY nodes + ways DESC, id LIMIT ?', (limit,)).fetchall()
+
+
+def user_changesets(db, uid):
+    """Return the changesets rows of one user (what they touched, where and when)"""
+    return db.execute('SELECT * FROM changesets WHERE uid = ? ORDER BY first_timestamp, id',
+                      (uid,)).fetchall()
+
+
+def top_contributors(db, limit=10):
+    """Return [(user, nodes + ways)] of the most active users"""
+    return db.execute('SELECT user, nodes + ways AS edits FROM user_activity '
+                      'ORDER BY nodes + ways DESC, uid LIMIT ?', (limit,)).fetchall()
+
+
+def test():
+
+    db = database.export_db('example.osm', ':memory:')
+    activity = ActivityIndex()
+    database.export_db('example.osm', ':memory:', sinks=[activity])
+    assert activity.report() == {'changesets': len(activity.changesets), 'users': 6}
+    activity.save(db)
+    streamed = db.execute('SELECT * FROM changesets ORDER BY id, uid').fetchall()
+    users = db.execute('SELECT * FROM user_activity ORDER BY uid').fetchall()
+    build_from_tables(db)
+    assert db.execute('SELECT * FROM changesets ORDER BY id, uid').fetchall() == streamed
+    assert db.execute('SELECT * FROM user_activity ORDER BY uid').fetchall() == users
+
+    assert top_contributors(db, 1) == [('uboot', 6)]
+    assert sum(nodes + ways for _, _, nodes, ways in largest_changesets(db, 100)) == 21
+    uid = db.execute("SELECT uid FROM nodes WHERE user = 'uboot'").fetchone()[0]
+    touched = user_changesets(db, uid)
+    assert sum(row[3] for row in touched) == 6 and all(row[2] == 'uboot' for row in touched)
+    plan = ' '.join(str(row[-1]) for row in db.execute(
+        'EXPLAIN QUERY PLAN SELECT * FROM changesets WHERE uid = ?', (uid,)))
+    assert 'changesets_uid' in plan, plan
+
+    # exporting the same source again replaces its changesets
+    db = database.export_db('example.osm', ':memory:')
+    activity.save(db)
+    activity.save(db)
+    assert db.execute('SELECT * FROM changesets ORDER BY id, uid').fetchall() == streamed
+    assert db.execute('SELECT * FROM user_activity ORDER BY uid').fetchall() == users
+
+    # the same elements from another source double the counts, bbox unchanged
+    ActivityIndex(db, 'other.osm').close()
+    assert top_contributors(db, 1) == [('uboot', 6)]
+    other = ActivityIndex(db, 'other.osm')
+    database.export_db('example.osm', ':memory:', sinks=[other])
+    other.close()
+    assert top_contributors(db, 1) == [('uboot', 12)]
+    assert [row[5:] for row in db.execute('SELECT * FROM changesets ORDER BY id, uid')] == [
+        row[5:] for row in streamed]
+
+    # a renamed user is listed under the name of their latest changeset
+    activity = ActivityIndex()
+    for changeset, user, timestamp in ((2, 'new', 20), (1, 'old', 10), (1, 'old', 30)):
+        activity.write({'way': {'changeset': changeset, 'uid': 7, 'user': user,
+                                'timestamp': timestamp}})
+    db = database.open_db(':memory:')
+    activity.save(db)
+    assert db.execute('SELECT user, ways, changesets FROM user_activity').fetchall() == [
+        ('old', 3, 2)]
+    activity.changesets[(1, 7)][LAST] = 15
+    activity.save(db)
+    assert db.execute('SELECT user FROM user_activity').fetchall() == [('new',)]
+    assert db.execute('SELECT MIN(minlat) FROM changesets').fetchone() == (None,)
+
+
+if __name__ == "__main__":
+    if len(sys.argv) > 1:
+        db = database.open_db(sys.argv[1])
+        build_from_tables(db)
+        print(top_contributors(db))
+    else:
+        test()
@@ -0,0 +1,245 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Zip code and city validation of the addr:* tags, applied while exporting.
+
+The notebook audits zip codes and cities against lists ("zip_code not in
+expected") and appends every bad city to a list that grows with the file.
+Here the reference data is a ZIP5 -> city table (zip_cities.csv by default),
+loaded once into a dict of frozensets, so every check is a set lookup.  For
+every shaped node or way with an addr:postcode or addr:city tag,
+AddressValidator.check returns its fix decisions:
+
+    zip_reformatted    '97701 1234', 'OR 97702', ' 97703' -> '97701-1234', '97702', '97703'
+                       (or the ZIP5 only, with plus4=False)
+    bad_zip            not a ZIP5 or ZIP+4                         (not fixed)
+    unknown_zip        not in the reference table                  (not fixed)
+    city_case          'BEND' -> 'Bend'
+    unknown_city       not in the reference table                  (not fixed)
+    city_zip_mismatch  the city is not one of the zip code's       (not fixed)
+    missing_city       with fill_city=True, the city of a zip code
+                       that has exactly one is added
+
+AddressValidator.apply returns the element with its fixes, as a copy, so
+the element it is given (a replayed cache record, say) is never changed.
+It only keeps counts and at most SAMPLE_SIZE decisions per problem; pass
+log (an open text file) to stream every decision to a csv.  process_map, export_db and
+export_columns take an AddressValidator as addresses= and apply it to
+every element before validating and writing it.
+
+Usage:
+    python -m osmwrangle.address mapBend2.osm [decisions.csv]   # report, without exporting
+"""
+import collections
+import csv
+import json
+import os
+import re
+import sys
+
+from . import data
+
+
+ZIP_CITIES = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'zip_cities.csv')
+SAMPLE_SIZE = 10  # decisions kept per problem
+
+ZIP_CODE = re.compile(r'^\s*(?:[A-Za-z]{2}\s+)?(\d{5})(?:\s*-?\s*(\d{4}))?\s*$')
+
+PROBLEMS = ('zip_reformatted', 'bad_zip', 'unknown_zip', 'city_case', 'unknown_city',
+            'city_zip_mismatch', 'missing_city')
+
+# fix is the new value, or None when the problem is only reported
+Decision = collections.namedtuple('Decision', 'element id key value fix problem')
+
+
+def load_zip_cities(path=ZIP_CITIES):
+    """Return {ZIP5: frozenset(cities)} of a zip,city csv"""
+    cities = collections.defaultdict(set)
+    with open(path, newline='', encoding='utf-8') as csv_file:
+        for row in csv.DictReader(csv_file):
+            cities[row['zip'].strip()].add(row['city'].strip())
+    return dict((zip5, frozenset(names)) for zip5, names in cities.items())
+
+
+def normalize_zip(value):
+    """Return (ZIP5, plus4 or None) of a zip code, or None if it is not one"""
+    match = ZIP_CODE.match(value)
+    if match is None:
+        return None
+    return match.group(1), match.group(2)
+
+
+class AddressValidator(object):
+    """Checks and fixes the zip code and city of each shaped element"""
+
+    def __init__(self, zip_cities=None, plus4=True, fill_city=False, log=None,
+                 sample_size=SAMPLE_SIZE):
+        if zip_cities is None or isinstance(zip_cities, str):
+            zip_cities = load_zip_cities(zip_cities or ZIP_CITIES)
+        self.zip_cities = zip_cities
+        self.cities = dict((city.casefold(), city) for names in zip_cities.values()
+                           for city in names)
+        self.plus4 = plus4
+        self.fill_city = fill_city
+        self.sample_size = sample_size
+        self.checked = 0
+        self.counts = dict((problem, 0) for problem in PROBLEMS)
+        self.samples = dict((problem, []) for problem in PROBLEMS)
+        self.log = None
+        if log is not None:
+            self.log = csv.writer(log)
+            self.log.writerow(Decision._fields)
+
+    def check(self, element, element_id, postcode, city):
+        """Return the [Decision] for one element's addr:postcode and addr:city values"""
+        decisions = []
+        zip5 = None
+        if postcode is not None:
+            parsed = normalize_zip(postcode)
+            if parsed is None:
+                decisions.append(Decision(element, element_id, 'postcode', postcode, None,
+                                          'bad_zip'))
+            else:
+                zip5, plus4 = parsed
+                fixed = zip5 + '-' + plus4 if plus4 and self.plus4 else zip5
+                if fixed != postcode:
+                    decisions.append(Decision(element, element_id, 'postcode', postcode, fixed,
+                                              'zip_reformatted'))
+                if zip5 not in self.zip_cities:
+                    decisions.append(Decision(element, element_id, 'postcode', postcode, None,
+                                              'unknown_zip'))
+                    zip5 = None
+
+        if city is not None:
+            known = self.cities.get(city.strip().casefold())
+            if known is None:
+                decisions.append(Decision(element, element_id, 'city', city, None,
+                                          'unknown_city'))
+            else:
+                if known != city:
+                    decisions.append(Decision(element, element_id, 'city', city, known,
+                                              'city_case'))
+                if zip5 is not None and known not in self.zip_cities[zip5]:
+                    decisions.append(Decision(element, element_id, 'city', city, None,
+                                              'city_zip_mismatch'))
+        elif zip5 is not None and self.fill_city and len(self.zip_cities[zip5]) == 1:
+            decisions.append(Decision(element, element_id, 'city', None,
+                                      next(iter(self.zip_cities[zip5])), 'missing_city'))
+        return decisions
+
+    def apply(self, el):
+        """Check a shaped element; return it with its fixes applied
+
+        el itself is left as it is: with fixes, a copy with a new tag list
+        (and new dicts for the fixed tags) is returned.
+        """
+        element = 'node' if 'node' in el else 'way'
+        tags = el[element + '_tags']
+        address = {}
+        for tag in tags:
+            if tag['type'] == 'addr' and (tag['key'] == 'postcode' or tag['key'] == 'city'):
+                address[tag['key']] = tag
+        if not address:
+            return el
+
+        self.checked += 1
+        postcode = address.get('postcode')
+        city = address.get('city')
+        decisions = self.check(element, el[element]['id'],
+                               postcode['value'] if postcode is not None else None,
+                               city['value'] if city is not None else None)
+        fixes = {}
+        for decision in decisions:
+            self.counts[decision.problem] += 1
+            samples = self.samples[decision.problem]
+            if len(samples) < self.sample_size:
+                samples.append(decision)
+            if self.log is not None:
+                self.log.writerow(decision)
+            if decision.fix is not None:
+                fixes[decision.key] = decision.fix
+        if not fixes:
+            return el
+
+        fixed_tags = []
+        for tag in tags:
+            if address.get(tag['key']) is tag and tag['key'] in fixes:
+                tag = dict(tag, value=fixes.pop(tag['key']))
+            fixed_tags.append(tag)
+        for key, value in fixes.items():  # a missing city
+            fixed_tags.append({'id': el[element]['id'], 'key': key, 'value': value,
+                               'type': 'addr'})
+        fixed = dict(el)
+        fixed[element + '_tags'] = fixed_tags
+        return fixed
+
+    def report(self):
+        """Return the counts and sample decisions as a JSON-serializable dict"""
+        report = {'checked': self.checked,
+                  'samples': dict((problem, [decision._asdict() for decision in samples])
+                                  for problem, samples in self.samples.items() if samples)}
+        report.update(self.counts)
+        return report
+
+
+# ================================================== #
+#               Main Function                        #
+# ================================================== #
+def validate_file(osm_file, addresses=None, rules=None):
+    """Check every node and way of osm_file without exporting; return the validator"""
+    addresses = addresses or AddressValidator()
+    for el in data.shaped_file(osm_file, rules):
+        addresses.apply(el)
+    return addresses
+
+
+def test():
+
+    addresses = AddressValidator()
+    assert normalize_zip('97701-1234') == ('97701', '1234')
+    assert normalize_zip('OR 97702') == ('97702', None)
+    assert normalize_zip('9770') is None
+
+    def problems(postcode, city, validator=addresses):
+        return [(d.fix, d.problem) for d in validator.check('node', 1, postcode, city)]
+
+    assert problems('97701', 'Bend') == []
+    assert problems('97701 1234', None) == [('97701-1234', 'zip_reformatted')]
+    assert problems('97701-1234', None, AddressValidator(plus4=False)) == [
+        ('97701', 'zip_reformatted')]
+    assert problems('Bend', None) == [(None, 'bad_zip')]
+    assert problems('12345', 'BEND') == [(None, 'unknown_zip'), ('Bend', 'city_case')]
+    assert problems('97756', 'Bend') == [(None, 'city_zip_mismatch')]
+    assert problems('97707', 'Sunriver') == []
+    assert problems('97756', None, AddressValidator(fill_city=True)) == [
+        ('Redmond', 'missing_city')]
+
+    el = {'node': {'id': 1},
+          'node_tags': [{'id': 1, 'key': 'postcode', 'value': 'OR 97702', 'type': 'addr'},
+                        {'id': 1, 'key': 'city', 'value': 'bend', 'type': 'addr'}]}
+    fixed = addresses.apply(el)
+    assert [tag['value'] for tag in fixed['node_tags']] == ['97702', 'Bend']
+    assert [tag['value'] for tag in el['node_tags']] == ['OR 97702', 'bend']  # not changed
+    assert addresses.counts['city_case'] == 1 and addresses.checked == 1
+    assert addresses.apply(fixed) is fixed
+
+    filled = AddressValidator(fill_city=True).apply(
+        {'way': {'id': 2}, 'way_tags': [{'id': 2, 'key': 'postcode', 'value': '97756',
+                                         'type': 'addr'}]})
+    assert filled['way_tags'][1] == {'id': 2, 'key': 'city', 'value': 'Redmond', 'type': 'addr'}
+
+    checked = validate_file('example.osm')
+    assert checked.checked == 0 and not any(checked.counts.values())
+
+
+if __name__ == "__main__":
+    if len(sys.argv) > 1:
+        log = open(sys.argv[2], 'w', newline='', encoding='utf-8') if len(sys.argv) > 2 else None
+        try:
+            json.dump(validate_file(sys.argv[1], AddressValidator(log=log)).report(), sys.stdout,
+                      indent=1, sort_keys=True)
+        finally:
+            if log is not None:
+                log.close()
+    else:
+        test()
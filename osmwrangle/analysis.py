@@ -0,0 +1,173 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Load query results into pandas DataFrames without a list of row tuples.
+
+The notebook's analysis cells do
+
+    c.execute(QUERY)
+    rows = c.fetchall()
+    df = pd.DataFrame(rows, columns=[...], index=['1', '2', ..., '10'])
+
+which holds every row as a tuple before pandas copies it again column by
+column, and breaks as soon as a query returns fewer rows than the index
+has labels.  query_frame instead reads the cursor with fetchmany in chunks
+of CHUNK_SIZE rows and appends each column of a chunk to a typed
+array.array: int64 while the values are ints, float64 for floats (ints
+with NULLs become float64 with NaN, as pandas would make them) and a list
+of objects for text.  The DataFrame is built over numpy views of those
+arrays, with a RangeIndex 1..n derived from the number of rows.
+
+    from osmwrangle import analysis, database
+    db = database.open_db('BendOR.db')
+    analysis.query_frame(db, TOP_CONTRIBUTORS, columns=['User Name', 'Number of Contributions'])
+    analysis.table_frame(db, 'nodes_tags')
+
+numpy and pandas are imported when the first DataFrame is built.
+"""
+import sys
+from array import array
+
+
+CHUNK_SIZE = 1000  # rows per fetchmany call (larger chunks fall out of the CPU cache)
+DTYPES = {'q': 'i8', 'd': 'f8'}
+NAN = float('nan')
+
+# the notebook's top 10 contributors query
+TOP_CONTRIBUTORS = '''
+SELECT subquery.user, COUNT(*) AS num
+FROM (SELECT user FROM nodes UNION ALL SELECT user FROM ways)
+AS subquery GROUP BY subquery.user ORDER BY num DESC LIMIT 10;
+'''
+
+
+class Column(object):
+    """The values of one result column, typed while they allow it"""
+
+    def __init__(self):
+        self.values = None  # array('q'), array('d') or list
+
+    def __len__(self):
+        return len(self.values) if self.values is not None else 0
+
+    def extend(self, values):
+        stored = self.values
+        if stored is None:
+            stored = self.values = self.start(values)
+        if isinstance(stored, list):
+            stored.extend(values)
+            return
+        size = len(stored)
+        try:
+            stored.extend(values)
+        except (TypeError, OverflowError):
+            del stored[size:]  # extend stops at the first bad value
+            self.promote(values)
+
+    @staticmethod
+    def start(values):
+        for value in values:
+            if value is None:
+                continue
+            if isinstance(value, int):
+                return array('q')
+            if isinstance(value, float):
+                return array('d')
+            break
+        return []
+
+    def promote(self, values):
+        """Widen the column for values that do not fit its array"""
+        stored = self.values
+        if all(value is None or (isinstance(value, (int, float)) and
+                                 abs(value) < 2 ** 63) for value in values):
+            if stored.typecode == 'q':
+                stored = self.values = array('d', stored)
+            stored.extend(NAN if value is None else value for value in values)
+        else:
+            self.values = stored.tolist()
+            self.values.extend(values)
+
+
+# ================================================== #
+#               Main Functions                       #
+# ================================================== #
+def fetch_columns(cursor, chunk_size=CHUNK_SIZE):
+    """Return ([column names], [Column]) of the remaining rows of an executed cursor"""
+    names = [description[0] for description in cursor.description]
+    columns = [Column() for _ in names]
+    while True:
+        rows = cursor.fetchmany(chunk_size)
+        if not rows:
+            break
+        for column, values in zip(columns, zip(*rows)):
+            column.extend(values)
+    return names, columns
+
+
+def column_array(column):
+    """A numpy array over the column's values (no copy for typed columns)"""
+    import numpy as np
+    values = column.values
+    if isinstance(values, array):
+        if not values:
+            return np.empty(0, dtype=DTYPES[values.typecode])
+        return np.frombuffer(values, dtype=DTYPES[values.typecode])
+    result = np.empty(len(column), dtype=object)
+    result[:] = values or []
+    return result
+
+
+def query_frame(db, query, params=(), columns=None, index_start=1, chunk_size=CHUNK_SIZE):
+    """Run query and return its result as a DataFrame indexed index_start..n
+
+    columns renames the result columns (default: the names in the query).
+    """
+    import pandas as pd
+    names, fetched = fetch_columns(db.execute(query, params), chunk_size)
+    rows = len(fetched[0]) if fetched else 0
+    frame = pd.DataFrame(dict((i, column_array(column)) for i, column in enumerate(fetched)),
+                         index=pd.RangeIndex(index_start, index_start + rows), copy=False)
+    frame.columns = list(columns) if columns is not None else names
+    return frame
+
+
+def table_frame(db, table, chunk_size=CHUNK_SIZE):
+    """Return a whole table (or view) as a DataFrame"""
+    return query_frame(db, 'SELECT * FROM {0}'.format(table), chunk_size=chunk_size)
+
+
+def test():
+
+    import pandas as pd
+    from . import database
+    db = database.export_db('example.osm', ':memory:')
+
+    top = query_frame(db, TOP_CONTRIBUTORS, columns=['User Name', 'Number of Contributions'])
+    assert list(top.index) == list(range(1, len(top) + 1)) and len(top) == 6
+    assert top.iloc[0].tolist() == ['uboot', 6]
+    assert str(top['Number of Contributions'].dtype) == 'int64'
+
+    # fewer rows than the notebook's hard-coded index, and no rows at all
+    tourism = query_frame(db, "SELECT value, COUNT(*) FROM nodes_tags WHERE key = 'tourism'")
+    assert len(tourism) == 1 and tourism.iloc[0, 1] == 0
+    assert len(query_frame(db, 'SELECT id FROM nodes WHERE id < 0')) == 0
+
+    nodes = table_frame(db, 'nodes', chunk_size=7)
+    expected = pd.DataFrame(db.execute('SELECT * FROM nodes').fetchall(), columns=nodes.columns,
+                            index=pd.RangeIndex(1, 21))
+    assert nodes.equals(expected)
+
+    column = Column()
+    column.extend((1, 2))
+    column.extend((None, 3))
+    column.extend(('x',))
+    assert str(column_array(column)[:2].dtype) == 'object' and column.values[3] == 3
+
+
+if __name__ == "__main__":
+    if len(sys.argv) > 2:
+        from . import database
+        print(query_frame(database.open_db(sys.argv[1]), sys.argv[2]).to_string())
+    else:
+        test()
@@ -0,0 +1,216 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Audit the tag values of an OSM file against the cleaning rules (rules.py).
+
+For every tag key that has expected values configured (addr:street,
+addr:postcode, addr:city with the default cleaning_rules.json) the audit
+counts the values whose audited part (the street type for addr:street) is
+not expected, and writes a compact JSON or CSV report with, per value, its
+occurrence count, the ids of its first occurrences and what the cleaning
+rules turn it into.
+
+Memory stays bounded on messy extracts: values are interned, at most
+SAMPLE_SIZE element ids are kept per value, and at most MAX_VALUES distinct
+values are tracked per key.  Past that the table is trimmed with the
+Misra-Gries frequent-items scheme, so every value occurring more than
+1/MAX_VALUES of the time is still reported; the counts are then lower
+bounds, off by at most the 'undercount' recorded in the report.  The counts
+per audited part (street type) are bounded the same way.
+
+Usage:
+    python -m osmwrangle.audit mapBend2.osm [report.json|report.csv] [cleaning_rules.json]
+"""
+import csv
+import json
+import os
+import sys
+
+try:
+    import xml.etree.cElementTree as ET
+except ImportError:  # removed in Python 3.9
+    import xml.etree.ElementTree as ET
+
+from . import fastscan
+from . import rules as cleaning
+
+
+MAX_VALUES = 10000  # distinct non-conforming values tracked per key
+SAMPLE_SIZE = 5     # element ids kept per value
+
+REPORT_FIELDS = ['key', 'part', 'value', 'count', 'cleaned', 'element_ids']
+
+
+class ValueAudit(object):
+    """Bounded occurrence counts of the non-conforming values of one key"""
+
+    def __init__(self, key, max_values=MAX_VALUES, sample_size=SAMPLE_SIZE):
+        self.key = key
+        self.max_values = max_values
+        self.sample_size = sample_size
+        self.values = {}       # value -> [count, part, [(element type, id), ...]]
+        self.parts = {}        # part -> [count]
+        self.total = 0         # exact number of non-conforming occurrences
+        self.undercount = 0    # upper bound of the error of any value count
+        self.parts_undercount = 0
+
+    def add(self, value, part, element_type, element_id):
+        self.total += 1
+        entry = self.parts.get(part)
+        if entry is None:
+            if len(self.parts) >= self.max_values:
+                trim(self.parts)
+                self.parts_undercount += 1
+            else:
+                self.parts[sys.intern(part)] = [1]
+        else:
+            entry[0] += 1
+
+        entry = self.values.get(value)
+        if entry is None:
+            if len(self.values) >= self.max_values:
+                trim(self.values)
+                self.undercount += 1
+                return
+            value = sys.intern(value)
+            entry = self.values[value] = [0, sys.intern(part), []]
+        entry[0] += 1
+        if len(entry[2]) < self.sample_size:
+            entry[2].append((element_type, element_id))
+
+    def rows(self, rules):
+        """Yield one report row per tracked value, most frequent first"""
+        for value, (count, part, ids) in sorted(self.values.items(),
+                                                key=lambda item: (-item[1][0], item[0])):
+            yield {'key': self.key, 'part': part, 'value': value, 'count': count,
+                   'cleaned': rules.clean(self.key, value),
+                   'element_ids': ['{0}/{1}'.format(t, i) for t, i in ids]}
+
+    def summary(self):
+        return {'key': self.key, 'total': self.total, 'distinct_values': len(self.values),
+                'undercount': self.undercount, 'parts_undercount': self.parts_undercount,
+                'parts': dict((part, entry[0]) for part, entry in self.parts.items())}
+
+
+# ================================================== #
+#               Helper Functions                     #
+# ================================================== #
+def trim(table):
+    """Misra-Gries step: decrement every count and drop the ones at zero"""
+    for value in list(table):
+        entry = table[value]
+        entry[0] -= 1
+        if entry[0] == 0:
+            del table[value]
+
+
+def iter_tag_values(osmfile, keys, backend='iterparse'):
+    """Yield (key, value, element type, element id) for node and way tags in keys
+
+    backend is 'iterparse', 'scan' (see fastscan.py) or 'cache', which
+    replays the shaped elements cached by cache.py.
+    """
+    if backend == 'scan':
+        for key in keys:
+            for element_type, element_id, value in fastscan.iter_tag_values(osmfile, key, ids=True):
+                yield key, fastscan.decode(value), element_type, element_id
+        return
+    if backend == 'cache':
+        from . import cache
+        for el in cache.shaped_elements(osmfile):
+            element_type = 'node' if 'node' in el else 'way'
+            for tag in el[element_type + '_tags']:
+                key = tag['key'] if tag['type'] == 'regular' else tag['type'] + ':' + tag['key']
+                if key in keys:
+                    yield key, tag['value'], element_type, tag['id']
+        return
+
+    # clear the root after every top level element, as data.get_element does,
+    # so the parsed tree never grows with the file
+    context = ET.iterparse(osmfile, events=('start', 'end'))
+    _, root = next(context)
+    for event, elem in context:
+        if event != 'end' or elem.tag not in ('node', 'way', 'relation'):
+            continue
+        if elem.tag != 'relation':
+            for tag in elem.iter('tag'):
+                if tag.attrib['k'] in keys:
+                    yield tag.attrib['k'], tag.attrib['v'], elem.tag, int(elem.attrib['id'])
+        root.clear()
+
+
+# ================================================== #
+#               Main Functions                       #
+# ================================================== #
+def audit(osmfile, rules=None, backend='iterparse', max_values=MAX_VALUES,
+          sample_size=SAMPLE_SIZE):
+    """Return {key: ValueAudit} for every key with expected values"""
+    rules = cleaning.load_rules(rules)
+    audits = dict((key, ValueAudit(key, max_values, sample_size)) for key in rules.keys())
+    for key, value, element_type, element_id in iter_tag_values(osmfile, set(audits), backend):
+        part = rules.problem(key, value)
+        if part is not None:
+            audits[key].add(value, part, element_type, element_id)
+    return audits
+
+
+def write_report(audits, path, rules=None):
+    """Write the audit as JSON (with per-key summaries) or as CSV rows"""
+    rules = cleaning.load_rules(rules)
+    if path.endswith('.csv'):
+        with open(path, 'w', newline='', encoding='utf-8') as report:
+            writer = csv.DictWriter(report, REPORT_FIELDS)
+            writer.writeheader()
+            for key in sorted(audits):
+                for row in audits[key].rows(rules):
+                    row['element_ids'] = ' '.join(row['element_ids'])
+                    writer.writerow(row)
+    else:
+        with open(path, 'w', encoding='utf-8') as report:
+            json.dump([dict(audits[key].summary(), values=list(audits[key].rows(rules)))
+                       for key in sorted(audits)], report, ensure_ascii=False,
+                      separators=(',', ':'))
+
+
+def test():
+
+    audits = audit('example.osm')
+    assert sorted(audits) == ['addr:city', 'addr:postcode', 'addr:street']
+    assert all(a.total == 0 for a in audits.values())
+    assert sorted(audit('example.osm', backend='cache')) == sorted(audits)
+
+    # every backend finds the same problems in a file of addresses; relations are skipped
+    osm_file = os.path.join('fixtures', 'osm', 'addresses.osm')
+    found = {}
+    for backend in ('iterparse', 'scan', 'cache'):
+        audits = audit(osm_file, backend=backend)
+        found[backend] = dict((key, sorted((row['value'], row['part'], row['count'],
+                                            row['element_ids'])
+                                           for row in audits[key].rows(cleaning.load_rules())))
+                              for key in audits)
+    assert found['iterparse'] == found['scan'] == found['cache']
+    assert found['iterparse'] == {
+        'addr:street': [('Greenwood Ave.', 'Ave.', 1, ['way/9201']),
+                        ('NW Wall St', 'St', 2, ['node/9001', 'way/9202']),
+                        ('Reed Mkt Rd', 'Rd', 1, ['node/9003'])],
+        'addr:postcode': [('97702-1234', '97702-1234', 1, ['node/9002']),
+                          ('OR 97703', 'OR 97703', 1, ['node/9003'])],
+        'addr:city': [('Deschutes River Woods', 'Deschutes River Woods', 1, ['node/9003']),
+                      ('ch', 'ch', 1, ['node/9002'])]}
+
+    street = ValueAudit('addr:street', max_values=2, sample_size=1)
+    for i, name in enumerate(['NW Wall St', 'NW Wall St', 'Bond Rd', 'Reed Ln', 'NW Wall St']):
+        street.add(name, name.split()[-1], 'way', i)
+    assert street.total == 5 and street.summary()['parts'] == {'St': 2}
+    assert [(r['value'], r['count'], r['element_ids']) for r in street.rows(cleaning.load_rules())] == [
+        ('NW Wall St', 2, ['way/0'])]
+    assert street.undercount == 1
+
+
+if __name__ == "__main__":
+    if len(sys.argv) > 1:
+        rules = cleaning.load_rules(sys.argv[3] if len(sys.argv) > 3 else None)
+        write_report(audit(sys.argv[1], rules), sys.argv[2] if len(sys.argv) > 2 else 'audit.json',
+                     rules)
+    else:
+        test()
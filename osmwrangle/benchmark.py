@@ -0,0 +1,625 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Timing harness for the alternative processing engines.
+
+Each benchmark runs every candidate implementation on the same OSM file,
+checks that they all return the same result as the first (reference)
+candidate, and prints the best-of-N wall time, the throughput and the
+speedup over the reference.
+
+Usage:
+    python -m osmwrangle.benchmark BENCHMARK mapBend2.osm [repeat]
+  where BENCHMARK is one of activity, budget, cache, csv, frame, graph, index, scan, sinks,
+  tags, tiles, waynodes
+  (budget exits with 1 if a stage is slower than its BUDGETS throughput)
+"""
+import os
+import sys
+import time
+
+try:
+    import xml.etree.cElementTree as ET
+except ImportError:  # removed in Python 3.9
+    import xml.etree.ElementTree as ET
+
+
+def time_call(func, args=(), repeat=3):
+    """Return (best wall time, result) of calling func(*args) repeat times"""
+    best = None
+    result = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = func(*args)
+        elapsed = time.perf_counter() - start
+        if best is None or elapsed < best:
+            best = elapsed
+    return best, result
+
+
+def same(result, reference):
+    if hasattr(result, 'equals'):  # pandas objects
+        return result.equals(reference)
+    return result == reference
+
+
+def compare(title, candidates, filename, repeat=3):
+    """Time each (label, func) candidate on filename and check they agree
+
+    Returns a dictionary of label -> best time in seconds.
+    """
+    megabytes = os.path.getsize(filename) / 1e6
+    timings = {}
+    reference = None
+    print(title)
+    for label, func in candidates:
+        elapsed, result = time_call(func, (filename,), repeat)
+        if reference is None:
+            reference = (elapsed, result)
+        elif not same(result, reference[1]):
+            raise AssertionError("{0}: '{1}' disagrees with the reference".format(title, label))
+        timings[label] = elapsed
+        print("  {0:<20} {1:9.3f} s {2:9.1f} MB/s {3:7.2f}x".format(
+            label, elapsed, megabytes / elapsed if elapsed else float('inf'),
+            reference[0] / elapsed if elapsed else float('inf')))
+    return timings
+
+
+# Minimum throughput in MB/s of the input file per stage, checked by
+# `benchmark budget`.  About half of what a single core does on a 40 MB
+# extract, so only a real slowdown fails; small files are dominated by
+# startup costs and should not be used.
+BUDGETS = {
+    'count_tags scan': 20.0,
+    'key_type scan': 25.0,
+    'users scan': 25.0,
+    'shape': 4.0,
+    'csv export': 3.0,
+    'sqlite export': 3.0,
+}
+
+
+# ================================================== #
+#               Benchmarks                           #
+# ================================================== #
+def street_names_iterparse(filename):
+    """The audit loop: every addr:street value of nodes and ways
+
+    Uses 'end' events; on 'start' the children of an element may not have
+    been parsed yet, so the notebook's loop can miss tags.
+    """
+    names = []
+    for _, elem in ET.iterparse(filename):
+        if elem.tag == "node" or elem.tag == "way":
+            for tag in elem.iter("tag"):
+                if tag.attrib['k'] == "addr:street":
+                    names.append(tag.attrib['v'])
+            elem.clear()
+    return names
+
+
+def street_names_scan(filename):
+    from . import fastscan
+    return [fastscan.decode(v) for _, v in fastscan.iter_tag_values(filename, 'addr:street')]
+
+
+def bench_scan(filename, repeat=3):
+    """iterparse/ElementTree against the fastscan byte scanner"""
+    from . import mapparser
+    from . import tags
+    from . import users
+
+    compare('count_tags', [
+        ('ElementTree', mapparser.count_tags),
+        ('scan', lambda f: mapparser.count_tags(f, backend='scan')),
+    ], filename, repeat)
+    compare('tags.process_map', [
+        ('iterparse', tags.process_map),
+        ('scan', lambda f: tags.process_map(f, backend='scan')),
+    ], filename, repeat)
+    compare('users.process_map', [
+        ('iterparse', users.process_map),
+        ('scan', lambda f: users.process_map(f, backend='scan')),
+    ], filename, repeat)
+    compare('addr:street audit', [
+        ('iterparse', street_names_iterparse),
+        ('scan', street_names_scan),
+    ], filename, repeat)
+
+
+def bench_index(filename, repeat=3, lookups=1000):
+    """Fetching single elements: full iterparse against the offset index"""
+    from . import osmindex
+
+    elapsed, _ = time_call(osmindex.build_index, (filename,), 1)
+    print("build_index\n  {0:<20} {1:9.3f} s".format('one pass', elapsed))
+
+    with osmindex.OsmIndex(filename) as index:
+        ids = index.ids('node')
+        step = max(1, len(ids) // lookups)
+        wanted = [ids[i] for i in range(0, len(ids), step)][:lookups]
+
+    def with_iterparse(f):
+        remaining = set(str(i) for i in wanted)
+        found = {}
+        for _, elem in ET.iterparse(f):
+            if elem.tag == 'node' and elem.get('id') in remaining:
+                found[int(elem.get('id'))] = dict(elem.attrib)
+            if elem.tag in ('node', 'way', 'relation'):
+                elem.clear()
+        return [found[i] for i in wanted]
+
+    def with_index(f):
+        with osmindex.OsmIndex(f) as index:
+            return [dict(index.element('node', i).attrib) for i in wanted]
+
+    timings = compare('{0} node lookups'.format(len(wanted)), [
+        ('iterparse', with_iterparse),
+        ('index', with_index),
+    ], filename, repeat)
+    print("  {0:.1f} us per indexed lookup".format(1e6 * timings['index'] / len(wanted)))
+
+
+def bench_waynodes(filename, repeat=3):
+    """ways_nodes rows: one dict per node ref against a typed ref array per way"""
+    import csv
+    import io
+    from . import data
+
+    ways = list(data.get_element(filename, tags=('way',)))
+    refs = sum(len(way.findall('nd')) for way in ways)
+
+    def with_dicts(f):
+        output = io.StringIO()
+        writer = csv.DictWriter(output, data.WAY_NODES_FIELDS)
+        for way in ways:
+            writer.writerows(data.shape_element(way)['way_nodes'])
+        return output.getvalue()
+
+    def with_refs(f):
+        output = io.StringIO()
+        writer = csv.writer(output)
+        for way in ways:
+            el = data.shape_element(way, way_node_refs=True)
+            writer.writerows(data.way_node_rows(el['way']['id'], el[data.WAY_NODE_REFS]))
+        return output.getvalue()
+
+    compare('{0} ways, {1} node refs shaped and written'.format(len(ways), refs), [
+        ('dicts', with_dicts),
+        ('ref arrays', with_refs),
+    ], filename, repeat)
+
+
+def audit_rows(audits):
+    from . import rules
+    return dict((key, list(a.rows(rules.load_rules()))) for key, a in audits.items())
+
+
+def bench_cache(filename, repeat=3):
+    """Shaping every element: parse and shape against replaying the cache"""
+    from . import audit
+    from . import cache
+    from . import data
+
+    def build():
+        return sum(1 for _ in cache.shaped_elements(filename, refresh=True))
+
+    elapsed, _ = time_call(build, (), 1)
+    print("cache.shaped_elements\n  {0:<20} {1:9.3f} s".format('first run', elapsed))
+
+    compare('shaped elements', [
+        ('parse', lambda f: list(data.shaped_file(f))),
+        ('cache', lambda f: list(data.shaped_file(f, cache=True))),
+    ], filename, repeat)
+    compare('audit', [
+        ('iterparse', lambda f: audit_rows(audit.audit(f))),
+        ('cache', lambda f: audit_rows(audit.audit(f, backend='cache'))),
+    ], filename, repeat)
+
+
+def bench_csv(filename, repeat=3):
+    """Writing the shaped rows: a rebuilt dict per row and DictWriter against RowWriter"""
+    import csv
+    import io
+    from . import data
+
+    class RebuildingDictWriter(csv.DictWriter):
+        # the Python 2 UnicodeDictWriter's per-row work, minus the encode
+        def writerow(self, row):
+            return super(RebuildingDictWriter, self).writerow(
+                dict((k, v) for k, v in row.items()))
+
+        def writerows(self, rows):
+            for row in rows:
+                self.writerow(row)
+
+    tables = [(fields, key) for _, _, fields, key in data.TABLES if key != 'way_nodes']
+    shaped = list(data.shaped_file(filename))
+    rows = sum(len(el[key]) if isinstance(el.get(key), list) else 1
+               for el in shaped for _, key in tables if key in el)
+
+    def write(writer_class):
+        outputs = dict((key, io.StringIO()) for _, key in tables)
+        writers = dict((key, writer_class(outputs[key], fields)) for fields, key in tables)
+        for el in shaped:
+            for key, value in el.items():
+                if key in writers:
+                    if isinstance(value, dict):
+                        writers[key].writerow(value)
+                    else:
+                        writers[key].writerows(value)
+        return [outputs[key].getvalue() for _, key in tables]
+
+    compare('{0} rows written'.format(rows), [
+        ('rebuilt dicts', lambda f: write(RebuildingDictWriter)),
+        ('DictWriter', lambda f: write(csv.DictWriter)),
+        ('RowWriter', lambda f: write(data.RowWriter)),
+    ], filename, repeat)
+
+
+def bench_frame(filename, repeat=3):
+    """Loading the tag tables into DataFrames: fetchall against analysis.query_frame"""
+    import shutil
+    import tempfile
+    import pandas as pd
+    from . import analysis
+    from . import database
+
+    tempdir = tempfile.mkdtemp()
+    try:
+        db = database.export_db(filename, os.path.join(tempdir, 'bench.db'))
+        query = 'SELECT * FROM nodes_tags UNION ALL SELECT * FROM ways_tags'
+
+        def fetchall(f):
+            cursor = db.execute(query)
+            columns = [description[0] for description in cursor.description]
+            rows = cursor.fetchall()
+            return pd.DataFrame(rows, columns=columns, index=pd.RangeIndex(1, len(rows) + 1))
+
+        compare('tag rows into a DataFrame', [
+            ('fetchall', fetchall),
+            ('query_frame', lambda f: analysis.query_frame(db, query)),
+        ], filename, repeat)
+        db.close()
+    finally:
+        shutil.rmtree(tempdir)
+
+
+def dijkstra_dicts(adjacency, source):
+    # the same search over a {vertex: [(target, weight)]} dictionary
+    import heapq
+    costs = {source: 0.0}
+    heap = [(0.0, source)]
+    while heap:
+        cost, v = heapq.heappop(heap)
+        if cost > costs[v]:
+            continue
+        for u, weight in adjacency.get(v, ()):
+            reached = cost + weight
+            if reached < costs.get(u, float('inf')):
+                costs[u] = reached
+                heapq.heappush(heap, (reached, u))
+    return costs
+
+
+def bench_graph(filename, repeat=3, sources=50):
+    """Shortest paths from the best connected vertices: dictionaries against graph.Graph"""
+    import shutil
+    import tempfile
+    import numpy as np
+    from . import database
+    from . import graph
+
+    tempdir = tempfile.mkdtemp()
+    try:
+        db = database.export_db(filename, os.path.join(tempdir, 'bench.db'))
+        elapsed, routes = time_call(graph.build_graph, (db,), 1)
+        db.close()
+        print("graph.build_graph\n  {0:<20} {1:9.3f} s  {2} vertices, {3} edges".format(
+            'build', elapsed, len(routes), routes.edges))
+    finally:
+        shutil.rmtree(tempdir)
+
+    starts = np.argsort(-np.diff(routes.indptr), kind='stable')[:sources]
+    start_ids = [int(routes.node_ids[v]) for v in starts]
+    adjacency = {}
+    for v in range(len(routes)):
+        edges = range(routes.indptr[v], routes.indptr[v + 1])
+        adjacency[v] = [(int(routes.indices[e]), float(routes.lengths[e])) for e in edges]
+
+    def reached(costs):
+        return round(float(sum(costs)), 6)
+
+    compare('dijkstra from {0} vertices'.format(len(starts)), [
+        ('dicts', lambda f: [reached(dijkstra_dicts(adjacency, int(v)).values()) for v in starts]),
+        ('csr arrays', lambda f: [reached(costs[np.isfinite(costs)])
+                                  for costs in (routes.dijkstra(v)[0] for v in start_ids)]),
+    ], filename, repeat)
+
+
+def shape_tag_inline(element_id, child, problem_chars, lower_colon, default_tag_type='regular'):
+    # the per-tag code of shape_element's node branch before data.shape_tag
+    tags_dict = {}
+    k_attrib = child.get('k')
+    v_attrib = child.get('v')
+    a_problem = problem_chars.search(k_attrib)
+    tags_dict['id'] = element_id
+    tags_dict['value'] = v_attrib
+    if a_problem == None:
+        colon = lower_colon.search(k_attrib)
+        if colon != None:
+            k_attrib_list = k_attrib.split(':', 1)
+            tags_dict['key'] = k_attrib_list[1]
+            tags_dict['type'] = k_attrib_list[0]
+        else:
+            tags_dict['key'] = k_attrib
+            tags_dict['type'] = default_tag_type
+        return tags_dict
+    return None
+
+
+def bench_tags(filename, repeat=3):
+    """Shaping the <tag> rows: the inline regex splits against the memoized data.tag_key"""
+    from . import data
+    from . import tags
+
+    children = []
+    for element in data.get_element(filename, tags=('node', 'way')):
+        element_id = int(element.get('id'))
+        children.extend((element_id, child) for child in element if child.tag == 'tag')
+    keys = [child.get('k') for _, child in children]
+
+    def per_tag(timings):
+        for label, elapsed in sorted(timings.items(), key=lambda item: -item[1]):
+            print("  {0:<20} {1:9.0f} ns/tag".format(label, elapsed / max(len(children), 1) * 1e9))
+
+    problem_chars, lower_colon = data.PROBLEMCHARS, data.LOWER_COLON
+    per_tag(compare('{0} tags shaped'.format(len(children)), [
+        ('inline', lambda f: [shape_tag_inline(i, child, problem_chars, lower_colon)
+                              for i, child in children]),
+        ('shape_tag', lambda f: [data.shape_tag(i, child) for i, child in children]),
+    ], filename, repeat))
+
+    def classify(classify_key):
+        counts = {"lower": 0, "lower_colon": 0, "problemchars": 0, "other": 0}
+        for k in keys:
+            classify_key(k, counts)
+        return counts
+
+    def classify_regex(k_attrib, keys):
+        # tags.classify_key before data.tag_key
+        result_lower = tags.lower.match(k_attrib)
+        result_lower_colon = tags.lower_colon.match(k_attrib)
+        result_problemchars = tags.problemchars.match(k_attrib)
+        if result_lower:
+            keys['lower'] += 1
+        if result_lower_colon:
+            keys['lower_colon'] += 1
+        if result_problemchars:
+            keys['problemchars'] += 1
+        if not result_lower and not result_lower_colon and not result_problemchars:
+            keys['other'] += 1
+        return keys
+
+    per_tag(compare('{0} tag keys classified'.format(len(keys)), [
+        ('regex', lambda f: classify(classify_regex)),
+        ('tag_key', lambda f: classify(tags.classify_key)),
+    ], filename, repeat))
+
+
+def tiles_dicts(shaped, zooms):
+    """Per-tile counts with the tile of every element computed and counted one at a time"""
+    import math
+    from . import data
+    from . import tiles
+    counts = {}
+    located = {}
+    for el in shaped:
+        if 'node' in el:
+            node = el['node']
+            lat = math.radians(min(max(node['lat'], -tiles.MAX_LAT), tiles.MAX_LAT))
+            x = (node['lon'] + 180.0) / 360.0
+            y = (1.0 - math.asinh(math.tan(lat)) / math.pi) / 2.0
+            located[node['id']] = (x, y)
+            flags = tiles.NODE | tiles.tag_flags(el['node_tags'])
+        else:
+            refs = el[data.WAY_NODE_REFS]
+            if not len(refs) or refs[0] not in located:
+                continue
+            x, y = located[refs[0]]
+            flags = tiles.WAY | tiles.tag_flags(el['way_tags'])
+        for zoom in zooms:
+            n = 1 << zoom
+            key = (zoom, min(int(x * n), n - 1), min(int(y * n), n - 1))
+            row = counts.get(key)
+            if row is None:
+                row = counts[key] = [0, 0, 0, 0]
+            for column in range(4):
+                row[column] += (flags >> column) & 1
+    return [key + tuple(row) for key, row in sorted(counts.items())]
+
+
+def bench_tiles(filename, repeat=3):
+    """Per-tile counts of the shaped elements: one element at a time against TileAggregator"""
+    from . import data
+    from . import tiles
+    shaped = list(data.shaped_file(filename))
+
+    def aggregate(f):
+        aggregator = tiles.TileAggregator()
+        for el in shaped:
+            aggregator.write(el)
+        return list(aggregator.rows())
+
+    compare('tile counts of {0} elements at zooms {1}'.format(len(shaped), tiles.ZOOMS), [
+        ('per element', lambda f: tiles_dicts(shaped, tiles.ZOOMS)),
+        ('numpy batches', aggregate),
+    ], filename, repeat)
+
+
+def bench_sinks(filename, repeat=3):
+    """The csv(s), a database and a column directory: one export each against one pass"""
+    import shutil
+    import tempfile
+    from . import columnar
+    from . import data
+    from . import database
+    from . import sinks
+
+    tempdir = tempfile.mkdtemp()
+    db_path = os.path.join(tempdir, 'bench.db')
+    columns = os.path.join(tempdir, 'columns')
+
+    def fresh_db():
+        if os.path.exists(db_path):
+            os.remove(db_path)  # time a new database, not dropping the last export
+
+    def rows():
+        manifest = columnar.read_manifest(columns)
+        return sorted((table, info['rows']) for table, info in manifest['tables'].items())
+
+    def separate(f):
+        fresh_db()
+        data.process_map(f, False, output_dir=tempdir)
+        database.export_db(f, db_path).close()
+        columnar.export_columns(f, columns)
+        return rows()
+
+    def fanout(f):
+        fresh_db()
+        data.process_map(f, False, output_dir=tempdir,
+                         sinks=[sinks.DatabaseSink(db_path), columnar.ColumnarWriter(columns)])
+        return rows()
+
+    try:
+        compare('csv(s) + sqlite + columns', [
+            ('three exports', separate),
+            ('one pass, sinks', fanout),
+        ], filename, repeat)
+    finally:
+        shutil.rmtree(tempdir)
+
+
+SCAN_CONTRIBUTORS = '''
+SELECT user, COUNT(*) AS edits
+FROM (SELECT uid, user FROM nodes UNION ALL SELECT uid, user FROM ways)
+GROUP BY uid ORDER BY edits DESC, uid LIMIT 10;
+'''
+
+SCAN_CHANGESETS = '''
+SELECT changeset, COUNT(*) AS edits
+FROM (SELECT changeset, uid FROM nodes UNION ALL SELECT changeset, uid FROM ways)
+GROUP BY changeset, uid ORDER BY edits DESC, changeset LIMIT 10;
+'''
+
+
+def bench_activity(filename, repeat=3):
+    """Top contributors and largest changesets: scans of nodes and ways against activity.py"""
+    import shutil
+    import tempfile
+    from . import activity
+    from . import database
+
+    tempdir = tempfile.mkdtemp()
+    try:
+        db_path = os.path.join(tempdir, 'bench.db')
+        index = activity.ActivityIndex(db_path)
+        elapsed, _ = time_call(database.export_db, (filename, db_path), 1)
+        print("database.export_db\n  {0:<20} {1:9.3f} s".format('without index', elapsed))
+        os.remove(db_path)
+        elapsed, db = time_call(lambda: database.export_db(filename, db_path, sinks=[index]), (),
+                                1)
+        print("  {0:<20} {1:9.3f} s  {2} changesets".format('with ActivityIndex', elapsed,
+                                                              len(index.changesets)))
+
+        def scans(f):
+            return (db.execute(SCAN_CONTRIBUTORS).fetchall(),
+                    db.execute(SCAN_CHANGESETS).fetchall())
+
+        def tables(f):
+            return (activity.top_contributors(db),
+                    [(changeset, nodes + ways) for changeset, _, nodes, ways in
+                     activity.largest_changesets(db)])
+
+        compare('top contributors and changesets', [
+            ('group by scans', scans),
+            ('activity tables', tables),
+        ], filename, repeat)
+        db.close()
+    finally:
+        shutil.rmtree(tempdir)
+
+
+def budget_stages(filename, directory):
+    """[(stage, func)] of the stages in BUDGETS, writing their output into directory"""
+    from . import data
+    from . import database
+    from . import mapparser
+    from . import tags
+    from . import users
+
+    def sqlite_export(f):
+        db_path = os.path.join(directory, 'budget.db')
+        if os.path.exists(db_path):
+            os.remove(db_path)  # time a new database, not dropping the last export
+        database.export_db(f, db_path).close()
+
+    return [
+        ('count_tags scan', lambda f: mapparser.count_tags(f, backend='scan')),
+        ('key_type scan', lambda f: tags.process_map(f, backend='scan')),
+        ('users scan', lambda f: users.process_map(f, backend='scan')),
+        ('shape', lambda f: sum(1 for _ in data.shaped_file(f))),
+        ('csv export', lambda f: data.process_map(f, False, output_dir=directory)),
+        ('sqlite export', sqlite_export),
+    ]
+
+
+def bench_budget(filename, repeat=3, budgets=None):
+    """Check every stage against its throughput budget; return the stages that miss it"""
+    import shutil
+    import tempfile
+    budgets = budgets or BUDGETS
+    megabytes = os.path.getsize(filename) / 1e6
+    failed = []
+    tempdir = tempfile.mkdtemp()
+    try:
+        print('throughput budgets ({0:.1f} MB)'.format(megabytes))
+        for stage, func in budget_stages(filename, tempdir):
+            elapsed, _ = time_call(func, (filename,), repeat)
+            throughput = megabytes / elapsed if elapsed else float('inf')
+            ok = throughput >= budgets[stage]
+            if not ok:
+                failed.append(stage)
+            print("  {0:<20} {1:9.3f} s {2:9.1f} MB/s  budget {3:6.1f}  {4}".format(
+                stage, elapsed, throughput, budgets[stage], 'ok' if ok else 'SLOW'))
+    finally:
+        shutil.rmtree(tempdir)
+    return failed
+
+
+BENCHMARKS = {
+    'activity': bench_activity,
+    'budget': bench_budget,
+    'cache': bench_cache,
+    'csv': bench_csv,
+    'frame': bench_frame,
+    'graph': bench_graph,
+    'index': bench_index,
+    'scan': bench_scan,
+    'sinks': bench_sinks,
+    'tags': bench_tags,
+    'tiles': bench_tiles,
+    'waynodes': bench_waynodes,
+}
+
+
+def main(argv):
+    if len(argv) < 2 or argv[0] not in BENCHMARKS:
+        print("usage: benchmark.py {{{0}}} FILE [repeat]".format(','.join(sorted(BENCHMARKS))))
+        return 2
+    repeat = int(argv[2]) if len(argv) > 2 else 3
+    return 1 if BENCHMARKS[argv[0]](argv[1], repeat) else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,273 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Persistent cache of the shaped element stream of an OSM file.
+
+Parsing the XML and running shape_element is most of the cost of every
+export and audit.  shaped_elements stores the stream it produces (the
+output of data.shape_elements) in a cache file the first time, and later
+runs replay it from there instead of re-parsing mapBend2.osm.
+
+A cache file belongs to one input and one way of shaping it.  Its name
+holds a hash of the absolute path of the OSM file, a source key hashed
+from
+
+- the absolute path, size and mtime of the OSM file,
+- a SHA-1 of the first HASH_PREFIX bytes of the file,
+- PIPELINE_VERSION (bump it whenever shape_element's output changes),
+
+and a variant: the digest of the cleaning rules (see rules.RuleSet), or
+'raw'.  Any change gives a new name, so a stale cache is never read; the
+caches of older versions of the same file (same path hash) are deleted
+once a new one is complete.
+
+The file is a stream of records, each a uint32 length followed by a
+marshal dump of a list of up to CHUNK_SIZE shaped elements (way node ref
+arrays stored as bytes).  marshal is the fastest serializer in the
+standard library and the cache is only ever read by the Python that wrote
+it.  It is written to a temporary file and renamed when the stream has
+been read to the end, so an interrupted run leaves no partial cache.
+Each chunk is dumped before its elements are handed on, so what a
+consumer does to them (address fixes, say) never reaches the cache.
+
+Usage:
+    python -m osmwrangle.cache mapBend2.osm      # build (or check) the cache
+"""
+import hashlib
+import marshal
+import os
+import struct
+import sys
+from array import array
+
+from . import data
+
+
+PIPELINE_VERSION = 2
+HASH_PREFIX = 1 << 20  # bytes of the input hashed into the key
+CHUNK_SIZE = 1024      # shaped elements per record
+CACHE_DIR = '.osmcache'
+SUFFIX = '.shaped'
+
+MAGIC = b'OSMSHAPED1\n'
+LENGTH = struct.Struct('<I')
+
+
+# ================================================== #
+#               Helper Functions                     #
+# ================================================== #
+def cache_key(osm_file, rules=None):
+    """Return (source key, variant) of the cache of osm_file shaped with rules
+
+    The source key changes with the input file and the pipeline version,
+    the variant with the cleaning rules.
+    """
+    path = os.path.abspath(osm_file)
+    stat = os.stat(path)
+    prefix = hashlib.sha1()
+    with open(path, 'rb') as source:
+        prefix.update(source.read(HASH_PREFIX))
+    parts = [path, str(stat.st_size), str(stat.st_mtime_ns), prefix.hexdigest(),
+             str(PIPELINE_VERSION), sys.byteorder, str(marshal.version)]
+    source_key = hashlib.sha1('\0'.join(parts).encode('utf-8')).hexdigest()[:16]
+    return source_key, rules.digest[:8] if rules is not None else 'raw'
+
+
+def cache_path(osm_file, key, cache_dir=None):
+    """<cache dir>/<file name>.<path hash>.<source key>.<variant>.shaped"""
+    path = os.path.abspath(osm_file)
+    if cache_dir is None:
+        cache_dir = os.path.join(os.path.dirname(path), CACHE_DIR)
+    path_hash = hashlib.sha1(path.encode('utf-8')).hexdigest()[:8]
+    return os.path.join(cache_dir, '{0}.{1}.{2}.{3}{4}'.format(os.path.basename(path), path_hash,
+                                                             key[0], key[1], SUFFIX))
+
+
+def header_line(key):
+    return '{0} {1}\n'.format(*key).encode('ascii')
+
+
+def dump_chunk(output, chunk):
+    records = []
+    for el in chunk:
+        refs = el.get(data.WAY_NODE_REFS)
+        if refs is not None:
+            el = dict(el)
+            el[data.WAY_NODE_REFS] = refs.tobytes()
+        records.append(el)
+    payload = marshal.dumps(records)
+    output.write(LENGTH.pack(len(payload)))
+    output.write(payload)
+
+
+def replay(path, key):
+    """Yield the shaped elements stored in a cache file"""
+    with open(path, 'rb') as cached:
+        if cached.readline() != MAGIC or cached.readline() != header_line(key):
+            raise ValueError("{0} is not the cache of this input".format(path))
+        read = cached.read
+        while True:
+            length = read(LENGTH.size)
+            if not length:
+                return
+            for el in marshal.loads(read(LENGTH.unpack(length)[0])):
+                refs = el.get(data.WAY_NODE_REFS)
+                if refs is not None:
+                    el[data.WAY_NODE_REFS] = array('q', refs)
+                yield el
+
+
+def record(shaped, path, key, quarantine=None):
+    """Yield the elements of shaped, writing them to the cache file as they pass
+
+    A chunk is written before its elements are yielded, so the cache holds
+    them as shaped even if the consumer changes them.  A stream that lost
+    elements to the quarantine (see data.shape_elements) is not kept.
+    """
+    unshaped = quarantine.unshaped if quarantine is not None else 0
+    directory = os.path.dirname(path)
+    if not os.path.isdir(directory):
+        os.makedirs(directory)
+    partial = '{0}.{1}.tmp'.format(path, os.getpid())
+    complete = False
+    try:
+        with open(partial, 'wb') as output:
+            output.write(MAGIC + header_line(key))
+            chunk = []
+            for el in shaped:
+                chunk.append(el)
+                if len(chunk) >= CHUNK_SIZE:
+                    dump_chunk(output, chunk)
+                    for dumped in chunk:
+                        yield dumped
+                    chunk = []
+            if chunk:
+                dump_chunk(output, chunk)
+                for dumped in chunk:
+                    yield dumped
+        if quarantine is not None and quarantine.unshaped != unshaped:
+            return
+        os.replace(partial, path)
+        complete = True
+    finally:
+        if not complete and os.path.exists(partial):
+            os.remove(partial)
+    prune(path)
+
+
+def name_parts(name):
+    """Return (base, path hash, source key, variant) of a cache file name, or None
+
+    None for a .shaped file that is not named like one (another format).
+    """
+    parts = name[:-len(SUFFIX)].rsplit('.', 3)
+    return tuple(parts) if len(parts) == 4 else None
+
+
+def prune(path):
+    """Delete the caches of earlier versions of the same input file (same path hash)"""
+    directory, name = os.path.split(path)
+    base, path_hash, source_key, _ = name_parts(name)
+    for other in os.listdir(directory):
+        parts = name_parts(other) if other.endswith(SUFFIX) else None
+        if parts is not None and parts[:2] == (base, path_hash) and parts[2] != source_key:
+            os.remove(os.path.join(directory, other))
+
+
+# ================================================== #
+#               Main Function                        #
+# ================================================== #
+def shaped_elements(osm_file, rules=None, cache_dir=None, refresh=False, quarantine=None):
+    """Yield the shaped nodes and ways of osm_file, from the cache when it is current
+
+    rules is a rules.RuleSet (or None); refresh=True re-parses and rewrites
+    the cache.  quarantine takes the elements that cannot be shaped; a file
+    with any is not cached.
+    """
+    key = cache_key(osm_file, rules)
+    path = cache_path(osm_file, key, cache_dir)
+    if os.path.exists(path) and not refresh:
+        return replay(path, key)
+    shaped = data.shape_elements(data.get_element(osm_file, tags=('node', 'way')), rules,
+                                 quarantine=quarantine)
+    return record(shaped, path, key, quarantine)
+
+
+def test():
+
+    import shutil
+    import tempfile
+    try:
+        import xml.etree.cElementTree as ET
+    except ImportError:  # removed in Python 3.9
+        import xml.etree.ElementTree as ET
+    from . import rules as cleaning
+    from . import address
+    directory = tempfile.mkdtemp()
+    try:
+        parsed = list(data.shape_elements(data.get_element('example.osm', tags=('node', 'way'))))
+        assert list(shaped_elements('example.osm', cache_dir=directory)) == parsed
+        assert len(os.listdir(directory)) == 1
+        assert list(shaped_elements('example.osm', cache_dir=directory)) == parsed
+
+        # a partial read writes nothing; a different rule set is another cache
+        rules = cleaning.load_rules()
+        clean = shaped_elements('example.osm', rules, cache_dir=directory)
+        next(clean)
+        clean.close()
+        assert len(os.listdir(directory)) == 1
+        list(shaped_elements('example.osm', rules, cache_dir=directory))
+        assert len(os.listdir(directory)) == 2
+
+        # what the consumer of a recording run changes is not cached
+        for el in shaped_elements('example.osm', cache_dir=directory, refresh=True):
+            for tag in el.get('node_tags', el.get('way_tags')):
+                tag['value'] = 'changed'
+            el['node' if 'node' in el else 'way']['user'] = 'changed'
+        assert list(shaped_elements('example.osm', cache_dir=directory)) == parsed
+
+        # a file of the same name elsewhere keeps its own cache in a shared cache dir
+        other = os.path.join(directory, 'other')
+        os.makedirs(other)
+        shutil.copyfile('example.osm', os.path.join(other, 'example.osm'))
+        list(shaped_elements(os.path.join(other, 'example.osm'), cache_dir=directory))
+        assert len(os.listdir(directory)) == 4
+
+        # foreign .shaped files (an earlier format, an input without extension) are kept
+        foreign = ['map.85de090374aa9930.raw.shaped', 'notes.shaped']
+        for name in foreign:
+            open(os.path.join(directory, name), 'wb').close()
+        assert list(shaped_elements('example.osm', cache_dir=directory, refresh=True)) == parsed
+        assert len(os.listdir(directory)) == 6
+        for name in foreign:
+            os.remove(os.path.join(directory, name))
+
+        # an export with address fixes, then one without, from the same cache
+        tree = ET.parse('example.osm')
+        node = tree.getroot().find('node')
+        ET.SubElement(node, 'tag', {'k': 'addr:postcode', 'v': 'OR 97702'})
+        ET.SubElement(node, 'tag', {'k': 'addr:city', 'v': 'BEND'})
+        osm_file = os.path.join(other, 'addresses.osm')
+        tree.write(osm_file, encoding='utf-8')
+        outputs = {}
+        for name, options in (('fixed', {'cache': True, 'addresses': address.AddressValidator()}),
+                              ('cached', {'cache': True}), ('parsed', {})):
+            outputs[name] = os.path.join(other, name)
+            os.makedirs(outputs[name])
+            data.process_map(osm_file, False, output_dir=outputs[name], **options)
+
+        def values(name):
+            with open(os.path.join(outputs[name], data.NODE_TAGS_PATH), encoding='utf-8') as tags:
+                return [line.split(',')[2] for line in tags if ',addr' in line]
+        assert values('fixed') == ['97702', 'Bend']
+        assert values('cached') == values('parsed') == ['OR 97702', 'BEND']
+    finally:
+        shutil.rmtree(directory)
+
+
+if __name__ == "__main__":
+    if len(sys.argv) > 1:
+        count = sum(1 for _ in shaped_elements(sys.argv[1]))
+        print('{0} shaped elements cached'.format(count))
+    else:
+        test()
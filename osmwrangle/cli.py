@@ -0,0 +1,347 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Command line interface: python -m osmwrangle <command> ...
+
+    count FILE               count of every XML tag name (mapparser.py)
+    users FILE               number of distinct contributing uids (users.py)
+    keys FILE                tag keys per category (tags.py)
+    audit FILE               audit report of the cleaning rules (audit.py)
+    sample FILE OUT          every k-th top level element (sample.py)
+    export FILE              csv(s), SQLite database or column files, or several of them
+                             in one pass (data.py, database.py, columnar.py, sinks.py)
+    regions FILE...          export regions side by side, optionally merged (regions.py)
+    report DB KIND           reports over the database (reports.py, activity.py)
+    search DB TEXT           full-text search of names, streets, ... (search.py)
+    graph DB DIR             road graph of the highway ways (graph.py)
+    route DIR FROM TO        shortest route between two nodes of a saved graph
+
+Each command imports only the modules it runs, so no command pays for the
+dependencies of another.  Results are printed as JSON or CSV lines.
+"""
+import argparse
+import json
+import os
+import sys
+
+
+def print_json(value):
+    json.dump(value, sys.stdout, indent=1, sort_keys=True, ensure_ascii=False)
+    sys.stdout.write('\n')
+
+
+def load_rules(args):
+    if args.rules is None:
+        return None
+    return True if args.rules == 'default' else args.rules
+
+
+# ================================================== #
+#               Commands                             #
+# ================================================== #
+def run_count(args):
+    from . import mapparser
+    print_json(mapparser.count_tags(args.file, backend=args.backend))
+
+
+def run_users(args):
+    from . import users
+    uids = users.process_map(args.file, backend=args.backend)
+    print_json(sorted(uids, key=int) if args.list else len(uids))
+
+
+def run_keys(args):
+    from . import tags
+    print_json(tags.process_map(args.file, backend=args.backend))
+
+
+def run_audit(args):
+    from . import audit
+    from . import rules as cleaning
+    rules = cleaning.load_rules(args.rules)
+    audits = audit.audit(args.file, rules, backend=args.backend, max_values=args.max_values)
+    audit.write_report(audits, args.report, rules)
+    print_json([dict((k, v) for k, v in audits[key].summary().items() if k != 'parts')
+                for key in sorted(audits)])
+
+
+def run_sample(args):
+    from . import sample
+    print_json(sample.write_sample(args.file, args.output, args.k))
+
+
+def run_export(args):
+    checker = None
+    if args.check:
+        from . import integrity
+        checker = integrity.IntegrityChecker(integrity.read_bounds(args.file))
+    area = None
+    if args.bbox:
+        from . import clip
+        area = clip.AreaFilter(args.bbox, clip_ways=args.clip_ways)
+    addresses = None
+    if args.addresses:
+        from . import address
+        addresses = address.AddressValidator(None if args.addresses == 'default' else
+                                             args.addresses, plus4=not args.zip5)
+    quarantine = None
+    if args.quarantine:
+        from . import quarantine as tolerant
+        quarantine = tolerant.Quarantine(args.quarantine)
+    tiles = None
+    if args.tiles is not None:
+        from . import tiles as density
+        tiles = density.TileAggregator(args.tiles or density.ZOOMS)
+    sinks = []
+    summaries = []
+    if args.sink:
+        from . import sinks as fanout
+        sinks = [fanout.open_sink(spec, args.encoded, args.search) for spec in args.sink]
+        summaries = [sink for sink in sinks
+                     if isinstance(sink, fanout.Summary) and sink.path is None]
+    activity = None
+    if args.activity is not None:
+        from . import activity as changesets
+        from . import database
+        exported = (args.output or database.DB_PATH) if args.to == 'sqlite' else 'activity.db'
+        activity = changesets.ActivityIndex(args.activity or exported, os.path.abspath(args.file))
+        sinks.append(activity)
+    options = dict(rules=load_rules(args), checker=checker, area=area, cache=args.cache,
+                   addresses=addresses, quarantine=quarantine, tiles=tiles, sinks=sinks)
+    validate = args.validate or quarantine is not None
+
+    if args.to == 'sqlite':
+        from . import database
+        database.export_db(args.file, args.output or database.DB_PATH, validate,
+                           encoded=args.encoded, search=args.search, **options).close()
+    elif args.to == 'columns':
+        from . import columnar
+        columnar.export_columns(args.file, args.output or 'columns', validate, **options)
+    else:
+        from . import data
+        output_dir = args.output or '.'
+        if not os.path.isdir(output_dir):
+            os.makedirs(output_dir)
+        data.process_map(args.file, validate, pipelined=args.pipelined, output_dir=output_dir,
+                         **options)
+
+    if addresses is not None:
+        print_json(addresses.report())
+    if quarantine is not None:
+        print_json(quarantine.report())
+    if tiles is not None:
+        print_json(tiles.report())
+    for summary in summaries:
+        print_json(summary.report())
+    if activity is not None:
+        print_json(activity.report())
+    if checker is not None:
+        print_json(checker.report())
+        return 0 if checker.ok() else 1
+
+
+def run_regions(args):
+    from . import regions
+    exported = regions.export_regions(args.files, args.output, args.to, args.processes,
+                                      validate=args.validate, rules=load_rules(args))
+    result = {'regions': [{'file': f, 'path': path, 'seconds': round(seconds, 3)}
+                          for f, path, seconds in exported]}
+    if args.merge:
+        result['merged'] = regions.merge([path for _, path, _ in exported], args.merge)
+    print_json(result)
+
+
+def run_graph(args):
+    from . import database
+    from . import graph
+    routes = graph.build_graph(database.open_db(args.db))
+    routes.save(args.output)
+    print_json({'vertices': len(routes), 'edges': routes.edges})
+
+
+def run_route(args):
+    from . import graph
+    routes = graph.load_graph(args.graph)
+    if args.within is not None:
+        reached = routes.reachable(args.source, args.within, args.weight)
+        print_json([int(node_id) for node_id in reached])
+        return
+    if args.target is None:
+        sys.stderr.write('route: give a target node or --within\n')
+        return 2
+    cost, path = routes.route(args.source, args.target, args.weight)
+    print_json({args.weight: cost if path else None, 'nodes': path})
+
+
+def run_report(args):
+    from . import database
+    from . import reports
+    db = database.open_db(args.db)
+    if args.kind == 'changesets':
+        from . import activity
+        if args.uid is not None:
+            print('id,uid,user,nodes,ways,minlat,minlon,maxlat,maxlon,first_timestamp,'
+                  'last_timestamp')
+            rows = activity.user_changesets(db, args.uid)
+        else:
+            print('id,user,nodes,ways')
+            rows = activity.largest_changesets(db, args.limit)
+    elif args.kind == 'contributors':
+        from . import activity
+        print('user,edits')
+        rows = activity.top_contributors(db, args.limit)
+    elif args.kind == 'users':
+        print('user,month,edits')
+        rows = reports.edits_per_user_per_month(db, args.start, args.end)
+    elif args.kind == 'keys':
+        print('key,count')
+        rows = reports.tag_key_counts(db, args.element, args.limit)
+    else:
+        print('month,nodes,ways,total')
+        rows = reports.growth_by_month(db, args.start, args.end)
+    for row in rows:
+        print(','.join(str(value) for value in row))
+
+
+def run_search(args):
+    from . import database
+    from . import search
+    print('element,id,{0},score'.format(','.join(search.COLUMNS)))
+    for row in search.search(database.open_db(args.db), args.text, args.column, args.element,
+                             not args.exact, args.limit):
+        print(','.join('' if value is None else str(value) for value in row))
+
+
+# ================================================== #
+#               Main Function                        #
+# ================================================== #
+def parser():
+    main_parser = argparse.ArgumentParser(prog='osmwrangle',
+                                          description='Wrangle OpenStreetMap XML data.')
+    commands = main_parser.add_subparsers(dest='command', metavar='command')
+    commands.required = True
+
+    def command(name, run, help):
+        sub = commands.add_parser(name, help=help, description=help)
+        sub.set_defaults(run=run)
+        return sub
+
+    scan = dict(choices=['iterparse', 'scan'], default='iterparse',
+                help="parse with iterparse or the fastscan byte scanner")
+
+    sub = command('count', run_count, 'count the XML tags of an OSM file')
+    sub.add_argument('file')
+    sub.add_argument('--backend', **scan)
+
+    sub = command('users', run_users, 'count the distinct contributors of an OSM file')
+    sub.add_argument('file')
+    sub.add_argument('--backend', **scan)
+    sub.add_argument('--list', action='store_true', help="print the uids instead of their number")
+
+    sub = command('keys', run_keys, 'count the tag keys per category (lower, lower_colon, ...)')
+    sub.add_argument('file')
+    sub.add_argument('--backend', **scan)
+
+    sub = command('audit', run_audit, 'audit the tag values against the cleaning rules')
+    sub.add_argument('file')
+    sub.add_argument('--report', default='audit.json', help="report path, .json or .csv")
+    sub.add_argument('--rules', help="cleaning rules config (default: cleaning_rules.json)")
+    sub.add_argument('--backend', choices=['iterparse', 'scan', 'cache'], default='iterparse')
+    sub.add_argument('--max-values', type=int, default=10000,
+                     help="distinct values tracked per key")
+
+    sub = command('sample', run_sample, 'write every k-th top level element to a smaller file')
+    sub.add_argument('file')
+    sub.add_argument('output')
+    sub.add_argument('-k', type=int, default=10)
+
+    sub = command('export', run_export, 'shape the nodes and ways into csv(s), SQLite or columns')
+    sub.add_argument('file')
+    sub.add_argument('--to', choices=['csv', 'sqlite', 'columns'], default='csv',
+                     help="csv(s), a database or a column directory")
+    sub.add_argument('--output', help="csv directory (default: the current directory), "
+                                      "database path or column directory")
+    sub.add_argument('--validate', action='store_true', help="validate against the schema")
+    sub.add_argument('--quarantine', metavar='PATH',
+                     help="validate, writing invalid elements to this JSON lines file "
+                          "instead of stopping")
+    sub.add_argument('--rules', nargs='?', const='default',
+                     help="clean the tag values (optionally with this rules config)")
+    sub.add_argument('--bbox', type=float, nargs=4,
+                     metavar=('MINLAT', 'MINLON', 'MAXLAT', 'MAXLON'),
+                     help="only export the nodes in this box and the ways that touch them")
+    sub.add_argument('--clip-ways', action='store_true',
+                     help="with --bbox, drop the refs of ways to nodes outside the box")
+    sub.add_argument('--addresses', nargs='?', const='default', metavar='ZIP_CITIES',
+                     help="fix and report the zip codes and cities (optionally against this "
+                          "zip,city csv)")
+    sub.add_argument('--zip5', action='store_true', help="with --addresses, drop the ZIP+4 part")
+    sub.add_argument('--sink', action='append', metavar='KIND:PATH',
+                     help="also write to this sink in the same pass: csv:DIR, sqlite:DB, "
+                          "columns:DIR or summary[:JSON] (repeatable)")
+    sub.add_argument('--activity', nargs='?', const='', metavar='DB',
+                     help="build the changesets and user_activity tables, in the exported "
+                          "database (or this one, default activity.db)")
+    sub.add_argument('--tiles', type=int, nargs='*', metavar='ZOOM',
+                     help="count the nodes, ways, buildings and amenities per map tile at "
+                          "these zoom levels (default: 10 12 14 16)")
+    sub.add_argument('--encoded', action='store_true', help="dictionary-encoded SQLite tags")
+    sub.add_argument('--search', action='store_true', help="build the SQLite tag_search index")
+    sub.add_argument('--cache', action='store_true', help="replay or record the shaped cache")
+    sub.add_argument('--pipelined', action='store_true', help="csv export in threads")
+    sub.add_argument('--check', action='store_true',
+                     help="print the integrity report; exit 1 on problems")
+
+    sub = command('regions', run_regions, 'export many extracts into one partition each')
+    sub.add_argument('files', nargs='+', metavar='file')
+    sub.add_argument('--output', default='regions', help="directory of the partitions")
+    sub.add_argument('--to', choices=['csv', 'sqlite'], default='sqlite',
+                     help="a csv directory or a database per region")
+    sub.add_argument('--processes', type=int, help="worker processes (default: one per CPU)")
+    sub.add_argument('--merge', metavar='DB',
+                     help="merge the regions into this database, latest version first")
+    sub.add_argument('--validate', action='store_true', help="validate against the schema")
+    sub.add_argument('--rules', nargs='?', const='default',
+                     help="clean the tag values (optionally with this rules config)")
+
+    sub = command('graph', run_graph, 'build and save the road graph of the highway ways')
+    sub.add_argument('db')
+    sub.add_argument('output', help="graph directory")
+
+    sub = command('route', run_route, 'shortest route, or the nodes within reach, in a graph')
+    sub.add_argument('graph', help="graph directory")
+    sub.add_argument('source', type=int, help="node id")
+    sub.add_argument('target', type=int, nargs='?', help="node id")
+    sub.add_argument('--weight', choices=['lengths', 'times'], default='lengths',
+                     help="meters or seconds")
+    sub.add_argument('--within', type=float, help="list the nodes reachable within this cost")
+
+    sub = command('report', run_report, 'contribution reports over the database')
+    sub.add_argument('db')
+    sub.add_argument('kind', choices=['growth', 'users', 'keys', 'changesets', 'contributors'])
+    sub.add_argument('--start', help="YYYY-MM-DD (growth, users)")
+    sub.add_argument('--end', help="YYYY-MM-DD, exclusive (growth, users)")
+    sub.add_argument('--element', choices=['nodes', 'ways'], default='nodes', help="(keys)")
+    sub.add_argument('--limit', type=int, default=10,
+                     help="(keys, changesets, contributors)")
+    sub.add_argument('--uid', type=int, help="the changesets of this user (changesets)")
+
+    sub = command('search', run_search, 'full-text search of the names, streets, amenities, ...')
+    sub.add_argument('db', help="database exported with --search")
+    sub.add_argument('text')
+    sub.add_argument('--column', action='append',
+                     choices=['name', 'street', 'amenity', 'cuisine', 'tourism'],
+                     help="only match this column (repeatable)")
+    sub.add_argument('--element', choices=['node', 'way'])
+    sub.add_argument('--exact', action='store_true', help="whole words instead of prefixes")
+    sub.add_argument('--limit', type=int, default=20)
+    return main_parser
+
+
+def main(argv=None):
+    args = parser().parse_args(argv)
+    return args.run(args) or 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,180 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Cut an area out of an OSM file while it is exported.
+
+An AreaFilter sits between shape_element and the writers (see
+data.shape_elements) and keeps
+
+- the nodes inside a bounding box or polygon,
+- the ways with at least one kept node.
+
+Nodes are buffered in batches of BATCH_SIZE and tested all at once with
+numpy (a box test, or an even-odd ray casting test per polygon edge), so
+the per-node cost is a few array operations.  The ids of the kept nodes go
+into an integrity.IdSet, which is all that is needed to decide the ways:
+the batch is flushed before the first way, since OSM files list nodes
+before ways.  With clip_ways=True the refs of a kept way to nodes outside
+the area are dropped (and the positions renumbered), so the export has no
+dangling ways_nodes rows; otherwise ways keep all their refs.
+
+Relations are not part of the exported tables, so they are not filtered.
+
+Usage:
+    python -m osmwrangle.clip mapBend2.osm 44.03 -121.34 44.08 -121.28   # csv(s) of a bbox
+"""
+import sys
+from array import array
+
+from . import data
+from .integrity import IdSet
+
+
+BATCH_SIZE = 4096  # nodes tested at once
+
+# the <bounds> of the Bend extract the notebook works on
+BEND_BOUNDS = (43.9592, -121.4288, 44.1199, -121.1957)
+
+
+class AreaFilter(object):
+    """Keep the shaped nodes inside an area and the ways that touch them
+
+    area is a (minlat, minlon, maxlat, maxlon) box or a polygon given as a
+    sequence of (lat, lon) vertices (closing it is optional).
+    """
+
+    def __init__(self, area, clip_ways=False, batch_size=BATCH_SIZE):
+        import numpy as np
+        self.np = np
+        if len(area) == 4 and all(isinstance(value, (int, float)) for value in area):
+            self.box = tuple(float(value) for value in area)
+            self.polygon = None
+        else:
+            polygon = np.asarray(area, dtype=float)
+            if polygon.ndim != 2 or polygon.shape[1] != 2 or len(polygon) < 3:
+                raise ValueError("area must be a bbox or at least 3 (lat, lon) vertices")
+            self.polygon = polygon
+            lat, lon = polygon[:, 0], polygon[:, 1]
+            self.box = (lat.min(), lon.min(), lat.max(), lon.max())
+        self.clip_ways = clip_ways
+        self.batch_size = batch_size
+        self.kept = IdSet()
+        self.counts = {'nodes': 0, 'nodes_kept': 0, 'ways': 0, 'ways_kept': 0}
+
+    def contains(self, lat, lon):
+        """Return a boolean mask of the points (lat, lon arrays) in the area"""
+        np = self.np
+        minlat, minlon, maxlat, maxlon = self.box
+        inside = (lat >= minlat) & (lat <= maxlat) & (lon >= minlon) & (lon <= maxlon)
+        if self.polygon is None or not inside.any():
+            return inside
+        candidates = np.flatnonzero(inside)
+        lat, lon = lat[candidates], lon[candidates]
+        crossings = np.zeros(len(candidates), dtype=bool)
+        polygon = self.polygon
+        for (lat1, lon1), (lat2, lon2) in zip(polygon, np.roll(polygon, -1, axis=0)):
+            if lat1 == lat2:
+                continue
+            spans = (lat1 > lat) != (lat2 > lat)
+            crossings ^= spans & (lon < lon1 + (lat - lat1) * (lon2 - lon1) / (lat2 - lat1))
+        inside[candidates] = crossings
+        return inside
+
+    def flush(self, batch):
+        """Yield the nodes of batch that are inside the area"""
+        np = self.np
+        lat = np.fromiter((el['node']['lat'] for el in batch), dtype=float, count=len(batch))
+        lon = np.fromiter((el['node']['lon'] for el in batch), dtype=float, count=len(batch))
+        mask = self.contains(lat, lon)
+        self.counts['nodes'] += len(batch)
+        for el in (batch[i] for i in np.flatnonzero(mask)):
+            self.kept.add(el['node']['id'])
+            self.counts['nodes_kept'] += 1
+            yield el
+
+    def way(self, el):
+        """Return the way if one of its nodes was kept (clipped if clip_ways), else None"""
+        kept = self.kept
+        self.counts['ways'] += 1
+        refs = el.get(data.WAY_NODE_REFS)
+        if refs is not None:
+            inside = [ref in kept for ref in refs]
+            if not any(inside):
+                return None
+            if self.clip_ways and not all(inside):
+                el = dict(el)
+                el[data.WAY_NODE_REFS] = array('q', (ref for ref, keep in zip(refs, inside) if keep))
+        else:
+            inside = [row['node_id'] in kept for row in el['way_nodes']]
+            if not any(inside):
+                return None
+            if self.clip_ways and not all(inside):
+                rows = [row for row, keep in zip(el['way_nodes'], inside) if keep]
+                el = dict(el, way_nodes=[dict(row, position=position)
+                                         for position, row in enumerate(rows)])
+        self.counts['ways_kept'] += 1
+        return el
+
+    def filter(self, shaped):
+        """Yield the shaped elements of a stream that are kept, in order"""
+        batch = []
+        for el in shaped:
+            if 'node' in el:
+                batch.append(el)
+                if len(batch) >= self.batch_size:
+                    for node in self.flush(batch):
+                        yield node
+                    batch = []
+                continue
+            if batch:
+                for node in self.flush(batch):
+                    yield node
+                batch = []
+            if 'way' in el:
+                el = self.way(el)
+                if el is None:
+                    continue
+            yield el
+        if batch:
+            for node in self.flush(batch):
+                yield node
+
+
+def area_filter(area):
+    """Return an AreaFilter from an AreaFilter, a bbox or a polygon"""
+    if hasattr(area, 'filter'):
+        return area
+    return AreaFilter(area)
+
+
+def test():
+
+    import numpy as np
+    square = AreaFilter([(0, 0), (0, 2), (2, 2), (2, 0)])
+    triangle = AreaFilter([(0, 0), (0, 2), (2, 0)])
+    lat = np.array([1.2, 1.5, 3.0, 0.5])
+    lon = np.array([1.0, 1.5, 1.0, 0.5])
+    assert list(square.contains(lat, lon)) == [True, True, False, True]
+    assert list(triangle.contains(lat, lon)) == [False, False, False, True]
+
+    def shaped(area):
+        elements = data.get_element('example.osm', tags=('node', 'way'))
+        return list(data.shape_elements(elements, area=area))
+
+    everything = shaped(None)
+    assert shaped((-90, -180, 90, 180)) == everything
+    assert shaped(BEND_BOUNDS) == []
+
+    # a bbox around two of the way's nodes keeps the way, clipped to them
+    clipper = AreaFilter((41.973, -87.6892, 41.9731, -87.6891), clip_ways=True)
+    kept = shaped(clipper)
+    assert clipper.counts == {'nodes': 20, 'nodes_kept': 2, 'ways': 1, 'ways_kept': 1}
+    assert list(kept[-1][data.WAY_NODE_REFS]) == [261114300, 261114302, 261114300]
+
+
+if __name__ == "__main__":
+    if len(sys.argv) == 6:
+        data.process_map(sys.argv[1], validate=False,
+                         area=tuple(float(value) for value in sys.argv[2:]))
+    else:
+        test()
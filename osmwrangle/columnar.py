@@ -0,0 +1,221 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Columnar export: one flat binary file per table column.
+
+Every column of the five tables is streamed into its own file of fixed
+width values (int64 ids, float64 coordinates, ...) as the elements are
+shaped, so memory stays flat however large the extract.  String columns
+are dictionary-encoded like the --encoded SQLite tables (database.py):
+users, tag (key, type) pairs and tag values are each stored once in a JSON
+dictionary and the columns hold int32 ids (starting at 1).
+
+The layout of a columnar directory:
+
+    columns.json                     tables, row counts, column dtypes
+    <table>.<column>.bin             raw column values
+    <dictionary>.json                dictionary entries, id 1 first
+
+read_table memory-maps the columns as numpy arrays; numpy is only needed
+for reading.
+
+Usage:
+    python -m osmwrangle.columnar mapBend2.osm columns/
+"""
+import json
+import os
+import sys
+from array import array
+from itertools import repeat
+
+from . import data
+from .database import Dictionary, TAG_KEYS
+
+
+CHUNK_SIZE = 65536  # values buffered per column before they are appended to its file
+BYTE_ORDER = '<' if sys.byteorder == 'little' else '>'
+
+# column -> array typecode, or the name of the dictionary encoding it
+COLUMNS = {
+    'nodes': [('id', 'q'), ('lat', 'd'), ('lon', 'd'), ('user', 'users'), ('uid', 'q'),
+              ('version', 'q'), ('changeset', 'q'), ('timestamp', 'q')],
+    'nodes_tags': [('id', 'q'), ('key_id', 'tag_keys'), ('value_id', 'tag_values')],
+    'ways': [('id', 'q'), ('user', 'users'), ('uid', 'q'), ('version', 'q'),
+             ('changeset', 'q'), ('timestamp', 'q')],
+    'ways_nodes': [('id', 'q'), ('node_id', 'q'), ('position', 'q')],
+    'ways_tags': [('id', 'q'), ('key_id', 'tag_keys'), ('value_id', 'tag_values')],
+}
+DICTIONARIES = ('users', 'tag_keys', 'tag_values')
+DTYPES = {'q': 'i8', 'd': 'f8', 'i': 'i4'}
+
+
+class ColumnarWriter(object):
+    """Append shaped elements to the column files of a directory"""
+
+    def __init__(self, directory, chunk_size=CHUNK_SIZE):
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+        self.directory = directory
+        self.chunk_size = chunk_size
+        self.dictionaries = dict((name, Dictionary()) for name in DICTIONARIES)
+        self.rows = dict((table, 0) for table in COLUMNS)
+        self.columns = {}
+        self.files = []
+        for table, _, _, key in data.TABLES:
+            columns = []
+            for column, kind in COLUMNS[table]:
+                typecode = kind if kind in DTYPES else 'i'
+                output = open(os.path.join(directory, '{0}.{1}.bin'.format(table, column)), 'wb')
+                self.files.append(output)
+                columns.append((column, kind, array(typecode), output))
+            self.columns[key] = (table, columns)
+
+    def write(self, el):
+        for key, rows in el.items():
+            if key == data.WAY_NODE_REFS:
+                self.write_way_nodes(el['way']['id'], rows)
+                continue
+            table, columns = self.columns[key]
+            if isinstance(rows, dict):
+                rows = (rows,)
+            tags = key in TAG_KEYS
+            for row in rows:
+                if tags:
+                    row = {'id': row['id'], 'key_id': (row['key'], row['type']),
+                           'value_id': row['value']}
+                for column, kind, values, _ in columns:
+                    if kind in DTYPES:
+                        values.append(row[column])
+                    else:
+                        values.append(self.dictionaries[kind].encode(row[column]))
+                self.rows[table] += 1
+            if len(columns[0][2]) >= self.chunk_size:
+                self.flush(columns)
+
+    def write_way_nodes(self, way_id, refs):
+        """Append the rows of a way's node ref array column by column"""
+        table, columns = self.columns['way_nodes']
+        ids, node_ids, positions = [values for _, _, values, _ in columns]
+        ids.extend(repeat(way_id, len(refs)))
+        node_ids.extend(refs)
+        positions.extend(range(len(refs)))
+        self.rows[table] += len(refs)
+        if len(ids) >= self.chunk_size:
+            self.flush(columns)
+
+    def flush(self, columns):
+        for _, _, values, output in columns:
+            values.tofile(output)
+            del values[:]
+
+    def close(self):
+        manifest = {'byte_order': BYTE_ORDER, 'tables': {}, 'dictionaries': {}}
+        for table, columns in self.columns.values():
+            self.flush(columns)
+            manifest['tables'][table] = {
+                'rows': self.rows[table],
+                'columns': dict((column, {'dtype': BYTE_ORDER + DTYPES[values.typecode],
+                                          'dictionary': None if kind in DTYPES else kind})
+                                for column, kind, values, _ in columns)}
+        for output in self.files:
+            output.close()
+        for name, dictionary in self.dictionaries.items():
+            path = '{0}.json'.format(name)
+            with open(os.path.join(self.directory, path), 'w', encoding='utf-8') as output:
+                json.dump([value for _, value in sorted((i, v) for v, i in dictionary.ids.items())],
+                          output, ensure_ascii=False)
+            manifest['dictionaries'][name] = path
+        with open(os.path.join(self.directory, 'columns.json'), 'w') as output:
+            json.dump(manifest, output, indent=1, sort_keys=True)
+
+    def abort(self):
+        """Close the column files without a manifest (nor that of an earlier export)"""
+        for output in self.files:
+            output.close()
+        manifest = os.path.join(self.directory, 'columns.json')
+        if os.path.exists(manifest):
+            os.remove(manifest)
+
+
+# ================================================== #
+#               Main Functions                       #
+# ================================================== #
+def export_columns(file_in, directory, validate=False, rules=None, checker=None,
+                   area=None, cache=False, addresses=None, quarantine=None, tiles=None,
+                   sinks=()):
+    """Shape every node and way of file_in into a columnar directory
+
+    The counts of a tiles.TileAggregator passed as tiles go to tiles.csv;
+    sinks are more writers fed in the same pass (see sinks.py).
+    """
+    validator = data.new_validator() if validate is True else None
+    if rules is not None:
+        from . import rules as cleaning
+        rules = cleaning.load_rules(None if rules is True else rules)
+
+    data.run_export(data.shaped_file(file_in, rules, area, cache, quarantine),
+                    data.export_writers(ColumnarWriter(directory), checker, tiles, sinks),
+                    validator, addresses, quarantine)
+    if tiles is not None:
+        tiles.write_csv(directory)
+
+
+def read_manifest(directory):
+    with open(os.path.join(directory, 'columns.json')) as manifest:
+        return json.load(manifest)
+
+
+def read_dictionary(directory, name):
+    """Return the entries of a dictionary as a numpy object array, indexed by id"""
+    import numpy as np
+    with open(os.path.join(directory, '{0}.json'.format(name)), encoding='utf-8') as entries:
+        values = [None] + [tuple(v) if isinstance(v, list) else v for v in json.load(entries)]
+    decoded = np.empty(len(values), dtype=object)
+    decoded[:] = values
+    return decoded
+
+
+def read_table(directory, table, decode=False):
+    """Return {column: numpy array} for a table, memory-mapped from its files
+
+    With decode=True dictionary columns are turned back into their values
+    (tag_keys entries are (key, type) tuples).
+    """
+    import numpy as np
+    manifest = read_manifest(directory)
+    info = manifest['tables'][table]
+    columns = {}
+    for column, spec in info['columns'].items():
+        path = os.path.join(directory, '{0}.{1}.bin'.format(table, column))
+        if info['rows']:
+            values = np.memmap(path, dtype=spec['dtype'], mode='r', shape=(info['rows'],))
+        else:
+            values = np.empty(0, dtype=spec['dtype'])
+        if decode and spec['dictionary']:
+            values = read_dictionary(directory, spec['dictionary'])[values]
+        columns[column] = values
+    return columns
+
+
+def test():
+
+    import shutil
+    import tempfile
+    directory = tempfile.mkdtemp()
+    try:
+        export_columns('example.osm', directory)
+        nodes = read_table(directory, 'nodes', decode=True)
+        assert len(nodes['id']) == 20 and nodes['user'][-1] == 'uboot'
+        tags = read_table(directory, 'ways_tags', decode=True)
+        assert list(tags['key_id']) == [('highway', 'regular'), ('building', 'regular'),
+                                        ('FIXME', 'regular')]
+        assert list(read_table(directory, 'ways_nodes')['position']) == [0, 1, 2, 3]
+    finally:
+        shutil.rmtree(directory)
+
+
+if __name__ == "__main__":
+    if len(sys.argv) > 2:
+        export_columns(sys.argv[1], sys.argv[2])
+    else:
+        test()
@@ -0,0 +1,736 @@
+#!/usr/bin/env python2
+# -*- coding: utf-8 -*-
+"""
+Created on Fri Jun 19 20:16:21 2020
+
+@author: reneecothern
+"""
+
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+After auditing is complete the next step is to prepare the data to be inserted into a SQL database.
+To do so you will parse the elements in the OSM XML file, transforming them from document format to
+tabular format, thus making it possible to write to .csv files.  These csv files can then easily be
+imported to a SQL database as tables.
+
+The process for this transformation is as follows:
+- Use iterparse to iteratively step through each top level element in the XML
+- Shape each element into several data structures using a custom function
+- Utilize a schema and validation library to ensure the transformed data is in the correct format
+- Write each data structure to the appropriate .csv files
+
+We've already provided the code needed to load the data, perform iterative parsing and write the
+output to csv files. Your task is to complete the shape_element function that will transform each
+element into the correct format. To make this process easier we've already defined a schema (see
+the schema.py file in the last code tab) for the .csv files and the eventual tables. Using the 
+cerberus library we can validate the output against this schema to ensure it is correct.
+
+## Shape Element Function
+The function should take as input an iterparse Element object and return a dictionary.
+
+### If the element top level tag is "node":
+The dictionary returned should have the format {"node": .., "node_tags": ...}
+
+The "node" field should hold a dictionary of the following top level node attributes:
+- id
+- user
+- uid
+- version
+- lat
+- lon
+- timestamp
+- changeset
+All other attributes can be ignored
+
+The "node_tags" field should hold a list of dictionaries, one per secondary tag. Secondary tags are
+child tags of node which have the tag name/type: "tag". Each dictionary should have the following
+fields from the secondary tag attributes:
+- id: the top level node id attribute value
+- key: the full tag "k" attribute value if no colon is present or the characters after the colon if one is.
+- value: the tag "v" attribute value
+- type: either the characters before the colon in the tag "k" value or "regular" if a colon
+        is not present.
+
+Additionally,
+
+- if the tag "k" value contains problematic characters, the tag should be ignored
+- if the tag "k" value contains a ":" the characters before the ":" should be set as the tag type
+  and characters after the ":" should be set as the tag key
+- if there are additional ":" in the "k" value they and they should be ignored and kept as part of
+  the tag key. For example:
+
+  <tag k="addr:street:name" v="Lincoln"/>
+  should be turned into
+  {'id': 12345, 'key': 'street:name', 'value': 'Lincoln', 'type': 'addr'}
+
+- If a node has no secondary tags then the "node_tags" field should just contain an empty list.
+
+The final return value for a "node" element should look something like:
+
+{'node': {'id': 757860928,
+          'user': 'uboot',
+          'uid': 26299,
+       'version': '2',
+          'lat': 41.9747374,
+          'lon': -87.6920102,
+          'timestamp': '2010-07-22T16:16:51Z',
+      'changeset': 5288876},
+ 'node_tags': [{'id': 757860928,
+                'key': 'amenity',
+                'value': 'fast_food',
+                'type': 'regular'},
+               {'id': 757860928,
+                'key': 'cuisine',
+                'value': 'sausage',
+                'type': 'regular'},
+               {'id': 757860928,
+                'key': 'name',
+                'value': "Shelly's Tasty Freeze",
+                'type': 'regular'}]}
+
+### If the element top level tag is "way":
+The dictionary should have the format {"way": ..., "way_tags": ..., "way_nodes": ...}
+
+The "way" field should hold a dictionary of the following top level way attributes:
+- id
+-  user
+- uid
+- version
+- timestamp
+- changeset
+
+All other attributes can be ignored
+
+The "way_tags" field should again hold a list of dictionaries, following the exact same rules as
+for "node_tags".
+
+Additionally, the dictionary should have a field "way_nodes". "way_nodes" should hold a list of
+dictionaries, one for each nd child tag.  Each dictionary should have the fields:
+- id: the top level element (way) id
+- node_id: the ref attribute value of the nd tag
+- position: the index starting at 0 of the nd tag i.e. what order the nd tag appears within
+            the way element
+
+The final return value for a "way" element should look something like:
+
+{'way': {'id': 209809850,
+         'user': 'chicago-buildings',
+         'uid': 674454,
+         'version': '1',
+         'timestamp': '2013-03-13T15:58:04Z',
+         'changeset': 15353317},
+ 'way_nodes': [{'id': 209809850, 'node_id': 2199822281, 'position': 0},
+               {'id': 209809850, 'node_id': 2199822390, 'position': 1},
+               {'id': 209809850, 'node_id': 2199822392, 'position': 2},
+               {'id': 209809850, 'node_id': 2199822369, 'position': 3},
+               {'id': 209809850, 'node_id': 2199822370, 'position': 4},
+               {'id': 209809850, 'node_id': 2199822284, 'position': 5},
+               {'id': 209809850, 'node_id': 2199822281, 'position': 6}],
+ 'way_tags': [{'id': 209809850,
+               'key': 'housenumber',
+               'type': 'addr',
+               'value': '1412'},
+              {'id': 209809850,
+               'key': 'street',
+               'type': 'addr',
+               'value': 'West Lexington St.'},
+              {'id': 209809850,
+               'key': 'street:name',
+               'type': 'addr',
+               'value': 'Lexington'},
+              {'id': '209809850',
+               'key': 'street:prefix',
+               'type': 'addr',
+               'value': 'West'},
+              {'id': 209809850,
+               'key': 'street:type',
+               'type': 'addr',
+               'value': 'Street'},
+              {'id': 209809850,
+               'key': 'building',
+               'type': 'regular',
+               'value': 'yes'},
+              {'id': 209809850,
+               'key': 'levels',
+               'type': 'building',
+               'value': '1'},
+              {'id': 209809850,
+               'key': 'building_id',
+               'type': 'chicago',
+               'value': '366409'}]}
+"""
+
+import calendar
+import csv
+import os
+import pprint
+import re
+from array import array
+from itertools import count, repeat
+from operator import itemgetter
+try:
+    import xml.etree.cElementTree as ET
+except ImportError:  # removed in Python 3.9
+    import xml.etree.ElementTree as ET
+
+from . import schema
+
+OSM_PATH = "example.osm"
+
+NODES_PATH = "nodes.csv"
+NODE_TAGS_PATH = "nodes_tags.csv"
+WAYS_PATH = "ways.csv"
+WAY_NODES_PATH = "ways_nodes.csv"
+WAY_TAGS_PATH = "ways_tags.csv"
+
+BUFFER_SIZE = 1 << 20  # write buffer of each csv file
+
+LOWER_COLON = re.compile(r'^([a-z]|_)+:([a-z]|_)+')
+PROBLEMCHARS = re.compile(r'[=\+/&<>;\'"\?%#$@\,\. \t\r\n]')
+
+# the tag key categories counted by tags.py
+LOWER = re.compile(r'^([a-z]|_)*$')
+LOWER_COLON_KEY = re.compile(r'^([a-z]|_)*:([a-z]|_)*$')
+
+KEY_CACHE_SIZE = 100000  # distinct tag "k" values memoized by tag_key
+
+SCHEMA = schema.schema
+
+# Make sure the fields order in the csvs matches the column order in the sql table schema
+NODE_FIELDS = ['id', 'lat', 'lon', 'user', 'uid', 'version', 'changeset', 'timestamp']
+NODE_TAGS_FIELDS = ['id', 'key', 'value', 'type']
+WAY_FIELDS = ['id', 'user', 'uid', 'version', 'changeset', 'timestamp']
+WAY_TAGS_FIELDS = ['id', 'key', 'value', 'type']
+WAY_NODES_FIELDS = ['id', 'node_id', 'position']
+
+# output table -> (csv path, fields, key of its rows in the shaped element)
+TABLES = [
+    ('nodes', NODES_PATH, NODE_FIELDS, 'node'),
+    ('nodes_tags', NODE_TAGS_PATH, NODE_TAGS_FIELDS, 'node_tags'),
+    ('ways', WAYS_PATH, WAY_FIELDS, 'way'),
+    ('ways_nodes', WAY_NODES_PATH, WAY_NODES_FIELDS, 'way_nodes'),
+    ('ways_tags', WAY_TAGS_PATH, WAY_TAGS_FIELDS, 'way_tags'),
+]
+
+# key of the typed node ref array shape_element returns instead of the
+# 'way_nodes' dicts when called with way_node_refs=True
+WAY_NODE_REFS = 'way_node_refs'
+
+_EPOCH_DAYS = {}
+_TAG_KEYS = {}
+
+
+def parse_timestamp(timestamp):
+    """Convert an OSM timestamp ('2010-07-22T16:16:51Z') to epoch seconds
+
+    The date part is converted once per distinct day; raises ValueError on
+    anything but the YYYY-MM-DDTHH:MM:SSZ form.
+    """
+    if len(timestamp) != 20 or timestamp[10] != 'T' or timestamp[19] != 'Z':
+        raise ValueError("invalid timestamp: {0!r}".format(timestamp))
+    day = timestamp[:10]
+    seconds = _EPOCH_DAYS.get(day)
+    if seconds is None:
+        seconds = _EPOCH_DAYS[day] = calendar.timegm(
+            (int(day[:4]), int(day[5:7]), int(day[8:10]), 0, 0, 0))
+    return (seconds + int(timestamp[11:13]) * 3600 + int(timestamp[14:16]) * 60
+            + int(timestamp[17:19]))
+
+
+# Attributes are converted to their column type while shaping, so every sink
+# gets native ints and floats (timestamps as epoch seconds); a malformed or
+# missing one raises ShapeError.  Attributes not listed here are kept as
+# strings, None when missing (the user of an anonymous edit).
+ATTRIBUTE_TYPES = {'id': int, 'lat': float, 'lon': float, 'uid': int, 'changeset': int,
+                   'version': int, 'timestamp': parse_timestamp}
+
+
+class ShapeError(ValueError):
+    """An element attribute that is missing or cannot be converted to its column type"""
+
+    def __init__(self, message, field):
+        super(ShapeError, self).__init__(message)
+        self.field = field
+
+
+def typed_attributes(element, fields, types=ATTRIBUTE_TYPES):
+    """Return {field: attribute value converted to its column type}
+
+    Raises ShapeError (a ValueError) for a typed attribute that is missing,
+    such as the uid of an anonymous edit, or malformed.
+    """
+    attribs = {}
+    for field in fields:
+        value = element.get(field)
+        convert = types.get(field)
+        if convert is None:
+            attribs[field] = value
+            continue
+        try:
+            attribs[field] = convert(value)
+        except (TypeError, ValueError):
+            raise ShapeError("{0} {1}: {2} {3}".format(
+                element.tag, element.get('id'), field,
+                'missing' if value is None else 'invalid: {0!r}'.format(value)), field)
+    return attribs
+
+
+def parse_tag_key(k, problem_chars=PROBLEMCHARS, default_tag_type='regular'):
+    """Return (type, key, category) of a tag "k" value
+
+    (type, key) is how shape_element stores the tag ((None, None) if the tag
+    is dropped for problem characters) and category is its tags.py category.
+    """
+    if problem_chars.search(k) is not None:
+        tag_type = key = None
+    elif LOWER_COLON.search(k) is not None:
+        tag_type, key = k.split(':', 1)
+    else:
+        tag_type, key = default_tag_type, k
+    if LOWER.match(k):
+        category = 'lower'
+    elif LOWER_COLON_KEY.match(k):
+        category = 'lower_colon'
+    elif PROBLEMCHARS.match(k):
+        category = 'problemchars'
+    else:
+        category = 'other'
+    return tag_type, key, category
+
+
+def tag_key(k):
+    """parse_tag_key with the default arguments, memoized per distinct k"""
+    parsed = _TAG_KEYS.get(k)
+    if parsed is None:
+        parsed = parse_tag_key(k)
+        if len(_TAG_KEYS) < KEY_CACHE_SIZE:
+            _TAG_KEYS[k] = parsed
+    return parsed
+
+
+def shape_tag(element_id, tag, rules=None, split=tag_key):
+    """Return the row dict of a <tag> child, or None if its key is dropped"""
+    k = tag.get('k')
+    tag_type, key, _ = split(k)
+    if key is None:
+        return None
+    value = tag.get('v')
+    if rules is not None:
+        value = rules.clean(k, value)
+    return {'id': element_id, 'key': key, 'value': value, 'type': tag_type}
+
+
+def way_node_rows(way_id, refs):
+    """Return an iterator of the (id, node_id, position) rows of a way's node refs"""
+    return zip(repeat(way_id, len(refs)), refs, count())
+
+
+def shape_element(element, node_attr_fields=NODE_FIELDS, way_attr_fields=WAY_FIELDS,
+                  problem_chars=PROBLEMCHARS, default_tag_type='regular', rules=None,
+                  way_node_refs=False):
+    """Clean and shape node or way XML element to Python dict
+
+    rules is an optional rules.RuleSet used to clean the tag values.  With
+    way_node_refs=True a way's node refs are returned as an array('q') under
+    WAY_NODE_REFS instead of one 'way_nodes' dict per ref; the writers turn
+    it into rows in bulk with way_node_rows.
+    """
+
+    node_attribs = {}
+    way_attribs = {}
+    way_nodes = []
+    tags = []  # Handle secondary tags the same way for both node and way elements
+
+    # tag keys are split by tag_key, memoized, unless the defaults are overridden
+    if problem_chars is PROBLEMCHARS and default_tag_type == 'regular':
+        split = tag_key
+    else:
+        def split(k):
+            return parse_tag_key(k, problem_chars, default_tag_type)
+
+    # YOUR CODE HERE
+    if element.tag == 'node':
+        node_attribs = typed_attributes(element, node_attr_fields)
+        element_id = int(element.get('id'))
+        for child in element:
+            #process the node_tags key
+            if child.tag == 'tag':
+                tags_dict = shape_tag(element_id, child, rules, split)
+                #Make sure problem characters aren't there
+                if tags_dict is not None:
+                    tags.append(tags_dict)
+        return {'node': node_attribs, 'node_tags': tags}
+    
+    elif element.tag == 'way':
+        way_attribs = typed_attributes(element, way_attr_fields)
+        element_id = int(element.get('id'))
+        nd_count = 0
+        refs = array('q') if way_node_refs else None
+        
+        for child in element:
+            #process way nodes
+            if child.tag == 'nd' and refs is not None:
+                refs.append(int(child.get('ref')))
+            elif child.tag == 'nd':
+                nodes_dict = {}
+                nodes_dict['id'] = element_id
+                nodes_dict['node_id'] = int(child.get('ref'))
+                nodes_dict['position'] = nd_count
+                nd_count += 1
+                way_nodes.append(nodes_dict)
+                
+            #process the way_tags key
+            elif child.tag == 'tag':
+                tags_dict = shape_tag(element_id, child, rules, split)
+                #Make sure problem characters aren't there
+                if tags_dict is not None:
+                    tags.append(tags_dict)
+        
+        if refs is not None:
+            return {'way': way_attribs, WAY_NODE_REFS: refs, 'way_tags': tags}
+        return {'way': way_attribs, 'way_nodes': way_nodes, 'way_tags': tags}
+
+
+def shape_elements(elements, rules=None, area=None, quarantine=None):
+    """Yield the shaped node and way elements, way node refs as arrays
+
+    area restricts the output to a bbox or polygon (see clip.AreaFilter).
+    An element shape_element rejects (a ShapeError, or another ValueError or
+    TypeError) stops the stream, or with a quarantine.Quarantine is written
+    there as raw XML and left out.
+    """
+    return within(shaped_or_quarantined(elements, rules, quarantine), area)
+
+
+def shaped_or_quarantined(elements, rules, quarantine):
+    for element in elements:
+        try:
+            el = shape_element(element, rules=rules, way_node_refs=True)
+        except (TypeError, ValueError) as error:
+            if quarantine is None:
+                raise
+            quarantine.write_unshaped(element, error)
+            continue
+        if el:
+            yield el
+
+
+def within(shaped, area):
+    """Restrict a shaped element stream to area (None keeps everything)"""
+    if area is None:
+        return shaped
+    from . import clip
+    return clip.area_filter(area).filter(shaped)
+
+
+def shaped_file(file_in, rules=None, area=None, cache=False, quarantine=None):
+    """Yield the shaped nodes and ways of file_in (see shape_elements)
+
+    With cache=True the shaped stream is replayed from the cache of
+    cache.py, or recorded into it if the file has no current cache.
+    """
+    if cache:
+        from . import cache as shaped_cache
+        return within(shaped_cache.shaped_elements(file_in, rules, quarantine=quarantine), area)
+    return shape_elements(get_element(file_in, tags=('node', 'way')), rules, area, quarantine)
+
+
+# ================================================== #
+#               Helper Functions                     #
+# ================================================== #
+def get_element(osm_file, tags=('node', 'way', 'relation')):
+    """Yield element if it is the right type of tag"""
+
+    context = ET.iterparse(osm_file, events=('start', 'end'))
+    _, root = next(context)
+    for event, elem in context:
+        if event == 'end' and elem.tag in tags:
+            yield elem
+            root.clear()
+
+
+def new_validator():
+    """Return a cerberus Validator; cerberus is only imported when validating"""
+    import cerberus
+    return cerberus.Validator()
+
+
+class ValidationError(Exception):
+    """A shaped element that does not match the schema
+
+    errors is the cerberus error dict of all fields: {field: [message or
+    {subfield or list index: [...]}]}.
+    """
+
+    def __init__(self, message, element, errors):
+        super(ValidationError, self).__init__(message)
+        self.element = element
+        self.errors = errors
+
+
+def validate_element(element, validator, schema=SCHEMA):
+    """Raise ValidationError if element does not match schema
+
+    Values are already typed by shape_element, so the document is checked
+    as is, without cerberus' normalization (coercion) pass.  A WAY_NODE_REFS
+    array holds int64 values by construction and is not checked.
+    """
+    if WAY_NODE_REFS in element:
+        element = dict((k, v) for k, v in element.items() if k != WAY_NODE_REFS)
+    if validator.validate(element, schema, normalize=False) is not True:
+        field, errors = next(iter(validator.errors.items()))
+        message_string = "\nElement of type '{0}' has the following errors:\n{1}"
+        error_string = pprint.pformat(errors)
+        
+        raise ValidationError(message_string.format(field, error_string), element,
+                              validator.errors)
+
+
+def valid(element, validator, quarantine=None):
+    """Validate element; with a quarantine, divert it there instead of raising
+
+    Returns False for an element written to the quarantine (see quarantine.py).
+    """
+    try:
+        validate_element(element, validator)
+    except ValidationError as error:
+        if quarantine is None:
+            raise
+        quarantine.write(element, error)
+        return False
+    return True
+
+
+def open_csv(path, buffer_size=BUFFER_SIZE):
+    """Open a csv file for writing: UTF-8, untranslated newlines, a large buffer"""
+    return open(path, 'w', encoding='utf-8', newline='', buffering=buffer_size)
+
+
+class RowWriter(object):
+    """Write the shaped rows (dicts) of one table with csv.writer
+
+    Each row is turned into a tuple in field order by an itemgetter, so no
+    intermediate dict is built; the output is the same as csv.DictWriter's
+    (excel dialect, CRLF line ends, UTF-8).
+    """
+
+    def __init__(self, output, fields):
+        self.fields = fields
+        self.writer = csv.writer(output)
+        self.row = itemgetter(*fields)
+
+    def writeheader(self):
+        self.writer.writerow(self.fields)
+
+    def writerow(self, row):
+        self.writer.writerow(self.row(row))
+
+    def writerows(self, rows):
+        self.writer.writerows(map(self.row, rows))
+
+
+class CsvWriter(object):
+    """Write shaped elements to the five csv(s) of process_map in output_dir"""
+
+    def __init__(self, output_dir='.'):
+        self.files = []
+        self.writers = {}
+        try:
+            for _, path, fields, key in TABLES:
+                output = open_csv(os.path.join(output_dir, path))
+                self.files.append(output)
+                if key == 'way_nodes':
+                    # rows of (id, node_id, position) tuples, see way_node_rows
+                    writer = csv.writer(output)
+                    writer.writerow(fields)
+                else:
+                    writer = RowWriter(output, fields)
+                    writer.writeheader()
+                self.writers[key] = writer
+        except Exception:
+            self.close()
+            raise
+
+    def write(self, el):
+        writers = self.writers
+        if 'node' in el:
+            writers['node'].writerow(el['node'])
+            writers['node_tags'].writerows(el['node_tags'])
+        else:
+            writers['way'].writerow(el['way'])
+            writers['way_nodes'].writerows(way_node_rows(el['way']['id'], el[WAY_NODE_REFS]))
+            writers['way_tags'].writerows(el['way_tags'])
+
+    def close(self):
+        for output in self.files:
+            output.close()
+
+    def abort(self):
+        """Close the csv(s); a failed export leaves them as far as they got"""
+        self.close()
+
+
+def export_writers(writer, checker=None, tiles=None, sinks=()):
+    """The writers of an export in the order they are fed: checker, tiles, sinks, writer"""
+    return [extra for extra in (checker, tiles) if extra is not None] + list(sinks) + [writer]
+
+
+def close_all(writers, failed=False):
+    """Close every writer, or abort every one of them if the export failed
+
+    An exception in one close does not skip the others: the writers after
+    it are aborted.
+    """
+    for i, writer in enumerate(writers):
+        try:
+            if failed:
+                writer.abort()
+            else:
+                writer.close()
+        except Exception:
+            close_all(writers[i + 1:], failed=True)
+            raise
+
+
+def run_export(shaped, writers, validator=None, addresses=None, quarantine=None):
+    """Feed every shaped element to each of writers, then close them all
+
+    Every writer has write(el), close() and abort() (see sinks.py).
+    addresses fixes each element and validator checks it before it is
+    written; with a quarantine, invalid elements go there (see valid).  The
+    writers are closed, which finalizes their output, only if the export
+    completes; if it fails they are aborted instead.
+    """
+    closing = writers + ([quarantine] if quarantine is not None else [])
+    try:
+        for el in shaped:
+            if addresses is not None:
+                el = addresses.apply(el)
+            if validator is not None and not valid(el, validator, quarantine):
+                continue
+            for writer in writers:
+                writer.write(el)
+    except BaseException:
+        close_all(closing, failed=True)
+        raise
+    close_all(closing)
+
+
+# ================================================== #
+#               Main Function                        #
+# ================================================== #
+def process_map(file_in, validate, pipelined=False, rules=None, checker=None, area=None,
+                cache=False, output_dir='.', addresses=None, quarantine=None, tiles=None,
+                sinks=()):
+    """Iteratively process each XML element and write to csv(s)
+
+    With pipelined=True parsing, shaping and writing run in separate threads
+    (see pipeline.py); the csv(s) written are identical.  rules cleans the
+    tag values: a rules.RuleSet, the path of a rules config file, or True
+    for the default cleaning_rules.json.  checker is an optional
+    integrity.IntegrityChecker fed every shaped element.  area keeps only
+    the nodes in a (minlat, minlon, maxlat, maxlon) box or a polygon of
+    (lat, lon) vertices, and the ways that touch them (see clip.py).
+    cache=True replays the shaped elements from the cache of cache.py
+    (always in this thread: replaying is cheaper than the pipeline).
+    The csv(s) are written into output_dir (see regions.py).  addresses is
+    an optional address.AddressValidator that fixes the zip codes and cities
+    of every element before it is validated and written.  With validate and
+    a quarantine.Quarantine as quarantine, invalid elements are written to
+    the quarantine file instead of aborting the export, and so are elements
+    that cannot be shaped (see shape_elements), with or without validate.  tiles is an
+    optional tiles.TileAggregator, whose counts are written to tiles.csv.
+    sinks are more writers (database.SqliteWriter, sinks.Summary, ...) fed
+    every element in the same pass and closed at the end (see sinks.py).
+    """
+    if rules is not None:
+        from . import rules as cleaning
+        rules = cleaning.load_rules(None if rules is True else rules)
+    if pipelined and not cache:
+        from . import pipeline
+        return pipeline.process_map(file_in, validate, rules=rules, checker=checker, area=area,
+                                    output_dir=output_dir, addresses=addresses,
+                                    quarantine=quarantine, tiles=tiles, sinks=sinks)
+
+    validator = new_validator() if validate is True else None
+    run_export(shaped_file(file_in, rules, area, cache, quarantine),
+               export_writers(CsvWriter(output_dir), checker, tiles, sinks), validator,
+               addresses, quarantine)
+    if tiles is not None:
+        tiles.write_csv(output_dir)
+
+
+def test():
+
+    import filecmp
+    import shutil
+    import tempfile
+    # csv(s) of example.osm as written by the csv.DictWriter export before
+    # RowWriter (typed values, epoch timestamps), not the case study's output
+    golden = os.path.abspath(os.path.join('fixtures', 'golden', 'example'))
+    osm_file = os.path.abspath('example.osm')
+    cwd = os.getcwd()
+    directory = tempfile.mkdtemp()
+    try:
+        os.chdir(directory)
+        for pipelined in (False, True):
+            process_map(osm_file, validate=True, pipelined=pipelined)
+            for _, path, _, _ in TABLES:
+                assert filecmp.cmp(path, os.path.join(golden, path), shallow=False), path
+    finally:
+        os.chdir(cwd)
+        shutil.rmtree(directory)
+
+    # typed attributes that are missing or malformed raise a ValueError
+    for attributes in ({'id': '1', 'lat': 'abc'}, {'id': '1', 'lat': '1', 'lon': '1'}):
+        try:
+            typed_attributes(ET.Element('node', attributes), NODE_FIELDS)
+        except ValueError as error:
+            assert error.field in ('lat', 'uid'), error
+        else:
+            raise AssertionError('expected a ValueError')
+
+    # a failing writer stops the export, and every writer is aborted, not closed
+    class Writer(object):
+        def __init__(self, fail=None):
+            self.fail = fail
+            self.closed = self.aborted = False
+
+        def write(self, el):
+            if self.fail == 'write':
+                raise IOError('disk full')
+
+        def close(self):
+            if self.fail == 'close':
+                raise IOError('disk full')
+            self.closed = True
+
+        def abort(self):
+            self.aborted = True
+
+    writers = [Writer(), Writer(fail='write'), Writer()]
+    try:
+        run_export(shaped_file(osm_file), writers)
+    except IOError:
+        assert all(writer.aborted and not writer.closed for writer in writers)
+    else:
+        raise AssertionError('expected an IOError')
+
+    # a failing close aborts the writers after it
+    writers = [Writer(), Writer(fail='close'), Writer()]
+    try:
+        run_export(shaped_file(osm_file), writers)
+    except IOError:
+        assert [(writer.closed, writer.aborted) for writer in writers] == [
+            (True, False), (False, False), (False, True)]
+    else:
+        raise AssertionError('expected an IOError')
+
+
+if __name__ == '__main__':
+    # Note: Validation is ~ 10X slower. For the project consider using a small
+    # sample of the map when validating.
+    process_map(OSM_PATH, validate=True)
+
@@ -0,0 +1,467 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Build the SQLite database the analysis queries run against.
+
+The tables mirror the csv files written by data.process_map.  Timestamps
+are stored as epoch seconds and versions as integers (see
+data.parse_timestamp), and the timestamp columns are indexed, so
+time-range questions are index range scans over integers rather than
+string comparisons (see reports.py).
+
+Either load the csv(s) of an earlier export, or export straight from the
+OSM file:
+
+Usage:
+    python -m osmwrangle.database test                    # run the test
+    python -m osmwrangle.database BendOR.db               # load the csv(s) in the current dir
+    python -m osmwrangle.database BendOR.db mapBend2.osm  # shape mapBend2.osm straight into the db
+  add --encoded to store the tags dictionary-encoded (see SQL_ENCODED_TAGS)
+  add --search to build the tag_search full-text index (see search.py)
+"""
+import csv
+import sys
+
+from . import data
+
+
+DB_PATH = 'BendOR.db'
+BATCH_SIZE = 10000  # rows per executemany call
+
+SQL_SCHEMA = '''
+CREATE TABLE IF NOT EXISTS nodes (
+    id INTEGER PRIMARY KEY NOT NULL,
+    lat REAL,
+    lon REAL,
+    user TEXT,
+    uid INTEGER,
+    version INTEGER,
+    changeset INTEGER,
+    timestamp INTEGER
+);
+
+CREATE TABLE IF NOT EXISTS ways (
+    id INTEGER PRIMARY KEY NOT NULL,
+    user TEXT,
+    uid INTEGER,
+    version INTEGER,
+    changeset INTEGER,
+    timestamp INTEGER
+);
+
+CREATE TABLE IF NOT EXISTS ways_nodes (
+    id INTEGER NOT NULL,
+    node_id INTEGER NOT NULL,
+    position INTEGER NOT NULL,
+    FOREIGN KEY (id) REFERENCES ways(id),
+    FOREIGN KEY (node_id) REFERENCES nodes(id)
+);
+'''
+
+SQL_TAGS = '''
+CREATE TABLE IF NOT EXISTS nodes_tags (
+    id INTEGER,
+    key TEXT,
+    value TEXT,
+    type TEXT,
+    FOREIGN KEY (id) REFERENCES nodes(id)
+);
+
+CREATE TABLE IF NOT EXISTS ways_tags (
+    id INTEGER NOT NULL,
+    key TEXT NOT NULL,
+    value TEXT NOT NULL,
+    type TEXT,
+    FOREIGN KEY (id) REFERENCES ways(id)
+);
+'''
+
+# Normalized (dictionary-encoded) tags: every distinct (key, type) and every
+# distinct value is stored once and the tag tables hold integer ids.  The
+# nodes_tags and ways_tags views keep the (id, key, value, type) shape for
+# existing queries; grouping on key_id / value_id avoids the joins.
+SQL_ENCODED_TAGS = '''
+CREATE TABLE IF NOT EXISTS tag_keys (
+    id INTEGER PRIMARY KEY NOT NULL,
+    key TEXT NOT NULL,
+    type TEXT NOT NULL
+);
+
+CREATE TABLE IF NOT EXISTS tag_values (
+    id INTEGER PRIMARY KEY NOT NULL,
+    value TEXT NOT NULL
+);
+
+CREATE TABLE IF NOT EXISTS nodes_tags_encoded (
+    id INTEGER NOT NULL,
+    key_id INTEGER NOT NULL,
+    value_id INTEGER NOT NULL,
+    FOREIGN KEY (id) REFERENCES nodes(id),
+    FOREIGN KEY (key_id) REFERENCES tag_keys(id),
+    FOREIGN KEY (value_id) REFERENCES tag_values(id)
+);
+
+CREATE TABLE IF NOT EXISTS ways_tags_encoded (
+    id INTEGER NOT NULL,
+    key_id INTEGER NOT NULL,
+    value_id INTEGER NOT NULL,
+    FOREIGN KEY (id) REFERENCES ways(id),
+    FOREIGN KEY (key_id) REFERENCES tag_keys(id),
+    FOREIGN KEY (value_id) REFERENCES tag_values(id)
+);
+
+CREATE VIEW IF NOT EXISTS nodes_tags AS
+SELECT t.id AS id, k.key AS key, v.value AS value, k.type AS type
+FROM nodes_tags_encoded t
+JOIN tag_keys k ON k.id = t.key_id
+JOIN tag_values v ON v.id = t.value_id;
+
+CREATE VIEW IF NOT EXISTS ways_tags AS
+SELECT t.id AS id, k.key AS key, v.value AS value, k.type AS type
+FROM ways_tags_encoded t
+JOIN tag_keys k ON k.id = t.key_id
+JOIN tag_values v ON v.id = t.value_id;
+'''
+
+# created after the bulk load, which is much faster than maintaining them
+SQL_INDEXES = '''
+CREATE INDEX IF NOT EXISTS nodes_timestamp ON nodes (timestamp);
+CREATE INDEX IF NOT EXISTS nodes_uid_timestamp ON nodes (uid, timestamp);
+CREATE INDEX IF NOT EXISTS ways_timestamp ON ways (timestamp);
+CREATE INDEX IF NOT EXISTS ways_uid_timestamp ON ways (uid, timestamp);
+CREATE INDEX IF NOT EXISTS ways_nodes_id ON ways_nodes (id);
+'''
+
+SQL_TAG_INDEXES = '''
+CREATE INDEX IF NOT EXISTS nodes_tags_id ON nodes_tags (id);
+CREATE INDEX IF NOT EXISTS ways_tags_id ON ways_tags (id);
+'''
+
+SQL_ENCODED_TAG_INDEXES = '''
+CREATE INDEX IF NOT EXISTS nodes_tags_encoded_id ON nodes_tags_encoded (id);
+CREATE INDEX IF NOT EXISTS nodes_tags_encoded_key ON nodes_tags_encoded (key_id, value_id);
+CREATE INDEX IF NOT EXISTS ways_tags_encoded_id ON ways_tags_encoded (id);
+CREATE INDEX IF NOT EXISTS ways_tags_encoded_key ON ways_tags_encoded (key_id, value_id);
+'''
+
+# Full-text index over the searched tag values: one row per node or way that
+# has any of them, one column per (key, type) in SEARCH_KEYS.  Filled from the
+# tag tables (or their views) after the bulk load; prefix='2 3' keeps prefix
+# indexes for short prefix queries.
+SEARCH_KEYS = (
+    ('name', 'name', 'regular'),
+    ('street', 'street', 'addr'),
+    ('amenity', 'amenity', 'regular'),
+    ('cuisine', 'cuisine', 'regular'),
+    ('tourism', 'tourism', 'regular'),
+)
+
+SQL_SEARCH = '''
+CREATE VIRTUAL TABLE IF NOT EXISTS tag_search USING fts5 (
+    element UNINDEXED,
+    id UNINDEXED,
+    {columns},
+    tokenize = 'unicode61 remove_diacritics 2',
+    prefix = '2 3'
+);
+'''.format(columns=',\n    '.join(column for column, _, _ in SEARCH_KEYS))
+
+SQL_FILL_SEARCH = '''
+INSERT INTO tag_search (element, id, {columns})
+SELECT '{element}', id, {values}
+FROM {element}s_tags
+WHERE {where}
+GROUP BY id;
+'''
+
+
+# csv columns that are not text; converted in Python because SQLite's own
+# text -> REAL conversion is not correctly rounded
+COLUMN_TYPES = {'id': int, 'lat': float, 'lon': float, 'uid': int, 'version': int,
+                'changeset': int, 'timestamp': int, 'node_id': int, 'position': int}
+
+
+TAG_KEYS = ('node_tags', 'way_tags')  # shaped element keys of the tag tables
+
+# the tables and views an export writes, dropped before a database is written again
+EXPORT_TABLES = ('tag_search', 'tiles', 'nodes_tags', 'ways_tags', 'nodes_tags_encoded',
+                 'ways_tags_encoded', 'tag_keys', 'tag_values', 'ways_nodes', 'ways', 'nodes')
+
+
+def open_db(db_path=DB_PATH):
+    """Open a database as is (sqlite3 is only imported here)"""
+    import sqlite3
+    return sqlite3.connect(db_path)
+
+
+def connect(db_path=DB_PATH, encoded=False):
+    """Open (and if needed create) the database, with plain or encoded tags"""
+    db = open_db(db_path)
+    db.executescript(SQL_SCHEMA)
+    db.executescript(SQL_ENCODED_TAGS if encoded else SQL_TAGS)
+    return db
+
+
+def drop_tables(db, tables=EXPORT_TABLES):
+    """Drop the tables (or views) of an earlier export; other tables are kept"""
+    for name in tables:
+        row = db.execute("SELECT type FROM sqlite_master WHERE name = ? AND type IN "
+                         "('table', 'view')", (name,)).fetchone()
+        if row is not None:
+            db.execute('DROP {0} {1}'.format(row[0].upper(), name))
+    db.commit()
+
+
+def create_db(db_path=DB_PATH, encoded=False):
+    """Open the database with empty export tables, replacing those of an earlier export"""
+    db = open_db(db_path)
+    drop_tables(db)
+    db.executescript(SQL_SCHEMA)
+    db.executescript(SQL_ENCODED_TAGS if encoded else SQL_TAGS)
+    return db
+
+
+def is_encoded(db):
+    """True if the database stores its tags dictionary-encoded"""
+    return db.execute("SELECT 1 FROM sqlite_master WHERE name = 'nodes_tags_encoded'").fetchone() is not None
+
+
+def create_indexes(db):
+    db.executescript(SQL_INDEXES)
+    db.executescript(SQL_ENCODED_TAG_INDEXES if is_encoded(db) else SQL_TAG_INDEXES)
+
+
+def create_search_index(db):
+    """(Re)build the tag_search full-text index from the tag tables"""
+    db.executescript(SQL_SEARCH)
+    db.execute('DELETE FROM tag_search')
+    columns = ', '.join(column for column, _, _ in SEARCH_KEYS)
+    values = ', '.join("MAX(CASE WHEN key = '{0}' AND type = '{1}' THEN value END)".format(
+        key, kind) for _, key, kind in SEARCH_KEYS)
+    where = ' OR '.join("(key = '{0}' AND type = '{1}')".format(key, kind)
+                        for _, key, kind in SEARCH_KEYS)
+    for element in ('node', 'way'):
+        db.execute(SQL_FILL_SEARCH.format(element=element, columns=columns, values=values,
+                                          where=where))
+
+
+def insert_sql(table, fields):
+    return 'INSERT INTO {0} ({1}) VALUES ({2})'.format(
+        table, ', '.join(fields), ', '.join('?' * len(fields)))
+
+
+class Dictionary(object):
+    """Intern values as consecutive integer ids, starting at 1
+
+    The entries added since the last call to take_added are kept so the
+    writers can store the new part of the dictionary incrementally.
+    """
+
+    def __init__(self, entries=()):
+        self.ids = {}
+        for entry_id, value in entries:
+            self.ids[value] = entry_id
+        self.next_id = max(self.ids.values()) + 1 if self.ids else 1
+        self.added = []
+
+    def __len__(self):
+        return len(self.ids)
+
+    def encode(self, value):
+        entry_id = self.ids.get(value)
+        if entry_id is None:
+            entry_id = self.ids[value] = self.next_id
+            self.next_id += 1
+            self.added.append((entry_id, value))
+        return entry_id
+
+    def take_added(self):
+        added, self.added = self.added, []
+        return added
+
+
+class SqliteWriter(object):
+    """Write shaped elements into the database in batches of executemany
+
+    With encoded=True the tag tables are written dictionary-encoded, and with
+    search=True the tag_search index is built when the writer is closed.
+    """
+
+    def __init__(self, db, batch_size=BATCH_SIZE, encoded=False, search=False):
+        self.db = db
+        self.batch_size = batch_size
+        self.encoded = encoded
+        self.search = search
+        self.tables = {}
+        for table, _, fields, key in data.TABLES:
+            if encoded and key in TAG_KEYS:
+                fields = ['id', 'key_id', 'value_id']
+                table += '_encoded'
+            self.tables[key] = (insert_sql(table, fields), fields, [])
+        if encoded:
+            self.keys = Dictionary(((i, (k, t)) for i, k, t in
+                                    db.execute('SELECT id, key, type FROM tag_keys')))
+            self.values = Dictionary(db.execute('SELECT id, value FROM tag_values'))
+
+    def write(self, el):
+        for key, rows in el.items():
+            if key == data.WAY_NODE_REFS:
+                key = 'way_nodes'
+                pending = self.tables[key][2]
+                pending.extend(data.way_node_rows(el['way']['id'], rows))
+            elif self.encoded and key in TAG_KEYS:
+                pending = self.tables[key][2]
+                for row in rows:
+                    pending.append((row['id'], self.keys.encode((row['key'], row['type'])),
+                                    self.values.encode(row['value'])))
+            else:
+                _, fields, pending = self.tables[key]
+                if isinstance(rows, dict):
+                    rows = (rows,)
+                for row in rows:
+                    pending.append(tuple(row[field] for field in fields))
+            if len(pending) >= self.batch_size:
+                self.flush(key)
+
+    def flush(self, key):
+        if self.encoded:
+            self.db.executemany('INSERT INTO tag_keys (id, key, type) VALUES (?, ?, ?)',
+                                ((i, k, t) for i, (k, t) in self.keys.take_added()))
+            self.db.executemany('INSERT INTO tag_values (id, value) VALUES (?, ?)',
+                                self.values.take_added())
+        sql, _, pending = self.tables[key]
+        self.db.executemany(sql, pending)
+        del pending[:]
+
+    def close(self):
+        for key, (_, _, pending) in self.tables.items():
+            if pending:
+                self.flush(key)
+        create_indexes(self.db)
+        if self.search:
+            create_search_index(self.db)
+        self.db.commit()
+
+    def abort(self):
+        """Roll back the rows written so far; no indexes, no search table"""
+        for _, _, pending in self.tables.values():
+            del pending[:]
+        self.db.rollback()
+
+
+# ================================================== #
+#               Main Functions                       #
+# ================================================== #
+def load_csvs(db_path=DB_PATH, csv_dir='.', encoded=False, search=False):
+    """Load the csv(s) written by data.process_map into the database (see create_db)"""
+    db = create_db(db_path, encoded)
+    writer = SqliteWriter(db, encoded=encoded, search=search)
+    for table, path, fields, key in data.TABLES:
+        with open('{0}/{1}'.format(csv_dir, path), newline='', encoding='utf-8') as csv_file:
+            reader = csv.reader(csv_file)
+            header = next(reader)
+            types = [COLUMN_TYPES.get(field, str) for field in header]
+            rows = ([convert(value) for convert, value in zip(types, row)] for row in reader)
+            if encoded and key in TAG_KEYS:
+                for row in rows:
+                    writer.write({key: [dict(zip(header, row))]})
+            else:
+                db.executemany(insert_sql(table, header), rows)
+    writer.close()
+    return db
+
+
+def export_db(file_in, db_path=DB_PATH, validate=False, rules=None, encoded=False, checker=None,
+              area=None, cache=False, search=False, addresses=None, quarantine=None, tiles=None,
+              sinks=()):
+    """Shape every node and way of file_in straight into the database
+
+    The tables of an earlier export to db_path are replaced (see create_db).
+    tiles is an optional tiles.TileAggregator; its counts are saved to the
+    tiles table.  sinks are more writers fed in the same pass (see sinks.py).
+    """
+    validator = data.new_validator() if validate is True else None
+    if rules is not None:
+        from . import rules as cleaning
+        rules = cleaning.load_rules(None if rules is True else rules)
+
+    db = create_db(db_path, encoded)
+    try:
+        data.run_export(data.shaped_file(file_in, rules, area, cache, quarantine),
+                        data.export_writers(SqliteWriter(db, encoded=encoded, search=search),
+                                            checker, tiles, sinks),
+                        validator, addresses, quarantine)
+        if tiles is not None:
+            tiles.save(db)
+    except Exception:
+        db.close()
+        raise
+    return db
+
+
+def test():
+
+    db = export_db('example.osm', ':memory:')
+    assert db.execute('SELECT COUNT(*) FROM nodes').fetchone() == (20,)
+    assert db.execute('SELECT node_id, position FROM ways_nodes').fetchall() == [
+        (261114300, 0), (261114302, 1), (261210804, 2), (261114300, 3)]
+    assert db.execute('SELECT version, timestamp FROM ways').fetchone() == (1, 1388696392)
+
+    encoded = export_db('example.osm', ':memory:', encoded=True)
+    query = 'SELECT id, key, value, type FROM ways_tags ORDER BY id, key'
+    assert encoded.execute(query).fetchall() == db.execute(query).fetchall()
+    assert encoded.execute('SELECT COUNT(*) FROM tag_keys').fetchone() == (6,)
+
+    searchable = export_db('example.osm', ':memory:', encoded=True, search=True)
+    query = 'SELECT element, id, name, street, cuisine FROM tag_search'
+    assert searchable.execute(query).fetchall() == [
+        ('node', 757860928, "Shelly's Tasty Freeze", None, 'sausage')]
+
+    # exporting again to the same file replaces the earlier export, plain or encoded
+    import os
+    import re
+    import shutil
+    import tempfile
+    directory = tempfile.mkdtemp()
+    try:
+        db_path = os.path.join(directory, 'example.db')
+        for encoded in (False, False, True, False):
+            exported = export_db('example.osm', db_path, encoded=encoded, search=True)
+            assert exported.execute('SELECT COUNT(*) FROM nodes').fetchone() == (20,)
+            assert exported.execute('SELECT COUNT(*) FROM nodes_tags').fetchone() == (3,)
+            assert exported.execute('SELECT COUNT(*) FROM tag_search').fetchone() == (1,)
+            assert is_encoded(exported) == encoded
+            exported.close()
+
+        # a failed export rolls back: no rows, indexes or search table look complete
+        broken = os.path.join(directory, 'broken.osm')
+        with open('example.osm', encoding='utf-8') as osm_file:
+            nodes = osm_file.read().split('<node ')
+        nodes[11] = re.sub(r'lat="[^"]*"', 'lat="abc"', nodes[11], count=1)
+        with open(broken, 'w', encoding='utf-8') as osm_file:
+            osm_file.write('<node '.join(nodes))
+        try:
+            export_db(broken, db_path, search=True)
+        except data.ShapeError:
+            pass
+        else:
+            raise AssertionError('expected a ShapeError')
+        exported = open_db(db_path)
+        assert exported.execute('SELECT COUNT(*) FROM nodes').fetchone() == (0,)
+        assert exported.execute("SELECT name FROM sqlite_master WHERE type = 'index' "
+                                "AND sql IS NOT NULL OR name = 'tag_search'").fetchall() == []
+        exported.close()
+    finally:
+        shutil.rmtree(directory)
+
+
+if __name__ == '__main__':
+    encoded = '--encoded' in sys.argv
+    search = '--search' in sys.argv
+    args = [arg for arg in sys.argv[1:] if arg not in ('--encoded', '--search')]
+    if args == ['test']:
+        test()
+    elif len(args) > 1:
+        export_db(args[1], args[0], encoded=encoded, search=search).close()
+    else:
+        load_csvs(args[0] if args else DB_PATH, encoded=encoded, search=search).close()
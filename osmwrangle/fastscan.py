@@ -0,0 +1,320 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+A byte-level scanner for the lightweight statistics (tag counts, key types,
+unique users and the tag audits).
+
+Those passes only ever read one or two attributes per element, but iterparse
+still builds a full Element object (with an attribute dict) for every node,
+way, nd, member and tag in the file.  The functions here memory-map the OSM
+file instead and walk the raw bytes with mmap.find, yielding
+(element_type, value) tuples where value is a zero-copy memoryview slice of
+the file.  Nothing is decoded until you call decode() on a value, so counting
+passes that never look at the text never pay for it.
+
+The scanner relies on two properties that every OSM writer (and
+ET.tostring, which the sample writer uses) guarantees:
+- attributes are separated by a single space, and
+- '<' never appears inside an attribute value (it is illegal XML), so the
+  next '<' in the file is always past the end of the current start tag.
+Values may be double or single quoted, and anything inside a <!-- -->
+comment is skipped.
+
+Usage:
+    python -m osmwrangle.fastscan mapBend2.osm     # benchmark against iterparse
+"""
+import mmap
+import sys
+from html import unescape
+
+
+# bytes that can end an element name inside a start tag
+NAME_END = frozenset(b' \t\r\n/>')
+TOP_LEVEL = ('node', 'way', 'relation')
+
+# literal whitespace in an attribute value is normalised to a space by any
+# conforming XML parser, so do the same to match iterparse exactly
+ATTRIBUTE_WHITESPACE = {ord('\t'): ' ', ord('\n'): ' ', ord('\r'): ' '}
+
+
+def decode(value):
+    """Decode a value yielded by the scanner into text, the way iterparse would"""
+    text = str(value, 'utf-8').translate(ATTRIBUTE_WHITESPACE)
+    if '&' in text:
+        text = unescape(text)
+    return text
+
+
+# ================================================== #
+#               Helper Functions                     #
+# ================================================== #
+def open_map(filename):
+    """Return a read-only memory map over the whole file"""
+    with open(filename, 'rb') as osm_file:
+        return mmap.mmap(osm_file.fileno(), 0, access=mmap.ACCESS_READ)
+
+
+def close_map(mapped, buf=None):
+    """Unmap the file unless the caller still holds memoryview slices of it"""
+    if buf is not None:
+        buf.release()
+    try:
+        mapped.close()
+    except BufferError:
+        # slices are still alive; the mapping is released with the last one
+        pass
+
+
+def comment_end(mapped, pos):
+    """Return the offset past the <!-- comment starting at pos (the end of an unterminated one)"""
+    end = mapped.find(b'-->', pos + 4)
+    return end + 3 if end != -1 else len(mapped)
+
+
+def iter_start_tags(mapped):
+    """Yield (name, start, bound) for every start tag in the mapped file
+
+    start is the offset of the '<' and bound the offset of the next '<' (or
+    the end of the file), which is always past the end of the start tag.
+    """
+    find = mapped.find
+    size = len(mapped)
+    names = {}
+    pos = find(b'<')
+    while pos != -1:
+        bound = find(b'<', pos + 1)
+        first = mapped[pos + 1:pos + 2]
+        if first == b'!':
+            # skip comments wholesale since they may contain '<'
+            if mapped[pos:pos + 4] == b'<!--':
+                bound = find(b'<', comment_end(mapped, pos))
+        elif first != b'/' and first != b'?':
+            end = pos + 1
+            while end < size and mapped[end] not in NAME_END:
+                end += 1
+            raw = mapped[pos + 1:end]
+            name = names.get(raw)
+            if name is None:
+                name = names[raw] = raw.decode('utf-8')
+            yield name, pos, bound if bound != -1 else size
+        pos = bound
+
+
+def find_attribute(mapped, needle, start, bound):
+    """Return the (begin, end) offsets of an attribute value, or None
+
+    needle is the encoded ' name="' prefix of the attribute; the single
+    quoted ' name=\'' is found as well.
+    """
+    begin = mapped.find(needle, start, bound)
+    if begin == -1:
+        needle = single_quoted(needle)
+        begin = mapped.find(needle, start, bound)
+        if begin == -1:
+            return None
+    begin += len(needle)
+    return begin, mapped.find(needle[-1:], begin, bound)
+
+
+def attribute_needle(attribute):
+    """Encode an attribute name as the byte prefix find_attribute looks for"""
+    return b' ' + attribute.encode('utf-8') + b'="'
+
+
+def single_quoted(needle):
+    """The single quoted form of a needle ending in a double quote"""
+    return needle[:-1] + b"'"
+
+
+def iter_matches(mapped, needles):
+    """Yield (offset, needle) for every occurrence of needles outside a comment
+
+    The occurrences of all the needles are merged in file order.  Comments
+    are found with one forward search as well, so the whole scan stays
+    linear in the size of the file.
+    """
+    find = mapped.find
+    found = [find(needle) for needle in needles]
+    comment = find(b'<!--')
+    while True:
+        pos = min((p for p in found if p != -1), default=-1)
+        if pos == -1:
+            return
+        if comment != -1 and comment < pos:
+            end = comment_end(mapped, comment)
+            comment = find(b'<!--', end)
+            for i, p in enumerate(found):
+                if p != -1 and p < end:
+                    found[i] = find(needles[i], end)
+            continue
+        i = found.index(pos)
+        yield pos, needles[i]
+        found[i] = find(needles[i], pos + len(needles[i]))
+
+
+# ================================================== #
+#               Scanner Functions                    #
+# ================================================== #
+def iter_attribute(filename, attribute, element_types=None):
+    """Yield (element_type, value) for every element carrying attribute
+
+    element_types optionally restricts the scan to the given element names.
+    value is a memoryview slice of the file; use decode() to get the text.
+    The scan jumps from one occurrence of the attribute to the next, so
+    elements without it cost nothing.
+    """
+    mapped = open_map(filename)
+    buf = memoryview(mapped)
+    find = mapped.find
+    rfind = mapped.rfind
+    # one needle without the quote, so either quote costs a single search
+    needle = attribute_needle(attribute)[:-1]
+    names = {}
+    try:
+        for pos, _ in iter_matches(mapped, (needle,)):
+            begin = pos + len(needle) + 1
+            quote = mapped[begin - 1:begin]
+            if quote != b'"' and quote != b"'":
+                continue
+            end = find(quote, begin)
+            # the element owning the attribute starts at the previous '<'
+            start = rfind(b'<', 0, pos) + 1
+            stop = start
+            while mapped[stop] not in NAME_END:
+                stop += 1
+            raw = mapped[start:stop]
+            name = names.get(raw)
+            if name is None:
+                name = names[raw] = raw.decode('utf-8')
+            if element_types is None or name in element_types:
+                yield name, buf[begin:end]
+    finally:
+        close_map(mapped, buf)
+
+
+def iter_tag_values(filename, key, parents=('node', 'way'), ids=False):
+    """Yield (parent_type, value) for every <tag k="key"> inside one of parents
+
+    This is the access pattern of the audit functions (addr:street,
+    addr:postcode, addr:city, ...).  Rather than walking every element, the
+    scan jumps from one k="key" to the next and looks backwards for the
+    enclosing node, way or relation.  With ids=True the tuples are
+    (parent_type, parent_id, value), parent_id being an int.
+    """
+    mapped = open_map(filename)
+    buf = memoryview(mapped)
+    find = mapped.find
+    size = len(mapped)
+    escaped = key.replace('&', '&amp;').replace('<', '&lt;')
+    needles = (attribute_needle('k') + escaped.replace('"', '&quot;').encode('utf-8') + b'"',
+               single_quoted(attribute_needle('k'))
+               + escaped.replace("'", '&apos;').encode('utf-8') + b"'")
+    v_needle = attribute_needle('v')
+    id_needle = attribute_needle('id')
+    try:
+        for pos, _ in iter_matches(mapped, needles):
+            start = mapped.rfind(b'<', 0, pos)
+            if mapped[start:start + 5] == b'<tag ':
+                parent, parent_start = enclosing_element(mapped, start)
+                if parent in parents:
+                    bound = find(b'<', pos)
+                    span = find_attribute(mapped, v_needle, start, bound if bound != -1 else size)
+                    if span is not None:
+                        value = buf[span[0]:span[1]]
+                        if ids:
+                            id_span = find_attribute(mapped, id_needle, parent_start,
+                                                     find(b'<', parent_start + 1))
+                            yield parent, int(mapped[id_span[0]:id_span[1]]), value
+                        else:
+                            yield parent, value
+    finally:
+        close_map(mapped, buf)
+
+
+def enclosing_element(mapped, start):
+    """Return (name, offset) of the top level element containing offset start
+
+    (None, -1) if start is not inside a node, way or relation.
+    """
+    rfind = mapped.rfind
+    pos = start
+    while True:
+        pos = rfind(b'<', 0, pos)
+        if pos == -1:
+            return None, -1
+        end = pos + 1
+        closing = mapped[end:end + 1] == b'/'
+        if closing:
+            end += 1
+        begin = end
+        while mapped[end] not in NAME_END:
+            end += 1
+        name = mapped[begin:end].decode('utf-8')
+        if name in TOP_LEVEL:
+            return (None, -1) if closing else (name, pos)
+
+
+def count_elements(filename):
+    """Return a dictionary of element name -> count, like mapparser.count_tags"""
+    counts = {}
+    mapped = open_map(filename)
+    try:
+        for name, _, _ in iter_start_tags(mapped):
+            if name in counts:
+                counts[name] += 1
+            else:
+                counts[name] = 1
+    finally:
+        close_map(mapped)
+    return counts
+
+
+def test():
+
+    assert count_elements('example.osm') == {'bounds': 1,
+                                             'member': 3,
+                                             'nd': 4,
+                                             'node': 20,
+                                             'osm': 1,
+                                             'relation': 1,
+                                             'tag': 7,
+                                             'way': 1}
+    keys = [decode(v) for _, v in iter_attribute('example.osm', 'k', ('tag',))]
+    assert keys == ['amenity', 'cuisine', 'name', 'highway', 'building', 'FIXME', '#restriction']
+    uids = set(decode(v) for _, v in iter_attribute('example.osm', 'uid'))
+    assert len(uids) == 6
+    names = [(t, decode(v)) for t, v in iter_tag_values('example.osm', 'name')]
+    assert names == [('node', "Shelly's Tasty Freeze")]
+    names = [(t, i, decode(v)) for t, i, v in iter_tag_values('example.osm', 'name', ids=True)]
+    assert names == [('node', 757860928, "Shelly's Tasty Freeze")]
+
+    # comments are skipped and single quoted values read like double quoted ones
+    import os
+    import tempfile
+    handle, path = tempfile.mkstemp(suffix='.osm')
+    with os.fdopen(handle, 'wb') as osm_file:
+        osm_file.write(b"""<?xml version='1.0' encoding='UTF-8'?>
+<osm>
+ <!-- <node id="9" uid="999"><tag k="name" v="commented"/></node> -->
+ <node id='1' uid='101'><tag k='name' v='single &apos;quoted&apos;'/></node>
+ <!-- a comment without tags -->
+ <node id="2" uid="102"><tag k="name" v="double 'quoted'"/></node>
+</osm>""")
+    try:
+        uids = [decode(v) for _, v in iter_attribute(path, 'uid')]
+        assert uids == ['101', '102']
+        keys = [decode(v) for _, v in iter_attribute(path, 'k', ('tag',))]
+        assert keys == ['name', 'name']
+        names = [(t, i, decode(v)) for t, i, v in iter_tag_values(path, 'name', ids=True)]
+        assert names == [('node', 1, "single 'quoted'"), ('node', 2, "double 'quoted'")]
+        assert count_elements(path) == {'osm': 1, 'node': 2, 'tag': 2}
+    finally:
+        os.remove(path)
+
+
+if __name__ == "__main__":
+    if len(sys.argv) > 1:
+        from . import benchmark
+        benchmark.main(['scan'] + sys.argv[1:])
+    else:
+        test()
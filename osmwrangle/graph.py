@@ -0,0 +1,322 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Road graph of the routable highway ways, as compressed sparse row arrays.
+
+build_graph reads the highway ways of an exported database (database.py),
+keeps the classes in SPEEDS, and turns consecutive way nodes into edges:
+both directions, or one for oneway=yes/-1, junction=roundabout and
+motorways.  The graph is held in numpy arrays:
+
+    node_ids   int64    OSM node id of every vertex (sorted)
+    lat, lon   float64  vertex coordinates
+    indptr     int64    edges of vertex v are indptr[v]:indptr[v + 1]
+    indices    int64    target vertex of every edge
+    lengths    float64  edge length in meters (haversine)
+    times      float64  edge travel time in seconds at the SPEEDS of its way
+
+Graph.save writes one raw file per array plus graph.json, like columnar.py,
+and load_graph memory-maps them back.  bfs expands whole frontiers with
+array operations; dijkstra runs a binary heap over the arrays (through
+memoryviews, so a memory-mapped graph is never copied into Python objects).
+numpy is imported when a graph is built or loaded.
+
+Usage:
+    python -m osmwrangle.graph BendOR.db graph/                 # build and save
+    python -m osmwrangle.graph graph/ 261114300 261210804       # shortest route
+"""
+import json
+import math
+import os
+import sys
+from array import array
+from heapq import heappop, heappush
+
+from . import database
+
+
+EARTH_RADIUS = 6371008.8  # meters, mean radius
+
+# routable highway classes and their assumed speeds in km/h
+SPEEDS = {
+    'motorway': 100, 'motorway_link': 60, 'trunk': 80, 'trunk_link': 50,
+    'primary': 65, 'primary_link': 45, 'secondary': 55, 'secondary_link': 40,
+    'tertiary': 45, 'tertiary_link': 35, 'unclassified': 40, 'residential': 40,
+    'living_street': 15, 'service': 20, 'road': 30, 'track': 20,
+}
+ONEWAY = {'yes': 1, 'true': 1, '1': 1, '-1': -1, 'reverse': -1, 'no': 0, 'false': 0, '0': 0}
+IMPLIED_ONEWAY = ('motorway',)
+
+ARRAYS = (('node_ids', 'i8'), ('lat', 'f8'), ('lon', 'f8'), ('indptr', 'i8'),
+          ('indices', 'i8'), ('lengths', 'f8'), ('times', 'f8'))
+
+SQL_HIGHWAYS = '''
+SELECT h.id, h.value,
+       (SELECT value FROM ways_tags o
+        WHERE o.id = h.id AND o.key = 'oneway' AND o.type = 'regular'),
+       (SELECT value FROM ways_tags j
+        WHERE j.id = h.id AND j.key = 'junction' AND j.type = 'regular')
+FROM ways_tags h
+WHERE h.key = 'highway' AND h.type = 'regular';
+'''
+
+SQL_GRAPH_WAYS = '''
+CREATE TEMP TABLE IF NOT EXISTS graph_ways (
+    id INTEGER PRIMARY KEY NOT NULL,
+    speed REAL NOT NULL,
+    direction INTEGER NOT NULL
+);
+DELETE FROM temp.graph_ways;
+'''
+
+SQL_WAY_NODES = '''
+SELECT wn.id, wn.node_id FROM ways_nodes wn
+JOIN temp.graph_ways g ON g.id = wn.id
+ORDER BY wn.id, wn.position;
+'''
+
+SQL_NODES = '''
+SELECT id, lat, lon FROM nodes
+WHERE id IN (SELECT wn.node_id FROM ways_nodes wn JOIN temp.graph_ways g ON g.id = wn.id)
+ORDER BY id;
+'''
+
+
+def haversine(lat1, lon1, lat2, lon2):
+    """Great circle distances in meters between arrays of coordinates in degrees"""
+    import numpy as np
+    lat1, lon1, lat2, lon2 = (np.radians(values) for values in (lat1, lon1, lat2, lon2))
+    a = np.sin((lat2 - lat1) / 2) ** 2 + \
+        np.cos(lat1) * np.cos(lat2) * np.sin((lon2 - lon1) / 2) ** 2
+    return 2 * EARTH_RADIUS * np.arcsin(np.sqrt(a))
+
+
+def way_direction(highway, oneway, junction):
+    """1 (with the way), -1 (against it) or 0 (both ways)"""
+    if oneway is not None and oneway in ONEWAY:
+        return ONEWAY[oneway]
+    if junction == 'roundabout' or highway in IMPLIED_ONEWAY:
+        return 1
+    return 0
+
+
+class Graph(object):
+    """A directed graph in CSR arrays; vertices are indexes into node_ids"""
+
+    def __init__(self, node_ids, lat, lon, indptr, indices, lengths, times):
+        self.node_ids = node_ids
+        self.lat = lat
+        self.lon = lon
+        self.indptr = indptr
+        self.indices = indices
+        self.lengths = lengths
+        self.times = times
+
+    def __len__(self):
+        return len(self.node_ids)
+
+    @property
+    def edges(self):
+        return len(self.indices)
+
+    def vertex(self, node_id):
+        """The vertex of an OSM node id (KeyError if it is not in the graph)"""
+        import numpy as np
+        i = int(np.searchsorted(self.node_ids, node_id))
+        if i == len(self.node_ids) or self.node_ids[i] != node_id:
+            raise KeyError(node_id)
+        return i
+
+    def bfs(self, source, max_depth=None):
+        """Hops from the node source to every vertex (-1 if unreachable)"""
+        import numpy as np
+        hops = np.full(len(self), -1, dtype='i4')
+        frontier = np.array([self.vertex(source)], dtype='i8')
+        hops[frontier] = depth = 0
+        while frontier.size and (max_depth is None or depth < max_depth):
+            starts = self.indptr[frontier]
+            counts = self.indptr[frontier + 1] - starts
+            # the edge indexes of all frontier vertices, concatenated
+            offsets = np.repeat(starts - (np.cumsum(counts) - counts), counts)
+            targets = self.indices[offsets + np.arange(counts.sum())]
+            frontier = np.unique(targets[hops[targets] < 0])
+            depth += 1
+            hops[frontier] = depth
+        return hops
+
+    def dijkstra(self, source, weight='lengths', target=None, limit=None):
+        """Return (costs, predecessors) from the node source, as arrays over the vertices
+
+        weight is 'lengths' (meters) or 'times' (seconds).  The search stops
+        at the node target, or beyond a cost of limit; unreached vertices
+        cost inf and have predecessor -1.
+        """
+        import numpy as np
+        indptr = memoryview(self.indptr)
+        indices = memoryview(self.indices)
+        weights = memoryview(getattr(self, weight))
+        costs = array('d', [math.inf]) * len(self)
+        predecessors = array('q', [-1]) * len(self)
+        start = self.vertex(source)
+        stop = self.vertex(target) if target is not None else -1
+        costs[start] = 0.0
+        heap = [(0.0, start)]
+        while heap:
+            cost, v = heappop(heap)
+            if cost > costs[v]:
+                continue
+            if v == stop or (limit is not None and cost > limit):
+                break
+            for edge in range(indptr[v], indptr[v + 1]):
+                u = indices[edge]
+                reached = cost + weights[edge]
+                if reached < costs[u]:
+                    costs[u] = reached
+                    predecessors[u] = v
+                    heappush(heap, (reached, u))
+        costs = np.frombuffer(costs, dtype='f8')
+        predecessors = np.frombuffer(predecessors, dtype='i8')
+        if limit is not None:
+            beyond = costs > limit
+            costs[beyond] = math.inf
+            predecessors[beyond] = -1
+        return costs, predecessors
+
+    def route(self, source, target, weight='lengths'):
+        """Return (cost, [node ids]) of the cheapest route, (inf, []) if there is none"""
+        costs, predecessors = self.dijkstra(source, weight, target)
+        v = self.vertex(target)
+        if math.isinf(costs[v]):
+            return math.inf, []
+        path = []
+        while v != -1:
+            path.append(int(self.node_ids[v]))
+            v = predecessors[v]
+        return float(costs[self.vertex(target)]), path[::-1]
+
+    def reachable(self, source, limit, weight='times'):
+        """The node ids reachable from source within limit (seconds, or meters)"""
+        costs, _ = self.dijkstra(source, weight, limit=limit)
+        return self.node_ids[costs <= limit]
+
+    def save(self, directory):
+        """Write every array to <directory>/<name>.bin, described by graph.json"""
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+        for name, dtype in ARRAYS:
+            getattr(self, name).astype(dtype, copy=False).tofile(
+                os.path.join(directory, '{0}.bin'.format(name)))
+        manifest = {'vertices': len(self), 'edges': self.edges,
+                    'arrays': dict((name, {'dtype': dtype, 'length': len(getattr(self, name))})
+                                   for name, dtype in ARRAYS)}
+        with open(os.path.join(directory, 'graph.json'), 'w') as output:
+            json.dump(manifest, output, indent=1, sort_keys=True)
+
+
+# ================================================== #
+#               Main Functions                       #
+# ================================================== #
+def build_graph(db, speeds=SPEEDS):
+    """Build the Graph of the routable highway ways of an exported database"""
+    import numpy as np
+    from . import analysis
+
+    db.executescript(SQL_GRAPH_WAYS)
+    db.executemany('INSERT INTO temp.graph_ways (id, speed, direction) VALUES (?, ?, ?)',
+                   ((way_id, speeds[highway], way_direction(highway, oneway, junction))
+                    for way_id, highway, oneway, junction in db.execute(SQL_HIGHWAYS)
+                    if highway in speeds))
+    ways = analysis.query_frame(db, 'SELECT id, speed, direction FROM temp.graph_ways ORDER BY id')
+    way_nodes = analysis.query_frame(db, SQL_WAY_NODES)
+    nodes = analysis.query_frame(db, SQL_NODES)
+    way_ids = ways['id'].to_numpy(dtype='i8')
+    node_ids = nodes['id'].to_numpy(dtype='i8')
+    way, node = way_nodes['id'].to_numpy(dtype='i8'), way_nodes['node_id'].to_numpy(dtype='i8')
+
+    # an edge between every two consecutive nodes of the same way
+    same = way[1:] == way[:-1]
+    edge_way = way[:-1][same]
+    a = np.searchsorted(node_ids, node[:-1][same])
+    b = np.searchsorted(node_ids, node[1:][same])
+    known = (a < len(node_ids)) & (b < len(node_ids))  # refs to missing nodes are dropped
+    known[known] = (node_ids[a[known]] == node[:-1][same][known]) & \
+                   (node_ids[b[known]] == node[1:][same][known])
+    keep = known & (a != b)
+    a, b, edge_way = a[keep], b[keep], edge_way[keep]
+
+    lat = nodes['lat'].to_numpy(dtype='f8')
+    lon = nodes['lon'].to_numpy(dtype='f8')
+    lengths = haversine(lat[a], lon[a], lat[b], lon[b])
+    w = np.searchsorted(way_ids, edge_way)
+    times = lengths / (ways['speed'].to_numpy(dtype='f8')[w] / 3.6)
+    direction = ways['direction'].to_numpy(dtype='i8')[w]
+    forward, backward = direction >= 0, direction <= 0
+
+    src = np.concatenate([a[forward], b[backward]])
+    dst = np.concatenate([b[forward], a[backward]])
+    lengths = np.concatenate([lengths[forward], lengths[backward]])
+    times = np.concatenate([times[forward], times[backward]])
+    order = np.lexsort((dst, src))
+    indptr = np.zeros(len(node_ids) + 1, dtype='i8')
+    np.cumsum(np.bincount(src, minlength=len(node_ids)), out=indptr[1:])
+    return Graph(node_ids, lat, lon, indptr, dst[order], lengths[order], times[order])
+
+
+def load_graph(directory):
+    """Memory-map a graph written by Graph.save"""
+    import numpy as np
+    with open(os.path.join(directory, 'graph.json')) as manifest:
+        arrays = json.load(manifest)['arrays']
+    values = {}
+    for name, _ in ARRAYS:
+        spec = arrays[name]
+        path = os.path.join(directory, '{0}.bin'.format(name))
+        if spec['length']:
+            values[name] = np.memmap(path, dtype=spec['dtype'], mode='r', shape=(spec['length'],))
+        else:
+            values[name] = np.empty(0, dtype=spec['dtype'])
+    return Graph(**values)
+
+
+def test():
+
+    import shutil
+    import tempfile
+    import numpy as np
+
+    db = database.export_db('example.osm', ':memory:')
+    graph = build_graph(db)
+    # the service way 258219703 is a closed ring of three nodes
+    assert list(graph.node_ids) == [261114300, 261114302, 261210804] and graph.edges == 6
+    assert list(graph.bfs(261114300)) == [0, 1, 1]
+    length, path = graph.route(261114302, 261210804)
+    assert path == [261114302, 261210804]
+    assert abs(length - haversine(41.9730351, -87.6891632, 41.9741219, -87.6932069)) < 1e-6
+    assert list(graph.reachable(261114300, 1.0, 'lengths')) == [261114300, 261114302]
+
+    db.execute("INSERT INTO ways_tags VALUES (258219703, 'oneway', 'yes', 'regular')")
+    oneway = build_graph(db)
+    assert oneway.edges == 3
+    assert oneway.route(261114302, 261114300)[1] == [261114302, 261210804, 261114300]
+    assert list(oneway.bfs(261114302, max_depth=1)) == [-1, 0, 1]
+
+    directory = tempfile.mkdtemp()
+    try:
+        oneway.save(directory)
+        loaded = load_graph(directory)
+        assert isinstance(loaded.indices, np.memmap)
+        assert loaded.route(261114302, 261114300) == oneway.route(261114302, 261114300)
+    finally:
+        shutil.rmtree(directory)
+
+
+if __name__ == "__main__":
+    if len(sys.argv) == 3:
+        graph = build_graph(database.open_db(sys.argv[1]))
+        graph.save(sys.argv[2])
+        print(json.dumps({'vertices': len(graph), 'edges': graph.edges}))
+    elif len(sys.argv) == 4:
+        cost, path = load_graph(sys.argv[1]).route(int(sys.argv[2]), int(sys.argv[3]))
+        print(json.dumps({'meters': cost, 'nodes': path}))
+    else:
+        test()
@@ -0,0 +1,275 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Referential integrity of an OSM export, checked while the elements are shaped.
+
+Sampled files (sample.osm keeps every k-th top level element) and clipped
+extracts break the links between the tables: ways_nodes.node_id values that
+are not in nodes, ids that occur twice, nodes outside the <bounds> of the
+file.  IntegrityChecker is fed the shaped elements of an export and reports
+
+- duplicate node and way ids,
+- dangling way refs (node ids that are not in the file),
+- nodes outside the <bounds> element.
+
+Node and way ids are kept in IdSet, split into pages of PAGE_BITS ids that
+are only allocated where ids occur.  A page holds a sorted array of 2 byte
+offsets until it has ARRAY_LIMIT ids and becomes a bitset after that, so
+dense id ranges cost a bit per id and the scattered ids of an extract (a
+city's nodes are spread over billions of ids) 2 bytes each, instead of a
+Python int in a set, and way refs are checked without a database join.  OSM files list nodes before
+ways, so a ref is normally final when it is checked; the missing node ids
+are kept in a second IdSet and checked again at the end in case nodes come
+after ways.  At most SAMPLE_SIZE example ids are kept per problem.
+
+Usage:
+    python -m osmwrangle.integrity sample.osm        # print the report, exit 1 on problems
+"""
+import json
+import sys
+from array import array
+from bisect import bisect_left
+
+try:
+    import xml.etree.cElementTree as ET
+except ImportError:  # removed in Python 3.9
+    import xml.etree.ElementTree as ET
+
+from . import data
+
+
+PAGE_SHIFT = 16
+PAGE_BITS = 1 << PAGE_SHIFT   # ids per page, 8 KiB of bits
+ARRAY_LIMIT = PAGE_BITS >> 4  # ids per array page, as big as a bitset page when full
+SAMPLE_SIZE = 10              # example ids kept per problem
+
+PROBLEMS = ('duplicate_nodes', 'duplicate_ways', 'dangling_refs', 'out_of_bounds')
+
+
+class IdSet(object):
+    """A set of integer ids stored as pages of sorted offsets or of bits"""
+
+    def __init__(self):
+        self.pages = {}
+        self.count = 0
+
+    def __len__(self):
+        return self.count
+
+    def __contains__(self, element_id):
+        page = self.pages.get(element_id >> PAGE_SHIFT)
+        if page is None:
+            return False
+        bit = element_id & (PAGE_BITS - 1)
+        if type(page) is array:
+            i = bisect_left(page, bit)
+            return i < len(page) and page[i] == bit
+        return bool(page[bit >> 3] & (1 << (bit & 7)))
+
+    def add(self, element_id):
+        """Add an id; return True if it was already in the set"""
+        page_number = element_id >> PAGE_SHIFT
+        page = self.pages.get(page_number)
+        bit = element_id & (PAGE_BITS - 1)
+        if page is None:
+            self.pages[page_number] = array('H', (bit,))
+            self.count += 1
+            return False
+        if type(page) is array:
+            i = bisect_left(page, bit)
+            if i < len(page) and page[i] == bit:
+                return True
+            if len(page) < ARRAY_LIMIT:
+                page.insert(i, bit)
+                self.count += 1
+                return False
+            page = self.pages[page_number] = bitset(page)
+        mask = 1 << (bit & 7)
+        if page[bit >> 3] & mask:
+            return True
+        page[bit >> 3] |= mask
+        self.count += 1
+        return False
+
+    def __iter__(self):
+        """Yield the ids in ascending order"""
+        for page_number in sorted(self.pages):
+            page = self.pages[page_number]
+            base = page_number << PAGE_SHIFT
+            if type(page) is array:
+                for bit in page:
+                    yield base + bit
+                continue
+            for offset, byte in enumerate(page):
+                if byte:
+                    for bit in range(8):
+                        if byte & (1 << bit):
+                            yield base + (offset << 3) + bit
+
+    def nbytes(self):
+        return sum(page.itemsize * len(page) if type(page) is array else len(page)
+                   for page in self.pages.values())
+
+
+def bitset(offsets):
+    """Return the bitset page holding the sorted offsets of an array page"""
+    page = bytearray(PAGE_BITS >> 3)
+    for bit in offsets:
+        page[bit >> 3] |= 1 << (bit & 7)
+    return page
+
+
+def read_bounds(osm_file):
+    """Return (minlat, minlon, maxlat, maxlon) of the <bounds> element, or None
+
+    Only the start of the file is parsed: <bounds> comes before the first
+    node, way or relation.
+    """
+    for _, elem in ET.iterparse(osm_file, events=('start',)):
+        if elem.tag == 'bounds':
+            return tuple(float(elem.get(side)) for side in ('minlat', 'minlon', 'maxlat', 'maxlon'))
+        if elem.tag in ('node', 'way', 'relation'):
+            return None
+    return None
+
+
+class IntegrityChecker(object):
+    """Check the shaped elements of an export, one at a time, in file order"""
+
+    def __init__(self, bounds=None, sample_size=SAMPLE_SIZE):
+        self.bounds = bounds
+        self.sample_size = sample_size
+        self.nodes = IdSet()
+        self.ways = IdSet()
+        self.missing = IdSet()  # node ids referenced before (or without) their node
+        self.refs = 0
+        self.counts = dict((problem, 0) for problem in PROBLEMS)
+        self.samples = dict((problem, []) for problem in PROBLEMS)
+        self.nodes_after_ways = False
+
+    def problem(self, problem, sample):
+        self.counts[problem] += 1
+        if len(self.samples[problem]) < self.sample_size:
+            self.samples[problem].append(sample)
+
+    def write(self, el):
+        """Check one element as shaped by data.shape_element"""
+        if 'node' in el:
+            node = el['node']
+            if self.nodes.add(node['id']):
+                self.problem('duplicate_nodes', node['id'])
+            if self.ways.count:
+                self.nodes_after_ways = True
+            if self.bounds is not None:
+                minlat, minlon, maxlat, maxlon = self.bounds
+                if not (minlat <= node['lat'] <= maxlat and minlon <= node['lon'] <= maxlon):
+                    self.problem('out_of_bounds', node['id'])
+        elif 'way' in el:
+            way_id = el['way']['id']
+            if self.ways.add(way_id):
+                self.problem('duplicate_ways', way_id)
+            refs = el.get(data.WAY_NODE_REFS)
+            if refs is None:
+                refs = [row['node_id'] for row in el['way_nodes']]
+            self.refs += len(refs)
+            nodes = self.nodes
+            for ref in refs:
+                if ref not in nodes:
+                    self.missing.add(ref)
+                    self.problem('dangling_refs', [way_id, ref])
+
+    def close(self):
+        """Drop the refs resolved by nodes that came after their ways"""
+        if not self.nodes_after_ways:
+            return
+        still_missing = IdSet()
+        for ref in self.missing:
+            if ref not in self.nodes:
+                still_missing.add(ref)
+        self.missing = still_missing
+        self.samples['dangling_refs'] = [sample for sample in self.samples['dangling_refs']
+                                         if sample[1] in still_missing]
+
+    def abort(self):
+        """Keep the findings so far; the report of a failed export is partial"""
+
+    def report(self):
+        """Return the findings as a JSON-serializable dict
+
+        'dangling_refs' counts the refs whose node was missing when the way
+        was checked; it is exact unless 'nodes_after_ways' is set, in which
+        case it is an upper bound ('dangling_node_ids' is always exact).
+        """
+        report = {'bounds': self.bounds, 'nodes': len(self.nodes), 'ways': len(self.ways),
+                  'refs': self.refs, 'nodes_after_ways': self.nodes_after_ways,
+                  'dangling_node_ids': len(self.missing),
+                  'id_set_bytes': self.nodes.nbytes() + self.ways.nbytes() + self.missing.nbytes(),
+                  'samples': self.samples}
+        report.update(self.counts)
+        return report
+
+    def ok(self):
+        return not any(self.counts[problem] for problem in PROBLEMS if problem != 'dangling_refs') \
+            and not len(self.missing)
+
+
+# ================================================== #
+#               Main Function                        #
+# ================================================== #
+def check_file(osm_file, sample_size=SAMPLE_SIZE):
+    """Shape every node and way of osm_file and return its IntegrityChecker"""
+    checker = IntegrityChecker(read_bounds(osm_file), sample_size)
+    for element in data.get_element(osm_file, tags=('node', 'way')):
+        el = data.shape_element(element, way_node_refs=True)
+        if el:
+            checker.write(el)
+    checker.close()
+    return checker
+
+
+def test():
+
+    ids = IdSet()
+    assert not ids.add(5) and ids.add(5) and not ids.add(-3) and not ids.add(10 ** 10)
+    assert 5 in ids and 6 not in ids and list(ids) == [-3, 5, 10 ** 10] and len(ids) == 3
+    assert ids.nbytes() == 6
+
+    # sparse ids stay 2 bytes each, a page turns into a bitset once it is dense
+    sparse = [i * 1000003 for i in range(5000)]
+    ids = IdSet()
+    assert not any(ids.add(i) for i in reversed(sparse)) and all(ids.add(i) for i in sparse)
+    assert list(ids) == sparse and ids.nbytes() == 2 * len(sparse)
+    assert 1000003 in ids and 1000004 not in ids
+    dense = range(70000, 70000 + ARRAY_LIMIT + 10)
+    assert not any(ids.add(i) for i in dense) and all(i in ids for i in dense)
+    assert list(ids) == sorted(set(sparse) | set(dense)) and len(ids) == len(sparse) + len(dense)
+    assert ids.nbytes() == 2 * len(sparse) + (PAGE_BITS >> 3)
+
+    checker = check_file('example.osm')
+    report = checker.report()
+    assert report['nodes'] == 20 and report['ways'] == 1 and report['refs'] == 4
+    assert report['dangling_refs'] == 0 and report['duplicate_nodes'] == 0
+    assert report['out_of_bounds'] == 14  # the excerpt keeps nodes outside its bounds
+    assert report['bounds'] == (41.97045, -87.69283, 41.97593, -87.68948)
+
+    # a way before its nodes, a dangling ref, a duplicate and a stray node
+    checker = IntegrityChecker(bounds=(0.0, 0.0, 1.0, 1.0))
+    checker.write({'way': {'id': 1}, data.WAY_NODE_REFS: array('q', [10, 11, 12])})
+    for node_id, lat in ((10, 0.5), (11, 0.5), (10, 0.5), (13, 2.0)):
+        checker.write({'node': {'id': node_id, 'lat': lat, 'lon': 0.5}})
+    checker.close()
+    report = checker.report()
+    assert report['nodes_after_ways'] and report['dangling_node_ids'] == 1
+    assert report['samples']['dangling_refs'] == [[1, 12]]
+    assert report['duplicate_nodes'] == 1 and report['samples']['out_of_bounds'] == [13]
+    assert not checker.ok()
+
+
+if __name__ == "__main__":
+    if len(sys.argv) > 1:
+        checker = check_file(sys.argv[1])
+        json.dump(checker.report(), sys.stdout, indent=1, sort_keys=True)
+        print()
+        sys.exit(0 if checker.ok() else 1)
+    else:
+        test()
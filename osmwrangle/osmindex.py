@@ -0,0 +1,287 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Random access to single elements of an OSM XML file by (type, id).
+
+build_index makes one pass over the memory-mapped file (see fastscan.py) and
+records where every top level node, way and relation starts and how long it
+is.  The index is written next to the OSM file as a binary file with one
+sorted section per element type:
+
+    header:   magic, source size, source mtime, node/way/relation counts
+    section:  ids (int64, sorted), byte offsets (uint64), lengths (uint32)
+
+OsmIndex memory-maps both files and answers a lookup with a binary search
+over the id column, so fetching and parsing one element only touches the
+few pages that hold it.  It is meant for spot audits and for rebuilding the
+elements referenced by ways_nodes without re-running iterparse.
+
+Usage:
+    python -m osmwrangle.osmindex mapBend2.osm                  # build mapBend2.osm.idx
+    python -m osmwrangle.osmindex mapBend2.osm way 123456789    # print one element
+"""
+import bisect
+import os
+import struct
+import sys
+from array import array
+
+try:
+    import xml.etree.cElementTree as ET
+except ImportError:  # removed in Python 3.9
+    import xml.etree.ElementTree as ET
+
+from . import fastscan
+
+
+INDEX_SUFFIX = '.idx'
+ELEMENT_TYPES = fastscan.TOP_LEVEL  # ('node', 'way', 'relation')
+
+# native byte order, so the id column can be bisected in place; the magic
+# number doubles as a byte order check
+MAGIC = 0x3158444d534f  # 'OSMDX1'
+HEADER = struct.Struct('=qqq3q')
+
+
+# ================================================== #
+#               Helper Functions                     #
+# ================================================== #
+def index_path(osm_file):
+    """Default location of the index for osm_file"""
+    return osm_file + INDEX_SUFFIX
+
+
+def source_stamp(osm_file):
+    """(size, mtime in ns) used to detect an index that is out of date"""
+    stat = os.stat(osm_file)
+    return stat.st_size, stat.st_mtime_ns
+
+
+def iter_element_spans(mapped):
+    """Yield (element_type, id, offset, length) for every top level element
+
+    Only the '<' of each top level element is visited: after an element the
+    scan jumps straight past its end tag to the next sibling.  Comments are
+    skipped as a whole, so commented-out elements are not indexed.
+    """
+    find = mapped.find
+    id_needle = fastscan.attribute_needle('id')
+    pos = find(b'<')
+    while pos != -1:
+        if mapped[pos:pos + 4] == b'<!--':
+            pos = find(b'<', fastscan.comment_end(mapped, pos))
+            continue
+        end = pos + 1
+        while mapped[end] not in fastscan.NAME_END:
+            end += 1
+        name = mapped[pos + 1:end].decode('utf-8')
+        if name in ELEMENT_TYPES:
+            bound = find(b'<', end)
+            close = mapped.rfind(b'>', end, bound if bound != -1 else len(mapped))
+            if mapped[close - 1:close] == b'/':
+                stop = close + 1
+            else:
+                stop = find(b'</' + name.encode('utf-8') + b'>', close) + len(name) + 3
+            span = fastscan.find_attribute(mapped, id_needle, end, close)
+            yield name, int(mapped[span[0]:span[1]]), pos, stop - pos
+            pos = find(b'<', stop)
+        else:
+            pos = find(b'<', end)
+
+
+def write_section(output, ids, offsets, lengths):
+    """Write one element type's columns, sorted by id and padded to 8 bytes"""
+    if any(ids[i] > ids[i + 1] for i in range(len(ids) - 1)):
+        order = sorted(range(len(ids)), key=ids.__getitem__)
+        ids = array('q', (ids[i] for i in order))
+        offsets = array('Q', (offsets[i] for i in order))
+        lengths = array('I', (lengths[i] for i in order))
+    ids.tofile(output)
+    offsets.tofile(output)
+    lengths.tofile(output)
+    if len(lengths) % 2:
+        output.write(b'\0' * 4)
+
+
+# ================================================== #
+#               Main Functions                       #
+# ================================================== #
+def build_index(osm_file, index_file=None):
+    """Scan osm_file once and write its (type, id) -> (offset, length) index"""
+    index_file = index_file or index_path(osm_file)
+    columns = dict((name, (array('q'), array('Q'), array('I'))) for name in ELEMENT_TYPES)
+
+    mapped = fastscan.open_map(osm_file)
+    try:
+        for name, element_id, offset, length in iter_element_spans(mapped):
+            ids, offsets, lengths = columns[name]
+            ids.append(element_id)
+            offsets.append(offset)
+            lengths.append(length)
+    finally:
+        fastscan.close_map(mapped)
+
+    size, mtime = source_stamp(osm_file)
+    counts = [len(columns[name][0]) for name in ELEMENT_TYPES]
+    with open(index_file, 'wb') as output:
+        output.write(HEADER.pack(MAGIC, size, mtime, *counts))
+        for name in ELEMENT_TYPES:
+            write_section(output, *columns[name])
+    return index_file
+
+
+class OsmIndex(object):
+    """Fetch single elements of an OSM file through its offset index
+
+    The index is built on first use, and rebuilt if the OSM file has changed
+    since it was written.
+    """
+
+    def __init__(self, osm_file, index_file=None):
+        self.osm_file = osm_file
+        self.index_file = index_file or index_path(osm_file)
+        if not os.path.exists(self.index_file) or self._stale():
+            build_index(osm_file, self.index_file)
+        self._index = fastscan.open_map(self.index_file)
+        self._osm = fastscan.open_map(osm_file)
+        self._buf = memoryview(self._index)
+        self._sections = {}
+        try:
+            self._read_sections()
+        except Exception:
+            self.close()
+            raise
+
+    def _read_sections(self):
+        magic, _, _, n_nodes, n_ways, n_relations = HEADER.unpack_from(self._index)
+        if magic != MAGIC:
+            raise ValueError("{0} is not an OSM index for this machine".format(self.index_file))
+        position = HEADER.size
+        for name, count in zip(ELEMENT_TYPES, (n_nodes, n_ways, n_relations)):
+            if position + 20 * count > len(self._index):
+                raise ValueError("{0} is truncated".format(self.index_file))
+            ids = self._buf[position:position + 8 * count].cast('q')
+            position += 8 * count
+            offsets = self._buf[position:position + 8 * count].cast('Q')
+            position += 8 * count
+            lengths = self._buf[position:position + 4 * count].cast('I')
+            position += 4 * count + 4 * (count % 2)
+            self._sections[name] = (ids, offsets, lengths)
+
+    def _stale(self):
+        with open(self.index_file, 'rb') as index:
+            header = index.read(HEADER.size)
+        if len(header) < HEADER.size:
+            return True
+        magic, size, mtime = HEADER.unpack(header)[:3]
+        return magic != MAGIC or (size, mtime) != source_stamp(self.osm_file)
+
+    def __len__(self):
+        return sum(len(ids) for ids, _, _ in self._sections.values())
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def close(self):
+        for section in self._sections.values():
+            for column in section:
+                column.release()
+        self._sections = {}
+        fastscan.close_map(self._index, self._buf)
+        fastscan.close_map(self._osm)
+
+    def ids(self, element_type):
+        """Return the sorted ids of one element type, as a memoryview"""
+        return self._sections[element_type][0]
+
+    def locate(self, element_type, element_id):
+        """Return (offset, length) of the element in the OSM file, or None"""
+        ids, offsets, lengths = self._sections[element_type]
+        i = bisect.bisect_left(ids, element_id)
+        if i == len(ids) or ids[i] != element_id:
+            return None
+        return offsets[i], lengths[i]
+
+    def raw(self, element_type, element_id):
+        """Return the element's XML as bytes, or None"""
+        location = self.locate(element_type, element_id)
+        if location is None:
+            return None
+        offset, length = location
+        return self._osm[offset:offset + length]
+
+    def element(self, element_type, element_id):
+        """Return the parsed element (with its children), or None"""
+        raw = self.raw(element_type, element_id)
+        return None if raw is None else ET.fromstring(raw)
+
+    def way_nodes(self, way_id):
+        """Return the node elements referenced by a way, in nd order
+
+        Nodes missing from the file (e.g. in a sample) come back as None.
+        """
+        way = self.element('way', way_id)
+        if way is None:
+            return None
+        return [self.element('node', int(nd.get('ref'))) for nd in way.iter('nd')]
+
+
+def test():
+
+    with OsmIndex('example.osm') as index:
+        assert len(index) == 22
+        node = index.element('node', 757860928)
+        assert node.get('user') == 'uboot'
+        assert [tag.get('k') for tag in node.iter('tag')] == ['amenity', 'cuisine', 'name']
+        assert index.element('node', 1) is None
+        nodes = index.way_nodes(258219703)
+        assert [n.get('id') for n in nodes] == ['261114300', '261114302', '261210804', '261114300']
+        assert index.element('relation', 1557627).get('version') == '2'
+    os.remove(index_path('example.osm'))
+
+    import shutil
+    import tempfile
+    directory = tempfile.mkdtemp()
+    try:
+        # commented-out elements are not indexed
+        osm_file = os.path.join(directory, 'comments.osm')
+        with open(osm_file, 'w', encoding='utf-8') as output:
+            output.write('<osm>\n <!-- <node id="9" lat="1" lon="1"/> -->\n'
+                         ' <node id="1" lat="1" lon="1"/>\n'
+                         ' <!-- <way id="8"><nd ref="1"/></way> -->\n'
+                         ' <way id="2"><nd ref="1"/></way>\n</osm>\n')
+        with OsmIndex(osm_file) as index:
+            assert list(index.ids('node')) == [1] and list(index.ids('way')) == [2]
+            assert index.element('node', 9) is None
+
+        # an index that cannot be read is reported with its maps closed
+        with open(index_path(osm_file), 'r+b') as index:
+            index.truncate(HEADER.size + 8)
+        closed = []
+
+        class Index(OsmIndex):
+            def close(self):
+                super(Index, self).close()
+                closed.append((self._index.closed, self._osm.closed))
+        try:
+            Index(osm_file)
+        except ValueError:
+            assert closed == [(True, True)]
+        else:
+            raise AssertionError('expected a ValueError')
+    finally:
+        shutil.rmtree(directory)
+
+
+if __name__ == "__main__":
+    if len(sys.argv) == 2:
+        print(build_index(sys.argv[1]))
+    elif len(sys.argv) == 4:
+        with OsmIndex(sys.argv[1]) as index:
+            raw = index.raw(sys.argv[2], int(sys.argv[3]))
+        print(raw.decode('utf-8') if raw is not None else 'not found')
+    else:
+        test()
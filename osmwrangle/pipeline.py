@@ -0,0 +1,222 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Pipelined version of data.process_map.
+
+data.process_map parses an element, shapes it, validates it and makes five
+writerow calls before it touches the next element, so every disk wait
+stalls the parser.  Here each step runs in its own thread:
+
+    parser  --(elements)-->  shaper/validator  --(row batches)-->  writer x 5
+
+- the parser thread runs get_element and hands finished elements over in
+  chunks of CHUNK_SIZE,
+- the shaper thread runs shape_element (and validate_element) and feeds
+  the extra writers (checker, tiles, sinks) and a Batcher, which groups
+  the rows per output table and hands over batches of BATCH_SIZE rows,
+- one writer thread per table writes its batches with a single writerows
+  call into a file with a data.BUFFER_SIZE write buffer.
+
+All queues are bounded (QUEUE_SIZE), so a slow disk holds the parser back
+instead of letting elements pile up in memory.  Every table has exactly one
+writer fed through a FIFO queue, so rows come out in the same order as the
+serial export.  The first exception in any stage stops the others and is
+re-raised by process_map; the shaper stops with Stopped when its input is
+cut off, so the writers of a failed export are aborted, never finalized.
+"""
+import csv
+import os
+import queue
+import sys
+import threading
+
+from . import data
+
+
+QUEUE_SIZE = 16        # element chunks or row batches in flight between two stages
+CHUNK_SIZE = 512       # parsed elements handed to the shaper at once
+BATCH_SIZE = 2048      # rows per writerows call
+
+TABLES = data.TABLES
+
+DONE = object()  # end of stream marker passed down every queue
+
+
+class Stopped(Exception):
+    """Raised in the shaper thread when another stage failed"""
+
+
+# ================================================== #
+#               Helper Functions                     #
+# ================================================== #
+class Stage(threading.Thread):
+    """A pipeline thread that records its first exception and stops the rest"""
+
+    def __init__(self, name, target, stop, errors):
+        super(Stage, self).__init__(name=name)
+        self.daemon = True
+        self._work = target
+        self._stop_event = stop
+        self._errors = errors
+
+    def run(self):
+        try:
+            self._work()
+        except BaseException:
+            self._errors.append(sys.exc_info())
+            self._stop_event.set()
+
+
+def put(channel, item, stop):
+    """Block until item is queued; give up (returning False) once stop is set"""
+    while not stop.is_set():
+        try:
+            channel.put(item, timeout=0.1)
+            return True
+        except queue.Full:
+            pass
+    return False
+
+
+def get(channel, stop):
+    """Block until an item arrives; return DONE once stop is set"""
+    while not stop.is_set():
+        try:
+            return channel.get(timeout=0.1)
+        except queue.Empty:
+            pass
+    return DONE
+
+
+def parse(file_in, elements, stop, chunk_size=CHUNK_SIZE):
+    chunk = []
+    for element in data.get_element(file_in, tags=('node', 'way')):
+        chunk.append(element)
+        if len(chunk) >= chunk_size:
+            if not put(elements, chunk, stop):
+                return
+            chunk = []
+    if chunk:
+        put(elements, chunk, stop)
+    put(elements, DONE, stop)
+
+
+def received(elements, stop):
+    """Yield the elements of the chunks arriving on a queue, until DONE
+
+    Raises Stopped if the stream ends because another stage failed.
+    """
+    while True:
+        chunk = get(elements, stop)
+        if stop.is_set():
+            raise Stopped()
+        if chunk is DONE:
+            return
+        for element in chunk:
+            yield element
+
+
+class Batcher(object):
+    """The writer of the shaper thread: groups the rows per table into batches
+
+    A full batch is handed to the writer thread of its table; close hands
+    over the rest and ends every table's stream.  Once stop is set the
+    batches are dropped; abort sets it.
+    """
+
+    def __init__(self, batches, stop, batch_size=BATCH_SIZE):
+        self.batches = batches
+        self.stop = stop
+        self.batch_size = batch_size
+        self.pending = dict((key, []) for _, _, _, key in TABLES)
+
+    def write(self, el):
+        pending = self.pending
+        for key, rows in el.items():
+            if key == data.WAY_NODE_REFS:
+                key, rows = 'way_nodes', data.way_node_rows(el['way']['id'], rows)
+            batch = pending[key]
+            if isinstance(rows, dict):
+                batch.append(rows)
+            else:
+                batch.extend(rows)
+            if len(batch) >= self.batch_size:
+                put(self.batches[key], batch, self.stop)
+                pending[key] = []
+
+    def close(self):
+        for key, batch in self.pending.items():
+            if batch:
+                put(self.batches[key], batch, self.stop)
+            put(self.batches[key], DONE, self.stop)
+
+    def abort(self):
+        self.stop.set()
+
+
+def shape(elements, batches, validate, stop, batch_size=BATCH_SIZE, rules=None,
+          checker=None, area=None, addresses=None, quarantine=None, tiles=None, sinks=()):
+    validator = data.new_validator() if validate is True else None
+    data.run_export(data.shape_elements(received(elements, stop), rules, area, quarantine),
+                    data.export_writers(Batcher(batches, stop, batch_size), checker, tiles,
+                                        sinks),
+                    validator, addresses, quarantine)
+
+
+def write(writer, batches, stop):
+    while True:
+        batch = get(batches, stop)
+        if batch is DONE:
+            return
+        writer.writerows(batch)
+
+
+# ================================================== #
+#               Main Function                        #
+# ================================================== #
+def process_map(file_in, validate, writer_class=None, queue_size=QUEUE_SIZE,
+                batch_size=BATCH_SIZE, rules=None, checker=None, area=None, output_dir='.',
+                addresses=None, quarantine=None, tiles=None, sinks=()):
+    """Write the same csv(s) as data.process_map with overlapping stages"""
+    writer_class = writer_class or data.RowWriter
+    stop = threading.Event()
+    errors = []
+    elements = queue.Queue(queue_size)
+    batches = dict((key, queue.Queue(queue_size)) for _, _, _, key in TABLES)
+
+    files = []
+    try:
+        for _, path, _, _ in TABLES:
+            files.append(data.open_csv(os.path.join(output_dir, path)))
+
+        stages = [
+            Stage('parse', lambda: parse(file_in, elements, stop), stop, errors),
+            Stage('shape', lambda: shape(elements, batches, validate, stop, batch_size, rules,
+                                         checker, area, addresses, quarantine, tiles,
+                                         sinks),
+                  stop, errors),
+        ]
+        for (table, _, fields, key), output in zip(TABLES, files):
+            if key == 'way_nodes':
+                # batches of (id, node_id, position) tuples, see data.way_node_rows
+                writer = csv.writer(output)
+                writer.writerow(fields)
+            else:
+                writer = writer_class(output, fields)
+                writer.writeheader()
+            stages.append(Stage(table, lambda w=writer, k=key: write(w, batches[k], stop),
+                                stop, errors))
+
+        for stage in stages:
+            stage.start()
+        for stage in stages:
+            stage.join()
+    finally:
+        for output in files:
+            output.close()
+
+    if errors:
+        _, error, traceback = errors[0]
+        raise error.with_traceback(traceback)
+    if tiles is not None:
+        tiles.write_csv(output_dir)
@@ -0,0 +1,207 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Tolerant validation: invalid elements go to a quarantine file, the export goes on.
+
+Without a quarantine, the first element that fails data.validate_element
+aborts the export.  With one (process_map, export_db and export_columns
+take quarantine=Quarantine(path) together with validate=True), each invalid
+element is written to the quarantine file as one JSON line
+
+    {"element": "node", "id": 123, "errors": {...cerberus errors...},
+     "fields": ["node.user"], "shaped": {...the shaped element...}}
+
+and left out of the export.  An element that cannot even be shaped (a
+lat of "abc", a node without uid: shape_element raises ValueError or
+TypeError) is quarantined as its raw XML with the error instead:
+
+    {"element": "node", "id": "123", "errors": {"shape": ["node 123: lat invalid: 'abc'"]},
+     "fields": ["node.lat"], "raw": "<node id=\"123\" lat=\"abc\" ... />"}
+
+report() counts the quarantined elements by element type and by field
+('node.user', 'way_tags.value', ...; list indexes are left out of the
+field names).
+
+Usage:
+    python -m osmwrangle export mapBend2.osm --quarantine quarantine.jsonl
+    python -m osmwrangle.quarantine quarantine.jsonl     # the report of a quarantine file
+"""
+import json
+import sys
+from collections import Counter
+try:
+    import xml.etree.cElementTree as ET
+except ImportError:  # removed in Python 3.9
+    import xml.etree.ElementTree as ET
+
+from . import data
+
+
+def error_fields(errors, prefix=''):
+    """Yield the dotted field name of every message in a cerberus error dict"""
+    for field, messages in errors.items():
+        name = prefix if isinstance(field, int) else (prefix + '.' if prefix else '') + str(field)
+        for message in messages if isinstance(messages, list) else [messages]:
+            if isinstance(message, dict):
+                for subfield in error_fields(message, name):
+                    yield subfield
+            else:
+                yield name
+
+
+def jsonable(element):
+    """The shaped element with its way node ref array as a list"""
+    refs = element.get(data.WAY_NODE_REFS)
+    if refs is None:
+        return element
+    element = dict(element)
+    element[data.WAY_NODE_REFS] = refs.tolist()
+    return element
+
+
+class Quarantine(object):
+    """Writes invalid shaped elements to a JSON lines file and counts their errors"""
+
+    def __init__(self, path):
+        self.path = path
+        self.output = open(path, 'w', encoding='utf-8')
+        self.elements = Counter()
+        self.fields = Counter()
+        self.unshaped = 0  # raw elements, see write_unshaped
+
+    def __len__(self):
+        return sum(self.elements.values())
+
+    def write(self, element, error):
+        """Quarantine element for a data.ValidationError"""
+        element_type = 'node' if 'node' in element else 'way'
+        element_id = element[element_type].get('id')
+        fields = sorted(set(error_fields(error.errors)))
+        self.elements[element_type] += 1
+        self.fields.update(fields)
+        json.dump({'element': element_type, 'id': element_id, 'errors': error.errors,
+                   'fields': fields, 'shaped': jsonable(element)},
+                  self.output, ensure_ascii=False, sort_keys=True, default=str)
+        self.output.write('\n')
+
+    def write_unshaped(self, element, error):
+        """Quarantine a raw XML element that shape_element rejected with error"""
+        field = getattr(error, 'field', None)  # see data.ShapeError
+        fields = [element.tag + '.' + field if field else element.tag]
+        self.elements[element.tag] += 1
+        self.fields.update(fields)
+        self.unshaped += 1
+        json.dump({'element': element.tag, 'id': element.get('id'),
+                   'errors': {'shape': [str(error)]}, 'fields': fields,
+                   'raw': ET.tostring(element, encoding='unicode').strip()},
+                  self.output, ensure_ascii=False, sort_keys=True)
+        self.output.write('\n')
+
+    def close(self):
+        self.output.close()
+
+    def abort(self):
+        """Close the file: the elements quarantined before an export failed are kept"""
+        self.close()
+
+    def report(self):
+        """Return the error counts as a JSON-serializable dict"""
+        return {'path': self.path, 'quarantined': len(self),
+                'elements': dict(self.elements), 'fields': dict(self.fields)}
+
+
+# ================================================== #
+#               Main Function                        #
+# ================================================== #
+def read_report(path):
+    """The report of an existing quarantine file"""
+    elements = Counter()
+    fields = Counter()
+    with open(path, encoding='utf-8') as lines:
+        for line in lines:
+            record = json.loads(line)
+            elements[record['element']] += 1
+            fields.update(record['fields'])
+    return {'path': path, 'quarantined': sum(elements.values()),
+            'elements': dict(elements), 'fields': dict(fields)}
+
+
+def test():
+
+    import os
+    import shutil
+    import tempfile
+    from . import database
+
+    assert sorted(error_fields({'node_tags': [{0: [{'value': ['null value not allowed']}]}],
+                                'node': [{'user': ['null value not allowed']}]})) == [
+        'node.user', 'node_tags.value']
+
+    directory = tempfile.mkdtemp()
+    try:
+        # an anonymous node (no user attribute) and a tag without a value
+        tree = ET.parse('example.osm')
+        nodes = tree.getroot().findall('node')
+        del nodes[0].attrib['user']
+        del next(node for node in nodes if node.find('tag') is not None).find('tag').attrib['v']
+        osm_file = os.path.join(directory, 'invalid.osm')
+        tree.write(osm_file, encoding='utf-8')
+
+        try:
+            database.export_db(osm_file, ':memory:', validate=True)
+        except data.ValidationError as error:
+            assert 'node' in error.errors
+        else:
+            raise AssertionError('expected a ValidationError')
+
+        path = os.path.join(directory, 'quarantine.jsonl')
+        quarantine = Quarantine(path)
+        db = database.export_db(osm_file, ':memory:', validate=True, quarantine=quarantine)
+        assert db.execute('SELECT COUNT(*) FROM nodes').fetchone() == (18,)
+        report = quarantine.report()
+        assert report['elements'] == {'node': 2}
+        assert report['fields'] == {'node.user': 1, 'node_tags.value': 1}
+        assert read_report(path) == report
+
+        for pipelined in (False, True):
+            quarantine = Quarantine(path)
+            data.process_map(osm_file, True, pipelined=pipelined, quarantine=quarantine,
+                             output_dir=directory)
+            assert quarantine.report() == report
+
+        # elements that cannot be shaped: a malformed lat, a node without uid
+        nodes[2].set('lat', 'abc')
+        del nodes[3].attrib['uid']
+        tree.write(osm_file, encoding='utf-8')
+        try:
+            database.export_db(osm_file, ':memory:')
+        except data.ShapeError as error:
+            assert error.field == 'lat'
+        else:
+            raise AssertionError('expected a ShapeError')
+
+        unshaped = {'node.lat': 1, 'node.uid': 1, 'node.user': 1, 'node_tags.value': 1}
+        for options in ({}, {'pipelined': True}, {'cache': True}, {'cache': True}):
+            quarantine = Quarantine(path)
+            data.process_map(osm_file, True, quarantine=quarantine, output_dir=directory,
+                             **options)
+            assert quarantine.report()['fields'] == unshaped, quarantine.report()
+            assert quarantine.unshaped == 2
+            with open(os.path.join(directory, data.NODES_PATH), encoding='utf-8') as nodes_csv:
+                assert sum(1 for _ in nodes_csv) == 1 + 16
+        # a stream with unshaped elements is not cached (the second run parsed again)
+        assert not os.listdir(os.path.join(directory, '.osmcache'))
+        with open(path, encoding='utf-8') as records:
+            raw = [json.loads(line) for line in records if '"raw"' in line]
+        assert [record['id'] for record in raw] == [nodes[2].get('id'), nodes[3].get('id')]
+        assert ET.fromstring(raw[0]['raw']).get('lat') == 'abc'
+        assert read_report(path)['fields'] == unshaped
+    finally:
+        shutil.rmtree(directory)
+
+
+if __name__ == "__main__":
+    if len(sys.argv) > 1:
+        json.dump(read_report(sys.argv[1]), sys.stdout, indent=1, sort_keys=True)
+    else:
+        test()
@@ -0,0 +1,229 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Export many regional extracts side by side and merge them into one database.
+
+Every region gets its own partition under the output directory, named after
+its OSM file, instead of overwriting the csv(s) in the current directory:
+
+    regions/bend/nodes.csv, ...     (to='csv')
+    regions/bend.db                 (to='sqlite')
+
+export_regions runs the regions in a process pool, one export per process.
+merge then ATTACHes the region databases one at a time.  Extracts that
+overlap contain the same nodes and ways, so for every (element, id) it
+keeps the row with the highest (version, timestamp), and takes the tags
+and way nodes from that same region, so a merged element is never a mix
+of two versions.  Csv partitions are loaded into a database in their
+directory first.
+
+Usage:
+    python -m osmwrangle.regions merged.db bend.osm redmond.osm ...
+"""
+import os
+import sys
+import time
+
+from . import data
+from . import database
+
+
+OUTPUT_DIR = 'regions'
+
+# per element type: the main table and the tables of its child rows
+ELEMENTS = (
+    ('nodes', ('nodes_tags',)),
+    ('ways', ('ways_nodes', 'ways_tags')),
+)
+
+SQL_LATEST = '''
+CREATE TEMP TABLE IF NOT EXISTS latest_{table} (
+    id INTEGER PRIMARY KEY NOT NULL,
+    version INTEGER,
+    timestamp INTEGER,
+    region INTEGER NOT NULL
+);
+'''
+
+# the WHERE 1 avoids the parsing ambiguity of INSERT ... SELECT ... ON CONFLICT
+SQL_UPDATE_LATEST = '''
+INSERT INTO latest_{table} (id, version, timestamp, region)
+SELECT id, version, timestamp, ? FROM region.{table} WHERE 1
+ON CONFLICT (id) DO UPDATE SET
+    version = excluded.version, timestamp = excluded.timestamp, region = excluded.region
+WHERE (excluded.version, excluded.timestamp) > (latest_{table}.version, latest_{table}.timestamp);
+'''
+
+SQL_COPY = '''
+INSERT INTO main.{table}
+SELECT r.* FROM region.{table} r
+JOIN latest_{parent} l ON l.id = r.id AND l.region = ?;
+'''
+
+
+def region_name(osm_file):
+    """The partition name of a region: its file name without extensions"""
+    return os.path.basename(osm_file).split('.')[0]
+
+
+def region_path(osm_file, output_dir=OUTPUT_DIR, to='csv'):
+    """The directory (csv) or database (sqlite) of a region's partition"""
+    path = os.path.join(output_dir, region_name(osm_file))
+    return path + '.db' if to == 'sqlite' else path
+
+
+def export_region(osm_file, output_dir=OUTPUT_DIR, to='csv', validate=False, rules=None,
+                  area=None):
+    """Export one region into its partition; return (osm_file, path, seconds)"""
+    start = time.perf_counter()
+    path = region_path(osm_file, output_dir, to)
+    if to == 'sqlite':
+        database.export_db(osm_file, path, validate, rules=rules, area=area).close()
+    else:
+        if not os.path.isdir(path):
+            os.makedirs(path)
+        data.process_map(osm_file, validate, rules=rules, area=area, output_dir=path)
+    return osm_file, path, time.perf_counter() - start
+
+
+def check_names(osm_files):
+    """Raise ValueError if two files would share a partition (a/bend.osm, b/bend.osm)"""
+    files = {}
+    for osm_file in osm_files:
+        files.setdefault(region_name(osm_file), []).append(osm_file)
+    clashes = ['{0}: {1}'.format(name, ', '.join(paths))
+               for name, paths in sorted(files.items()) if len(paths) > 1]
+    if clashes:
+        raise ValueError('regions with the same partition name (rename one of the files): '
+                         + '; '.join(clashes))
+
+
+def export_regions(osm_files, output_dir=OUTPUT_DIR, to='csv', processes=None, **options):
+    """Export every region in a pool of processes; return [(osm_file, path, seconds)]
+
+    options are passed to export_region (validate, rules, area); rules
+    should be a config path or True, as every process loads its own copy.
+    With processes=1 the regions run one after the other in this process.
+    Every region needs its own partition name (see check_names).
+    """
+    check_names(osm_files)
+    if not os.path.isdir(output_dir):
+        os.makedirs(output_dir)
+    if processes == 1 or len(osm_files) == 1:
+        return [export_region(osm_file, output_dir, to, **options) for osm_file in osm_files]
+
+    from concurrent.futures import ProcessPoolExecutor
+    with ProcessPoolExecutor(processes) as pool:
+        futures = [pool.submit(export_region, osm_file, output_dir, to, **options)
+                   for osm_file in osm_files]
+        return [future.result() for future in futures]
+
+
+def region_db(path):
+    """The database of a partition, loading the csv(s) of a csv partition first"""
+    if not os.path.isdir(path):
+        return path
+    db_path = os.path.join(path, region_name(path) + '.db')
+    if os.path.exists(db_path):
+        os.remove(db_path)
+    database.load_csvs(db_path, path).close()
+    return db_path
+
+
+def merge(paths, db_path, search=False):
+    """Merge region partitions into db_path, keeping the latest version of each element
+
+    The tables of an earlier export or merge into db_path are replaced (see
+    database.create_db).  Returns a dictionary of table -> rows in the
+    merged database.
+    """
+    paths = [region_db(path) for path in paths]
+    db = database.create_db(db_path)
+    for table, _ in ELEMENTS:
+        db.execute(SQL_LATEST.format(table=table))
+
+    for region, path in enumerate(paths):
+        db.execute('ATTACH DATABASE ? AS region', (path,))
+        for table, _ in ELEMENTS:
+            db.execute(SQL_UPDATE_LATEST.format(table=table), (region,))
+        db.commit()
+        db.execute('DETACH DATABASE region')
+
+    for region, path in enumerate(paths):
+        db.execute('ATTACH DATABASE ? AS region', (path,))
+        for parent, children in ELEMENTS:
+            for table in (parent,) + children:
+                db.execute(SQL_COPY.format(table=table, parent=parent), (region,))
+        db.commit()
+        db.execute('DETACH DATABASE region')
+
+    database.create_indexes(db)
+    if search:
+        database.create_search_index(db)
+    db.commit()
+    counts = dict((table, db.execute('SELECT COUNT(*) FROM {0}'.format(table)).fetchone()[0])
+                  for parent, children in ELEMENTS for table in (parent,) + children)
+    db.close()
+    return counts
+
+
+def test():
+
+    import shutil
+    import tempfile
+    try:
+        import xml.etree.cElementTree as ET
+    except ImportError:  # removed in Python 3.9
+        import xml.etree.ElementTree as ET
+
+    directory = tempfile.mkdtemp()
+    try:
+        # a second extract with a newer version of one node and an older one of another
+        tree = ET.parse('example.osm')
+        nodes = tree.getroot().findall('node')
+        newer, older = nodes[0], nodes[1]
+        newer.set('version', str(int(newer.get('version')) + 1))
+        newer.set('lat', '41.9800000')
+        ET.SubElement(newer, 'tag', {'k': 'name', 'v': 'Newer'})
+        older.set('version', '0')
+        older.set('lat', '0.0')
+        other = os.path.join(directory, 'other.osm')
+        tree.write(other, encoding='utf-8')
+
+        regions = os.path.join(directory, 'regions')
+        for to in ('csv', 'sqlite'):
+            exported = export_regions(['example.osm', other], regions, to, processes=2)
+            paths = [path for _, path, _ in exported]
+            assert paths == [region_path(f, regions, to) for f in ('example.osm', other)]
+
+            merged = os.path.join(directory, 'merged_{0}.db'.format(to))
+            merge(paths, merged)
+            counts = merge(paths, merged)  # merging again replaces the first merge
+            assert counts == {'nodes': 20, 'nodes_tags': 4, 'ways': 1, 'ways_nodes': 4,
+                              'ways_tags': 3}, counts
+            db = database.open_db(merged)
+            lat = 'SELECT lat FROM nodes WHERE id = ?'
+            assert db.execute(lat, (int(newer.get('id')),)).fetchone() == (41.98,)
+            assert db.execute(lat, (int(older.get('id')),)).fetchone() != (0.0,)
+            assert db.execute('SELECT value FROM nodes_tags WHERE id = ?',
+                              (int(newer.get('id')),)).fetchall() == [('Newer',)]
+            db.close()
+
+        # two extracts named alike would be exported into one partition
+        try:
+            export_regions(['example.osm', os.path.join(directory, 'b', 'example.osm')],
+                           regions)
+        except ValueError as error:
+            assert 'example.osm' in str(error)
+        else:
+            raise AssertionError('expected a ValueError')
+    finally:
+        shutil.rmtree(directory)
+
+
+if __name__ == "__main__":
+    if len(sys.argv) > 2:
+        exported = export_regions(sys.argv[2:], to='sqlite')
+        print(merge([path for _, path, _ in exported], sys.argv[1]))
+    else:
+        test()
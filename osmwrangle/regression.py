@@ -0,0 +1,260 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Regression check of every engine against the golden outputs of a fixture corpus.
+
+fixtures/corpus.json lists the corpus: example.osm and small hand-written
+files under fixtures/osm covering Unicode names and users, XML entities,
+problem characters and multi-colon keys (addr:street:name), relations and
+ways without (or with dangling) node refs.  Its version is bumped whenever a
+fixture or a golden output changes on purpose.
+
+fixtures/golden/<name>/ holds what today's code writes for each file:
+
+    count_tags.json    mapparser.count_tags
+    key_type.json      tags.process_map
+    users.json         users.process_map (sorted uids)
+    nodes.csv, ...     data.process_map
+    database.json      the rows of every table of database.export_db, sorted
+
+Each output is produced by the reference engine (the first of its group in
+ENGINES) and by every alternative engine (the fastscan backends, the
+pipelined and cached exports, the sinks, the encoded database, ...), and
+every one must match the golden file byte for byte.  After an intended
+change of the output, rewrite the goldens with --update and bump the
+corpus version.  The throughput budgets are checked by
+`python -m osmwrangle.benchmark budget FILE` (see benchmark.BUDGETS).
+
+Usage:
+    python -m osmwrangle.regression                      # check the whole corpus
+    python -m osmwrangle.regression unicode relations    # check some files, print the mismatches
+    python -m osmwrangle.regression --update [NAME ...]  # rewrite the golden outputs
+"""
+import filecmp
+import json
+import os
+import shutil
+import sys
+import tempfile
+
+from . import data
+from . import database
+
+
+CORPUS = os.path.join('fixtures', 'corpus.json')
+GOLDEN_DIR = os.path.join('fixtures', 'golden')
+
+CSV_PATHS = [path for _, path, _, _ in data.TABLES]
+
+
+def load_corpus(path=CORPUS):
+    """Return {'version': n, 'files': {name: osm path}} (paths relative to the corpus root)"""
+    with open(path, encoding='utf-8') as corpus:
+        return json.load(corpus)
+
+
+def write_json(value, path):
+    with open(path, 'w', encoding='utf-8', newline='\n') as output:
+        json.dump(value, output, indent=1, sort_keys=True, ensure_ascii=False)
+        output.write('\n')
+
+
+def write_tables(tables, path):
+    """Write {table: rows} as JSON with one row per line, for readable diffs"""
+    with open(path, 'w', encoding='utf-8', newline='\n') as output:
+        output.write('{\n')
+        for i, table in enumerate(sorted(tables)):
+            rows = ',\n'.join('  ' + json.dumps(row, ensure_ascii=False) for row in tables[table])
+            output.write(' {0}: [{1}{2}{3}]{4}\n'.format(
+                json.dumps(table), '\n' if rows else '', rows, '\n ' if rows else '',
+                ',' if i < len(tables) - 1 else ''))
+        output.write('}\n')
+
+
+def dump_database(db):
+    """{table: [rows in column order]} of the exported tables, sorted"""
+    tables = {}
+    for table, _, fields, _ in data.TABLES:
+        columns = ', '.join(fields)
+        tables[table] = [list(row) for row in db.execute(
+            'SELECT {0} FROM {1} ORDER BY {0}'.format(columns, table))]
+    return tables
+
+
+# ================================================== #
+#               Engines                              #
+# ================================================== #
+# every engine writes its output files for osm_file into directory
+def count_tags(backend):
+    def engine(osm_file, directory):
+        from . import mapparser
+        write_json(mapparser.count_tags(osm_file, backend=backend),
+                   os.path.join(directory, 'count_tags.json'))
+    return engine
+
+
+def key_type(backend):
+    def engine(osm_file, directory):
+        from . import tags
+        write_json(tags.process_map(osm_file, backend=backend),
+                   os.path.join(directory, 'key_type.json'))
+    return engine
+
+
+def users(backend):
+    def engine(osm_file, directory):
+        from . import users as contributors
+        write_json(sorted(contributors.process_map(osm_file, backend=backend), key=int),
+                   os.path.join(directory, 'users.json'))
+    return engine
+
+
+def csvs(**options):
+    def engine(osm_file, directory):
+        data.process_map(osm_file, False, output_dir=directory, **options)
+    return engine
+
+
+def cached_csvs(osm_file, directory):
+    data.process_map(osm_file, False, cache=True, output_dir=directory)  # records the cache
+    data.process_map(osm_file, False, cache=True, output_dir=directory)  # replays it
+
+
+def csvs_from_database(osm_file, directory):
+    database.export_db(osm_file, ':memory:', sinks=[data.CsvWriter(directory)]).close()
+
+
+def exported_database(**options):
+    def engine(osm_file, directory):
+        db = database.export_db(osm_file, ':memory:', **options)
+        write_tables(dump_database(db), os.path.join(directory, 'database.json'))
+        db.close()
+    return engine
+
+
+def loaded_database(osm_file, directory):
+    data.process_map(osm_file, False, output_dir=directory)
+    db = database.load_csvs(os.path.join(directory, 'loaded.db'), directory)
+    write_tables(dump_database(db), os.path.join(directory, 'database.json'))
+    db.close()
+
+
+def database_sink(osm_file, directory):
+    from . import sinks
+    db_path = os.path.join(directory, 'sink.db')
+    data.process_map(osm_file, False, output_dir=directory, sinks=[sinks.DatabaseSink(db_path)])
+    db = database.open_db(db_path)
+    write_tables(dump_database(db), os.path.join(directory, 'database.json'))
+    db.close()
+
+
+# output group -> (golden files, [(engine, writer)]); the first engine is the reference
+ENGINES = [
+    ('count_tags', ['count_tags.json'], [('iterparse', count_tags('iterparse')),
+                                         ('scan', count_tags('scan'))]),
+    ('key_type', ['key_type.json'], [('iterparse', key_type('iterparse')),
+                                     ('scan', key_type('scan'))]),
+    ('users', ['users.json'], [('iterparse', users('iterparse')), ('scan', users('scan'))]),
+    ('process_map', CSV_PATHS, [('serial', csvs()),
+                                ('pipelined', csvs(pipelined=True)),
+                                ('cache', cached_csvs),
+                                ('csv sink', csvs_from_database)]),
+    ('database', ['database.json'], [('export_db', exported_database()),
+                                     ('encoded', exported_database(encoded=True)),
+                                     ('load_csvs', loaded_database),
+                                     ('sqlite sink', database_sink)]),
+]
+
+
+# ================================================== #
+#               Main Functions                       #
+# ================================================== #
+def golden_path(name, golden_dir=GOLDEN_DIR):
+    return os.path.join(golden_dir, name)
+
+
+def run_engine(engine, osm_file):
+    """Run engine on a copy of osm_file in a fresh directory; return the directory
+
+    The copy keeps caches (see cache.py) out of the corpus.
+    """
+    directory = tempfile.mkdtemp()
+    copy = os.path.join(directory, os.path.basename(osm_file))
+    shutil.copyfile(osm_file, copy)
+    output = os.path.join(directory, 'output')
+    os.makedirs(output)
+    engine(copy, output)
+    return directory
+
+
+def check(name, osm_file, golden_dir=GOLDEN_DIR):
+    """Return [(group, engine, file)] of every output that differs from the golden one"""
+    golden = golden_path(name, golden_dir)
+    mismatches = []
+    for group, files, engines in ENGINES:
+        for label, engine in engines:
+            directory = run_engine(engine, osm_file)
+            try:
+                for path in files:
+                    if not (os.path.exists(os.path.join(golden, path)) and
+                            filecmp.cmp(os.path.join(directory, 'output', path),
+                                        os.path.join(golden, path), shallow=False)):
+                        mismatches.append((group, label, path))
+            finally:
+                shutil.rmtree(directory)
+    return mismatches
+
+
+def update(name, osm_file, golden_dir=GOLDEN_DIR):
+    """Rewrite the golden outputs of one corpus file with the reference engines"""
+    golden = golden_path(name, golden_dir)
+    if not os.path.isdir(golden):
+        os.makedirs(golden)
+    for _, files, engines in ENGINES:
+        directory = run_engine(engines[0][1], osm_file)
+        try:
+            for path in files:
+                shutil.copyfile(os.path.join(directory, 'output', path),
+                                os.path.join(golden, path))
+        finally:
+            shutil.rmtree(directory)
+
+
+def check_corpus(corpus=CORPUS, golden_dir=GOLDEN_DIR, names=None):
+    """Return {name: mismatches} of every corpus file (or of names)"""
+    files = load_corpus(corpus)['files']
+    return dict((name, check(name, files[name], golden_dir))
+                for name in sorted(names or files))
+
+
+def test():
+
+    files = load_corpus()['files']
+    assert 'example' in files and all(os.path.exists(path) for path in files.values())
+    mismatches = check_corpus()
+    assert not any(mismatches.values()), mismatches
+
+    # a changed output is reported for every engine that writes it
+    directory = tempfile.mkdtemp()
+    try:
+        golden = os.path.join(directory, 'example')
+        shutil.copytree(golden_path('example'), golden)
+        write_json({}, os.path.join(golden, 'users.json'))
+        assert check('example', files['example'], directory) == [
+            ('users', 'iterparse', 'users.json'), ('users', 'scan', 'users.json')]
+    finally:
+        shutil.rmtree(directory)
+
+
+if __name__ == "__main__":
+    if '--update' in sys.argv:
+        corpus = load_corpus()['files']
+        for name in [arg for arg in sys.argv[1:] if arg != '--update'] or sorted(corpus):
+            update(name, corpus[name])
+            print('updated', golden_path(name))
+    elif len(sys.argv) > 1:
+        results = check_corpus(names=sys.argv[1:])
+        json.dump(results, sys.stdout, indent=1, sort_keys=True)
+        sys.exit(1 if any(results.values()) else 0)
+    else:
+        test()
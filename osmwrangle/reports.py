@@ -0,0 +1,166 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Contribution timeline reports over the SQLite database (see database.py).
+
+Timestamps are stored as indexed epoch seconds, so every report restricts
+nodes and ways with an integer range on the timestamp index (or on the
+(uid, timestamp) index for a single user) before grouping by month.
+
+Note that OSM only records the timestamp of the current version of each
+element, so "growth" counts elements by the month of their last edit.
+
+Usage:
+    python -m osmwrangle.reports BendOR.db users [start] [end]     # edits per user per month
+    python -m osmwrangle.reports BendOR.db growth [start] [end]    # map growth over time
+    python -m osmwrangle.reports BendOR.db keys [nodes|ways]       # top 10 tag keys
+  (start and end are YYYY-MM-DD dates, end exclusive)
+"""
+import calendar
+import sys
+import time
+
+from . import database
+
+
+MONTH = "strftime('%Y-%m', timestamp, 'unixepoch')"
+END_OF_TIME = 2 ** 62
+
+
+def epoch(date):
+    """Epoch seconds of a 'YYYY-MM-DD' date (ints pass through, None -> None)"""
+    if date is None or isinstance(date, int):
+        return date
+    return calendar.timegm(time.strptime(date, '%Y-%m-%d'))
+
+
+def time_range(start, end):
+    return (epoch(start) if start is not None else 0,
+            epoch(end) if end is not None else END_OF_TIME)
+
+
+def edits_per_user_per_month(db, start=None, end=None, uid=None):
+    """Return [(user, month, edits)] of the nodes and ways edited in [start, end)
+
+    With uid the scan is limited to that user's (uid, timestamp) index range.
+    """
+    where = 'timestamp >= ? AND timestamp < ?'
+    params = time_range(start, end)
+    if uid is not None:
+        where = 'uid = ? AND ' + where
+        params = (uid,) + params
+    query = '''
+    SELECT user, month, COUNT(*) AS edits
+    FROM (SELECT user, {month} AS month FROM nodes WHERE {where}
+          UNION ALL
+          SELECT user, {month} AS month FROM ways WHERE {where})
+    GROUP BY user, month
+    ORDER BY month, edits DESC;
+    '''.format(month=MONTH, where=where)
+    return db.execute(query, params + params).fetchall()
+
+
+def growth_by_month(db, start=None, end=None):
+    """Return [(month, nodes, ways, running total of nodes and ways)]"""
+    params = time_range(start, end)
+    counts = {}
+    for column, table in enumerate(('nodes', 'ways')):
+        query = '''
+        SELECT {month} AS month, COUNT(*) FROM {table}
+        WHERE timestamp >= ? AND timestamp < ?
+        GROUP BY month;
+        '''.format(month=MONTH, table=table)
+        for month, count in db.execute(query, params):
+            counts.setdefault(month, [0, 0])[column] = count
+
+    rows = []
+    total = 0
+    for month in sorted(counts):
+        nodes, ways = counts[month]
+        total += nodes + ways
+        rows.append((month, nodes, ways, total))
+    return rows
+
+
+def tag_key_counts(db, element='nodes', limit=10):
+    """Return the [(key, count)] of the most used tag keys of nodes or ways
+
+    On a dictionary-encoded database the grouping runs over integer key ids
+    and only the top keys are joined back to their text.
+    """
+    if database.is_encoded(db):
+        query = '''
+        SELECT k.key AS key, SUM(t.count) AS count
+        FROM (SELECT key_id, COUNT(*) AS count FROM {0}_tags_encoded GROUP BY key_id) t
+        JOIN tag_keys k ON k.id = t.key_id
+        GROUP BY k.key
+        ORDER BY count DESC, key
+        LIMIT ?;
+        '''
+    else:
+        query = '''
+        SELECT key, COUNT(*) AS count FROM {0}_tags
+        GROUP BY key
+        ORDER BY count DESC, key
+        LIMIT ?;
+        '''
+    return db.execute(query.format(element), (limit,)).fetchall()
+
+
+def tag_value_counts(db, key, element='nodes', limit=10):
+    """Return the [(value, count)] of the most common values of one tag key"""
+    if database.is_encoded(db):
+        query = '''
+        SELECT v.value AS value, t.count AS count
+        FROM (SELECT value_id, COUNT(*) AS count FROM {0}_tags_encoded
+              WHERE key_id IN (SELECT id FROM tag_keys WHERE key = ?)
+              GROUP BY value_id) t
+        JOIN tag_values v ON v.id = t.value_id
+        ORDER BY count DESC, value
+        LIMIT ?;
+        '''
+    else:
+        query = '''
+        SELECT value, COUNT(*) AS count FROM {0}_tags
+        WHERE key = ?
+        GROUP BY value
+        ORDER BY count DESC, value
+        LIMIT ?;
+        '''
+    return db.execute(query.format(element), (key, limit)).fetchall()
+
+
+def test():
+
+    db = database.export_db('example.osm', ':memory:')
+    growth = growth_by_month(db)
+    assert growth[0] == ('2009-01', 4, 0, 4)
+    assert growth[-1] == ('2014-01', 0, 1, 21)
+    assert edits_per_user_per_month(db, '2013-01-01', '2014-01-01') == [
+        ('chicago-buildings', '2013-03', 4)]
+    assert edits_per_user_per_month(db, uid=26299, end='2010-01-01') == [('uboot', '2009-01', 4)]
+
+    encoded = database.export_db('example.osm', ':memory:', encoded=True)
+    for tags_db in (db, encoded):
+        assert tag_key_counts(tags_db, 'ways') == [('FIXME', 1), ('building', 1), ('highway', 1)]
+        assert tag_value_counts(tags_db, 'building', 'ways') == [('yes', 1)]
+
+
+if __name__ == '__main__':
+    if len(sys.argv) < 2:
+        test()
+        sys.exit()
+    db = database.open_db(sys.argv[1])
+    report = sys.argv[2] if len(sys.argv) > 2 else 'growth'
+    args = sys.argv[3:5]
+    if report == 'users':
+        print('user,month,edits')
+        rows = edits_per_user_per_month(db, *args)
+    elif report == 'keys':
+        print('key,count')
+        rows = tag_key_counts(db, *args)
+    else:
+        print('month,nodes,ways,total')
+        rows = growth_by_month(db, *args)
+    for row in rows:
+        print(','.join(str(value) for value in row))
@@ -0,0 +1,152 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Data-driven cleaning rules for tag values.
+
+The expected street types and their mapping, the expected zip codes and
+city, the NW/SW/NE/SE replacements and the 'ch' -> 'Bend' city fix used to
+be hard-coded in the notebook.  They now live in a JSON config file
+(cleaning_rules.json by default) keyed by the full tag "k" value:
+
+    {
+        "addr:street": {
+            "part": "\\b\\S+\\.?$",            optional: regex selecting the part
+                                               of the value that is audited and
+                                               mapped (default: the whole value)
+            "expected": ["Street", ...],       allowed values of that part
+            "mapping": {"St": "Street", ...},  replacements for that part
+            "rewrites": [["\\bNW\\b", "Northwest"]]
+                                               regex -> literal replacement,
+                                               applied to the whole value (anchor
+                                               the pattern, e.g. with \\b)
+        },
+        ...
+    }
+
+Everything is compiled once when the rules are loaded: expected values into
+a frozenset, the mapping into a dict, and all rewrites of a key into a
+single alternation regex, so adding rules does not add per-tag work.  The
+rewrite patterns are combined, so they must not use backreferences.
+
+shape_element (data.py) cleans tag values with RuleSet.clean and the audit
+pass (audit.py) reports values with RuleSet.problem.
+"""
+import hashlib
+import json
+import os
+import re
+
+
+DEFAULT_RULES = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'cleaning_rules.json')
+
+
+class KeyRules(object):
+    """The compiled rules of one tag key"""
+
+    def __init__(self, key, config):
+        self.key = key
+        self.part = re.compile(config['part']) if 'part' in config else None
+        self.expected = frozenset(config.get('expected', ()))
+        self.mapping = dict(config.get('mapping', {}))
+
+        rewrites = config.get('rewrites', [])
+        self.replacements = dict(('r{0}'.format(i), replacement)
+                                 for i, (_, replacement) in enumerate(rewrites))
+        if rewrites:
+            self.rewrite = re.compile('|'.join('(?P<r{0}>{1})'.format(i, pattern)
+                                               for i, (pattern, _) in enumerate(rewrites)))
+        else:
+            self.rewrite = None
+
+    def _replace(self, match):
+        return self.replacements[match.lastgroup]
+
+    def audited_part(self, value):
+        """Return (part, start, end) of the value the expected/mapping rules apply to"""
+        if self.part is None:
+            return value, 0, len(value)
+        match = self.part.search(value)
+        if match is None:
+            return None, 0, 0
+        return match.group(), match.start(), match.end()
+
+    def problem(self, value):
+        """Return the non-conforming part of value, or None if it is expected"""
+        if not self.expected:
+            return None
+        part = self.audited_part(value)[0]
+        if part is None or part in self.expected:
+            return None
+        return part
+
+    def clean(self, value):
+        """Apply the mapping, then the rewrites, and return the cleaned value"""
+        if self.mapping:
+            part, start, end = self.audited_part(value)
+            if part is not None and part in self.mapping:
+                value = value[:start] + self.mapping[part] + value[end:]
+        if self.rewrite is not None:
+            value = self.rewrite.sub(self._replace, value)
+        return value
+
+
+class RuleSet(object):
+    """Cleaning rules for every configured tag key"""
+
+    def __init__(self, config):
+        self.rules = dict((key, KeyRules(key, key_config)) for key, key_config in config.items())
+        # identifies the configuration, e.g. in the keys of cache.py
+        self.digest = hashlib.sha1(json.dumps(config, sort_keys=True).encode('utf-8')).hexdigest()
+
+    @classmethod
+    def load(cls, path=DEFAULT_RULES):
+        """Load and compile the rules of a JSON config file"""
+        with open(path) as config_file:
+            return cls(json.load(config_file))
+
+    def keys(self):
+        return list(self.rules)
+
+    def clean(self, key, value):
+        """Return the cleaned value of a tag (unchanged if key has no rules)"""
+        rules = self.rules.get(key)
+        if rules is None:
+            return value
+        return rules.clean(value)
+
+    def problem(self, key, value):
+        """Return the non-conforming part of a tag value, or None"""
+        rules = self.rules.get(key)
+        if rules is None:
+            return None
+        return rules.problem(value)
+
+
+def load_rules(rules=None):
+    """Return a RuleSet from a RuleSet, a config file path or the default config"""
+    if isinstance(rules, RuleSet):
+        return rules
+    return RuleSet.load(rules or DEFAULT_RULES)
+
+
+def test():
+
+    rules = load_rules()
+    assert rules.clean('addr:street', 'NW Wall St') == 'Northwest Wall Street'
+    assert rules.clean('addr:street', 'Greenwood Ave.') == 'Greenwood Avenue'
+    assert rules.clean('addr:street', 'SE 3rd Street') == 'Southeast 3rd Street'
+    assert rules.problem('addr:street', 'Reed Mkt Rd') == 'Rd'
+    assert rules.problem('addr:street', 'Bond Street') is None
+    assert rules.problem('addr:postcode', '97701') is None
+    assert rules.problem('addr:postcode', '97701-1234') == '97701-1234'
+    assert rules.clean('addr:street', 'SEARS Rd') == 'SEARS Road'
+    assert rules.clean('addr:street', 'NWX Ln') == 'NWX Lane'
+    assert rules.clean('addr:city', 'ch') == 'Bend'
+    assert rules.clean('addr:city', 'Deschutes River Woods') == 'Deschutes River Woods'
+    assert rules.clean('addr:city', 'Blanchard') == 'Blanchard'
+    assert rules.problem('addr:city', 'ch') == 'ch'
+    assert rules.clean('name', 'NW Crossing') == 'NW Crossing'
+
+
+if __name__ == "__main__":
+    test()
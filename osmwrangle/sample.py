@@ -0,0 +1,60 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Write sample.osm: every k-th top level element of a large OSM file.
+
+This is the notebook's sampler.  The sample keeps every k-th node, way and
+relation, so most way refs point at nodes that were left out; check it
+with integrity.py before relying on the ways.
+
+Usage:
+    python -m osmwrangle.sample mapBend2.osm sample.osm [k]
+"""
+import sys
+
+try:
+    import xml.etree.cElementTree as ET
+except ImportError:  # removed in Python 3.9
+    import xml.etree.ElementTree as ET
+
+from . import data
+
+
+K = 10  # take every k-th top level element
+
+
+def write_sample(osm_file, sample_file, k=K):
+    """Write every k-th top level element of osm_file; return how many were written"""
+    written = 0
+    with open(sample_file, 'wb') as output:
+        output.write(b'<?xml version="1.0" encoding="UTF-8"?>\n')
+        output.write(b'<osm>\n  ')
+
+        for i, element in enumerate(data.get_element(osm_file)):
+            if i % k == 0:
+                output.write(ET.tostring(element, encoding='utf-8'))
+                written += 1
+
+        output.write(b'</osm>')
+    return written
+
+
+def test():
+
+    import os
+    import tempfile
+    from . import mapparser
+    handle, path = tempfile.mkstemp(suffix='.osm')
+    os.close(handle)
+    try:
+        assert write_sample('example.osm', path, k=5) == 5
+        assert mapparser.count_tags(path)['osm'] == 1
+    finally:
+        os.remove(path)
+
+
+if __name__ == "__main__":
+    if len(sys.argv) > 2:
+        write_sample(sys.argv[1], sys.argv[2], int(sys.argv[3]) if len(sys.argv) > 3 else K)
+    else:
+        test()
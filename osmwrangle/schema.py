@@ -0,0 +1,72 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Schema of the shaped elements (and of the csv files / sql tables), used by
+data.validate_element with the cerberus library.
+
+shape_element already produces native ints and floats (timestamps as
+epoch seconds), so the schema only checks types; there are no 'coerce'
+rules to run.
+"""
+
+schema = {
+    'node': {
+        'type': 'dict',
+        'schema': {
+            'id': {'required': True, 'type': 'integer'},
+            'lat': {'required': True, 'type': 'float'},
+            'lon': {'required': True, 'type': 'float'},
+            'user': {'required': True, 'type': 'string'},
+            'uid': {'required': True, 'type': 'integer'},
+            'version': {'required': True, 'type': 'integer'},
+            'changeset': {'required': True, 'type': 'integer'},
+            'timestamp': {'required': True, 'type': 'integer'}
+        }
+    },
+    'node_tags': {
+        'type': 'list',
+        'schema': {
+            'type': 'dict',
+            'schema': {
+                'id': {'required': True, 'type': 'integer'},
+                'key': {'required': True, 'type': 'string'},
+                'value': {'required': True, 'type': 'string'},
+                'type': {'required': True, 'type': 'string'}
+            }
+        }
+    },
+    'way': {
+        'type': 'dict',
+        'schema': {
+            'id': {'required': True, 'type': 'integer'},
+            'user': {'required': True, 'type': 'string'},
+            'uid': {'required': True, 'type': 'integer'},
+            'version': {'required': True, 'type': 'integer'},
+            'changeset': {'required': True, 'type': 'integer'},
+            'timestamp': {'required': True, 'type': 'integer'}
+        }
+    },
+    'way_nodes': {
+        'type': 'list',
+        'schema': {
+            'type': 'dict',
+            'schema': {
+                'id': {'required': True, 'type': 'integer'},
+                'node_id': {'required': True, 'type': 'integer'},
+                'position': {'required': True, 'type': 'integer'}
+            }
+        }
+    },
+    'way_tags': {
+        'type': 'list',
+        'schema': {
+            'type': 'dict',
+            'schema': {
+                'id': {'required': True, 'type': 'integer'},
+                'key': {'required': True, 'type': 'string'},
+                'value': {'required': True, 'type': 'string'},
+                'type': {'required': True, 'type': 'string'}
+            }
+        }
+    }
+}
@@ -0,0 +1,83 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Full-text search over the name, street, amenity, cuisine and tourism values.
+
+Instead of LIKE scans over nodes_tags.value, search() runs against the
+tag_search FTS5 index built during the export (export_db(..., search=True),
+see database.SQL_SEARCH), with one row per node or way.  Every word of the
+text must match; with prefix=True the words are prefix matches, so 'desch'
+finds 'Deschutes'.  Results are ranked with bm25, with names weighted above
+streets and the category columns (WEIGHTS).
+
+Usage:
+    python -m osmwrangle.search BendOR.db deschutes                # names, streets, ...
+    python -m osmwrangle.search BendOR.db pizza cuisine            # only the cuisine column
+"""
+import re
+import sys
+
+from . import database
+
+
+COLUMNS = tuple(column for column, _, _ in database.SEARCH_KEYS)
+# bm25 weights of the tag_search columns: element, id, then COLUMNS
+WEIGHTS = (0.0, 0.0, 10.0, 5.0, 2.0, 2.0, 2.0)
+WORD = re.compile(r'\w+', re.UNICODE)
+
+
+def match_expression(text, columns=None, prefix=True):
+    """The FTS5 MATCH expression for the words of text (None if it has none)"""
+    words = WORD.findall(text)
+    if not words:
+        return None
+    expression = ' '.join('"{0}"{1}'.format(word, '*' if prefix else '') for word in words)
+    if columns:
+        for column in columns:
+            if column not in COLUMNS:
+                raise ValueError("unknown search column {0!r}, expected one of {1}".format(
+                    column, ', '.join(COLUMNS)))
+        expression = '{{{0}}} : ({1})'.format(' '.join(columns), expression)
+    return expression
+
+
+def search(db, text, columns=None, element=None, prefix=True, limit=20):
+    """Return [(element, id, name, street, amenity, cuisine, tourism, score)], best first
+
+    columns restricts the match to some of COLUMNS, element to 'node' or
+    'way'.  Lower scores are better matches (bm25).
+    """
+    expression = match_expression(text, columns, prefix)
+    if expression is None:
+        return []
+    query = '''
+    SELECT element, id, {columns}, bm25(tag_search, {weights}) AS score
+    FROM tag_search
+    WHERE tag_search MATCH ? {element}
+    ORDER BY score
+    LIMIT ?;
+    '''.format(columns=', '.join(COLUMNS), weights=', '.join(str(w) for w in WEIGHTS),
+               element='AND element = ?' if element else '')
+    params = (expression, element, limit) if element else (expression, limit)
+    return db.execute(query, params).fetchall()
+
+
+def test():
+
+    db = database.export_db('example.osm', ':memory:', search=True)
+    shelly = ('node', 757860928, "Shelly's Tasty Freeze", None, 'fast_food', 'sausage', None)
+    assert [row[:-1] for row in search(db, 'shel')] == [shelly]
+    assert [row[:-1] for row in search(db, 'tasty shelly')] == [shelly]
+    assert search(db, 'shel', prefix=False) == []
+    assert search(db, 'sausage', columns=['name']) == []
+    assert search(db, 'sausage', columns=['cuisine'])[0][:2] == ('node', 757860928)
+    assert search(db, 'freeze', element='way') == []
+    assert search(db, "'*") == []
+
+
+if __name__ == "__main__":
+    if len(sys.argv) > 2:
+        for row in search(database.open_db(sys.argv[1]), sys.argv[2], sys.argv[3:] or None):
+            print(','.join('' if value is None else str(value) for value in row))
+    else:
+        test()
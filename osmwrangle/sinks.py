@@ -0,0 +1,255 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Write one export to several sinks in a single pass over the OSM file.
+
+Producing the csv(s) and a database used to take two exports, that is two
+XML parses.  Every writer of an export has the same three methods,
+write(shaped element), close() and abort(), so process_map, export_db and
+export_columns take a list of extra writers as sinks= and feed each of
+them every element they write themselves (after the area filter, the
+address fixes and validation).  They all run the same loop,
+data.run_export, over the integrity checker, the tile counts, the sinks
+and their own format writer.  It closes every one of them, finalizing
+their output, when the export completes, and aborts them when it fails,
+so a failed export never looks complete: a database is rolled back
+without indexes, a columnar directory gets no manifest and no summary or
+activity tables are written.
+
+
+    data.CsvWriter(output_dir)            the csv(s) of process_map
+    DatabaseSink(db_path)                 a database.SqliteWriter on a new export to db_path
+    columnar.ColumnarWriter(directory)    a columnar directory
+    Summary(path)                         the overview counts of the notebook, as JSON
+
+open_sink builds them from 'kind:path' specs.  Re-exporting the same file
+with another set of sinks is cheaper still with cache=True, which replays
+the shaped elements from the binary cache of cache.py instead of parsing.
+
+Usage:
+    python -m osmwrangle export mapBend2.osm --to sqlite --sink csv:. --sink summary:summary.json
+    python -m osmwrangle.sinks mapBend2.osm sqlite:BendOR.db   # csv(s), the db and a summary
+"""
+import json
+import os
+import sys
+import time
+from collections import Counter
+
+from . import data
+from . import database
+
+
+SINK_KINDS = ('csv', 'sqlite', 'columns', 'summary')
+TOP = 10  # users and tag keys listed by Summary.report
+
+
+class DatabaseSink(object):
+    """A SqliteWriter on its own connection to db_path, closed with the writer
+
+    The connection is opened by the first write (or close), in the thread
+    that feeds the sink: the shaper thread of a pipelined export, and
+    sqlite3 connections stay in the thread that opened them.
+    """
+
+    def __init__(self, db_path=database.DB_PATH, encoded=False, search=False):
+        self.db_path = db_path
+        self.encoded = encoded
+        self.search = search
+        self.writer = None
+
+    def open(self):
+        if self.writer is None:
+            self.writer = database.SqliteWriter(database.create_db(self.db_path, self.encoded),
+                                                encoded=self.encoded, search=self.search)
+        return self.writer
+
+    def write(self, el):
+        self.open().write(el)
+
+    def close(self):
+        writer = self.open()
+        writer.close()
+        writer.db.close()
+
+    def abort(self):
+        if self.writer is not None:
+            self.writer.abort()
+            self.writer.db.close()
+
+
+class Summary(object):
+    """Counts the elements, tags and contributors of an export
+
+    The report holds the numbers of the notebook's data overview (nodes,
+    ways, distinct users, top contributors, ...) without a database; it is
+    written to path as JSON on close.
+    """
+
+    def __init__(self, path=None, top=TOP):
+        self.path = path
+        self.top = top
+        self.rows = dict((table, 0) for table, _, _, _ in data.TABLES)
+        self.users = Counter()
+        self.keys = Counter()
+        self.first = None
+        self.last = None
+
+    def write(self, el):
+        if 'node' in el:
+            attributes, tags = el['node'], el['node_tags']
+            self.rows['nodes'] += 1
+            self.rows['nodes_tags'] += len(tags)
+        else:
+            attributes, tags = el['way'], el['way_tags']
+            refs = el.get(data.WAY_NODE_REFS)
+            self.rows['ways'] += 1
+            self.rows['ways_nodes'] += len(refs if refs is not None else el['way_nodes'])
+            self.rows['ways_tags'] += len(tags)
+        self.users[attributes['user']] += 1
+        for tag in tags:
+            self.keys[tag['key'] if tag['type'] == 'regular' else
+                      tag['type'] + ':' + tag['key']] += 1
+        timestamp = attributes['timestamp']
+        if self.first is None or timestamp < self.first:
+            self.first = timestamp
+        if self.last is None or timestamp > self.last:
+            self.last = timestamp
+
+    def report(self):
+        """Return the counts as a JSON-serializable dict"""
+        def date(timestamp):
+            if timestamp is None:
+                return None
+            return time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime(timestamp))
+        report = dict(self.rows)
+        report.update({'users': len(self.users),
+                       'top_users': self.users.most_common(self.top),
+                       'top_keys': self.keys.most_common(self.top),
+                       'first_edit': date(self.first), 'last_edit': date(self.last)})
+        return report
+
+    def close(self):
+        if self.path is not None:
+            with open(self.path, 'w', encoding='utf-8') as output:
+                json.dump(self.report(), output, indent=1, sort_keys=True, ensure_ascii=False)
+
+    def abort(self):
+        """Write no report for a failed export"""
+
+
+def open_sink(spec, encoded=False, search=False):
+    """Return the writer of a 'kind:path' spec (kind is one of SINK_KINDS)
+
+    The path is optional: the current directory for csv, BendOR.db, columns/
+    and no file for the summary.  encoded and search apply to sqlite sinks.
+    """
+    kind, _, path = spec.partition(':')
+    if kind not in SINK_KINDS:
+        raise ValueError("unknown sink {0!r}, expected one of {1}".format(
+            kind, ', '.join(SINK_KINDS)))
+    if kind == 'csv':
+        path = path or '.'
+        if not os.path.isdir(path):
+            os.makedirs(path)
+        return data.CsvWriter(path)
+    if kind == 'sqlite':
+        return DatabaseSink(path or database.DB_PATH, encoded, search)
+    if kind == 'columns':
+        from . import columnar
+        return columnar.ColumnarWriter(path or 'columns')
+    return Summary(path or None)
+
+
+def test():
+
+    import filecmp
+    import shutil
+    import tempfile
+    from . import columnar
+    directory = tempfile.mkdtemp()
+    try:
+        reference = os.path.join(directory, 'reference')
+        os.makedirs(reference)
+        data.process_map('example.osm', False, output_dir=reference)
+
+        for pipelined in (False, True):
+            db_path = os.path.join(directory, 'example{0}.db'.format(int(pipelined)))
+            summary = Summary()
+            sinks = [open_sink('sqlite:' + db_path),
+                     open_sink('columns:' + os.path.join(directory, 'columns')), summary]
+            data.process_map('example.osm', False, pipelined=pipelined, output_dir=directory,
+                             sinks=sinks)
+            for _, path, _, _ in data.TABLES:
+                assert filecmp.cmp(os.path.join(directory, path), os.path.join(reference, path),
+                                   shallow=False), path
+
+            db = database.open_db(db_path)
+            counts = dict((table, db.execute('SELECT COUNT(*) FROM ' + table).fetchone()[0])
+                          for table, _, _, _ in data.TABLES)
+            db.close()
+            report = summary.report()
+            assert counts == dict((table, report[table]) for table in counts)
+            assert counts == {'nodes': 20, 'nodes_tags': 3, 'ways': 1, 'ways_nodes': 4,
+                              'ways_tags': 3}, counts
+            manifest = columnar.read_manifest(os.path.join(directory, 'columns'))
+            assert dict((table, info['rows']) for table, info in
+                        manifest['tables'].items()) == counts
+            assert report['users'] == 6 and report['top_users'][0] == ('uboot', 6)
+
+        # a database export can fan out to the csv(s) as well
+        out = os.path.join(directory, 'out')
+        summary_path = os.path.join(directory, 'summary.json')
+        database.export_db('example.osm', ':memory:',
+                           sinks=[open_sink('csv:' + out), open_sink('summary:' + summary_path)])
+        assert filecmp.cmp(os.path.join(out, data.NODES_PATH),
+                           os.path.join(reference, data.NODES_PATH), shallow=False)
+        with open(summary_path, encoding='utf-8') as summary_file:
+            assert json.load(summary_file)['nodes'] == 20
+
+        # a failed export, in the shaper or (pipelined) in the parser, is aborted:
+        # no rows in the sink database, no manifest, no summary
+        with open('example.osm', 'rb') as osm_file:
+            text = osm_file.read()
+        nodes = text.split(b'<node ')
+        nodes[11] = nodes[11].replace(b' lat="', b' lat="x', 1)  # after the first rows
+        broken = os.path.join(directory, 'broken.osm')
+        for pipelined, content in ((False, b'<node '.join(nodes)), (True, text[:len(text) // 2])):
+            with open(broken, 'wb') as osm_file:
+                osm_file.write(content)
+            db_path = os.path.join(directory, 'example0.db')
+            columns = os.path.join(directory, 'columns')
+            summary_path = os.path.join(directory, 'failed.json')
+            try:
+                data.process_map(broken, False, pipelined=pipelined, output_dir=directory,
+                                 sinks=[open_sink('sqlite:' + db_path),
+                                        open_sink('columns:' + columns),
+                                        open_sink('summary:' + summary_path)])
+            except (ValueError, SyntaxError):  # ShapeError or ET.ParseError
+                pass
+            else:
+                raise AssertionError('expected the export to fail')
+            db = database.open_db(db_path)
+            assert db.execute('SELECT COUNT(*) FROM nodes').fetchone() == (0,)
+            db.close()
+            assert not os.path.exists(os.path.join(columns, 'columns.json'))
+            assert not os.path.exists(summary_path)
+
+        try:
+            open_sink('parquet:out')
+        except ValueError:
+            pass
+        else:
+            raise AssertionError('expected a ValueError')
+    finally:
+        shutil.rmtree(directory)
+
+
+if __name__ == "__main__":
+    if len(sys.argv) > 1:
+        summary = Summary()
+        data.process_map(sys.argv[1], False, sinks=[summary] + [open_sink(spec) for spec in
+                                                                  sys.argv[2:]])
+        json.dump(summary.report(), sys.stdout, indent=1, sort_keys=True, ensure_ascii=False)
+    else:
+        test()
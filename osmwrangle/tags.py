@@ -9,9 +9,14 @@ Created on Fri Jun 19 20:13:54 2020
 
 #!/usr/bin/env python
 # -*- coding: utf-8 -*-
-import xml.etree.cElementTree as ET
+try:
+    import xml.etree.cElementTree as ET
+except ImportError:  # removed in Python 3.9
+    import xml.etree.ElementTree as ET
 import pprint
-import re
+
+from . import data
+from . import fastscan
 """
 Your task is to explore the data a bit more.
 Before you process the data and add it into your database, you should check the
@@ -34,35 +39,34 @@ See the 'process_map' and 'test' functions for examples of the expected format.
 """
 
 
-lower = re.compile(r'^([a-z]|_)*$')
-lower_colon = re.compile(r'^([a-z]|_)*:([a-z]|_)*$')
-problemchars = re.compile(r'[=\+/&<>;\'"\?%#$@\,\. \t\r\n]')
+lower = data.LOWER
+lower_colon = data.LOWER_COLON_KEY
+problemchars = data.PROBLEMCHARS
 
 
 def key_type(element, keys):
     if element.tag == "tag":
         # YOUR CODE HERE
-        k_attrib = element.attrib['k']
-        result_lower = lower.match(k_attrib)
-        result_lower_colon = lower_colon.match(k_attrib)
-        result_problemchars = problemchars.match(k_attrib)
-        
-        if result_lower:
-            keys['lower'] += 1
-        if result_lower_colon:
-            keys['lower_colon'] += 1
-        if result_problemchars:
-            keys['problemchars'] += 1
-        if not result_lower and not result_lower_colon and not result_problemchars:
-            keys['other'] += 1
-        pass
+        keys = classify_key(element.attrib['k'], keys)
         
     return keys
 
 
+def classify_key(k_attrib, keys):
+    """Count a single tag "k" value into the four key categories (see data.tag_key)"""
+    keys[data.tag_key(k_attrib)[2]] += 1
+    return keys
+
+
 
-def process_map(filename):
+def process_map(filename, backend='iterparse'):
+    """Count tag keys by category; backend is 'iterparse' or 'scan' (see fastscan.py)"""
     keys = {"lower": 0, "lower_colon": 0, "problemchars": 0, "other": 0}
+    if backend == 'scan':
+        for _, k_attrib in fastscan.iter_attribute(filename, 'k', ('tag',)):
+            keys = classify_key(fastscan.decode(k_attrib), keys)
+        return keys
+
     for _, element in ET.iterparse(filename):
         keys = key_type(element, keys)
 
@@ -78,6 +82,7 @@ def test():
     keys = process_map('example.osm')
     pprint.pprint(keys)
     assert keys == {'lower': 5, 'lower_colon': 0, 'other': 1, 'problemchars': 1}
+    assert process_map('example.osm', backend='scan') == keys
 
 
 if __name__ == "__main__":
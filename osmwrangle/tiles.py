@@ -0,0 +1,346 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Per-tile density counts for map visualisation, aggregated while exporting.
+
+A TileAggregator is fed every shaped element, like the integrity checker,
+and counts per web-mercator tile (the z/x/y tiles of slippy maps) at
+several zoom levels
+
+    nodes       nodes in the tile
+    ways        ways whose first node is in the tile
+    buildings   nodes and ways with a building tag (other than building=no)
+    amenities   nodes and ways with an amenity tag
+
+Nodes are buffered in batches of BATCH_SIZE and binned all at once with
+numpy: the tile x/y of the deepest zoom is computed once per node and the
+other zooms are bit shifts of it.  Every batch is reduced to its distinct
+tiles with np.unique and bincount, and every FOLD_BATCHES batches the
+reduced batches are folded into running totals, so the counts kept in
+memory grow with the number of tiles, not of nodes.  To place the ways, the
+(id, x, y) of every node is kept in compact arrays (16 bytes a node, freed
+by close) and the first refs of a batch of ways are looked up with
+searchsorted.
+
+export_db writes the counts to the tiles table (SQL_TILES), process_map and
+export_columns to tiles.csv, so heatmaps never need to touch the nodes.
+save adds the counts to the tiles already in the table (SQL_UPSERT_TILES),
+so several files can be counted into one database; export_db drops the
+table of an earlier export first.
+
+Usage:
+    python -m osmwrangle export mapBend2.osm --to sqlite --tiles 10 12 14
+    python -m osmwrangle.tiles mapBend2.osm BendOR.db    # only (re)build the tiles table
+"""
+import csv
+import math
+import os
+import sys
+from array import array
+
+from . import data
+
+
+ZOOMS = (10, 12, 14, 16)
+MAX_ZOOM = 24  # x and y take 24 bits each in a tile key
+MAX_LAT = 85.0511287798  # the square web-mercator world
+BATCH_SIZE = 4096  # nodes (or ways) binned at once
+FOLD_BATCHES = 64  # reduced batches kept before folding them into the totals
+TILES_PATH = 'tiles.csv'
+
+# element flags; count column i of a tile sums bit i
+NODE, WAY, BUILDING, AMENITY = 1, 2, 4, 8
+COUNTS = ('nodes', 'ways', 'buildings', 'amenities')
+TAG_FLAGS = {'building': BUILDING, 'amenity': AMENITY}
+TILES_FIELDS = ['zoom', 'x', 'y'] + list(COUNTS)
+
+SQL_TILES = '''
+CREATE TABLE IF NOT EXISTS tiles (
+    zoom INTEGER NOT NULL,
+    x INTEGER NOT NULL,
+    y INTEGER NOT NULL,
+    nodes INTEGER NOT NULL,
+    ways INTEGER NOT NULL,
+    buildings INTEGER NOT NULL,
+    amenities INTEGER NOT NULL,
+    PRIMARY KEY (zoom, x, y)
+) WITHOUT ROWID;
+'''
+
+SQL_UPSERT_TILES = '''
+INSERT INTO tiles VALUES (?, ?, ?, ?, ?, ?, ?)
+ON CONFLICT (zoom, x, y) DO UPDATE SET
+    nodes = nodes + excluded.nodes,
+    ways = ways + excluded.ways,
+    buildings = buildings + excluded.buildings,
+    amenities = amenities + excluded.amenities;
+'''
+
+
+def tile_xy(lat, lon, zoom):
+    """Return the tile x and y arrays of lat and lon arrays at a zoom level"""
+    import numpy as np
+    n = 1 << zoom
+    lat = np.radians(np.clip(lat, -MAX_LAT, MAX_LAT))
+    x = np.floor((np.asarray(lon, dtype=float) + 180.0) / 360.0 * n)
+    y = np.floor((1.0 - np.arcsinh(np.tan(lat)) / math.pi) / 2.0 * n)
+    return np.clip(x, 0, n - 1).astype(np.int64), np.clip(y, 0, n - 1).astype(np.int64)
+
+
+def tile_bounds(zoom, x, y):
+    """Return the (minlat, minlon, maxlat, maxlon) of a tile"""
+    n = float(1 << zoom)
+
+    def lat(y):
+        return math.degrees(math.atan(math.sinh(math.pi * (1 - 2 * y / n))))
+    return lat(y + 1), x / n * 360.0 - 180.0, lat(y), (x + 1) / n * 360.0 - 180.0
+
+
+def tag_flags(tags):
+    flags = 0
+    for tag in tags:
+        if tag['type'] == 'regular' and tag['value'] != 'no':
+            flags |= TAG_FLAGS.get(tag['key'], 0)
+    return flags
+
+
+class TileAggregator(object):
+    """Counts the shaped nodes and ways per tile at every zoom level of zooms"""
+
+    def __init__(self, zooms=ZOOMS, batch_size=BATCH_SIZE, fold_batches=FOLD_BATCHES):
+        import numpy as np
+        self.np = np
+        self.zooms = tuple(sorted(set(zooms)))
+        if not self.zooms or self.zooms[0] < 0 or self.zooms[-1] > MAX_ZOOM:
+            raise ValueError("zoom levels must be between 0 and {0}".format(MAX_ZOOM))
+        self.zoom = self.zooms[-1]
+        self.batch_size = batch_size
+        self.fold_batches = fold_batches
+        self.missing = 0  # ways without a first node in the export
+        self.node_ids, self.lat, self.lon, self.node_flags = (
+            array('q'), array('d'), array('d'), array('b'))
+        self.way_refs, self.way_flags = array('q'), array('b')
+        self.located = []  # (ids, x, y) of the binned node batches
+        self.nodes = None  # the same, concatenated and sorted by id
+        self.parts = []  # (tile keys, counts) of the batches since the last fold
+        self.tiles = None
+
+    def write(self, el):
+        if 'node' in el:
+            node = el['node']
+            self.node_ids.append(node['id'])
+            self.lat.append(node['lat'])
+            self.lon.append(node['lon'])
+            self.node_flags.append(NODE | tag_flags(el['node_tags']))
+            if len(self.node_ids) >= self.batch_size:
+                self.flush_nodes()
+            return
+        refs = el.get(data.WAY_NODE_REFS)
+        if refs is None:
+            refs = [row['node_id'] for row in el['way_nodes'][:1]]
+        if not len(refs):
+            self.missing += 1
+            return
+        self.way_refs.append(refs[0])
+        self.way_flags.append(WAY | tag_flags(el['way_tags']))
+        if len(self.way_refs) >= self.batch_size:
+            self.flush_ways()
+
+    def add(self, x, y, flags):
+        """Count a batch of elements at the deepest zoom tiles x, y"""
+        np = self.np
+        keys = np.concatenate([(zoom << 2 * MAX_ZOOM) | ((x >> self.zoom - zoom) << MAX_ZOOM) |
+                               (y >> self.zoom - zoom) for zoom in self.zooms])
+        flags = np.tile(flags, len(self.zooms))
+        tiles, inverse = np.unique(keys, return_inverse=True)
+        counts = np.empty((len(tiles), len(COUNTS)), dtype=np.int64)
+        for column in range(len(COUNTS)):
+            counts[:, column] = np.bincount(inverse, weights=(flags >> column) & 1,
+                                            minlength=len(tiles))
+        self.parts.append((tiles, counts))
+        if len(self.parts) > self.fold_batches:
+            self.fold()
+
+    def fold(self):
+        """Merge the counts of the batches so far into one (tile keys, counts) part"""
+        np = self.np
+        keys = np.concatenate([keys for keys, _ in self.parts])
+        counts = np.concatenate([counts for _, counts in self.parts])
+        tiles, inverse = np.unique(keys, return_inverse=True)
+        totals = np.zeros((len(tiles), len(COUNTS)), dtype=np.int64)
+        np.add.at(totals, inverse, counts)
+        self.parts = [(tiles, totals)]
+
+    def flush_nodes(self):
+        if not self.node_ids:
+            return
+        np = self.np
+        ids = np.frombuffer(self.node_ids, dtype=np.int64)
+        x, y = tile_xy(np.frombuffer(self.lat, dtype=np.float64),
+                       np.frombuffer(self.lon, dtype=np.float64), self.zoom)
+        self.add(x, y, np.frombuffer(self.node_flags, dtype=np.int8))
+        self.located.append((ids, x.astype(np.int32), y.astype(np.int32)))
+        self.node_ids, self.lat, self.lon, self.node_flags = (
+            array('q'), array('d'), array('d'), array('b'))
+
+    def locate(self):
+        """The (ids, x, y) of every node binned so far, sorted by id"""
+        np = self.np
+        if self.located:
+            parts = ([self.nodes] if self.nodes is not None else []) + self.located
+            ids, x, y = (np.concatenate(column) for column in zip(*parts))
+            if len(ids) > 1 and (ids[1:] < ids[:-1]).any():  # OSM files are sorted by id
+                order = np.argsort(ids, kind='stable')
+                ids, x, y = ids[order], x[order], y[order]
+            self.nodes = (ids, x, y)
+            self.located = []
+        return self.nodes
+
+    def flush_ways(self):
+        if not self.way_refs:
+            return
+        np = self.np
+        self.flush_nodes()
+        nodes = self.locate()
+        refs = np.frombuffer(self.way_refs, dtype=np.int64)
+        flags = np.frombuffer(self.way_flags, dtype=np.int8)
+        if nodes is None:
+            found = np.zeros(len(refs), dtype=bool)
+        else:
+            ids, x, y = nodes
+            positions = np.minimum(np.searchsorted(ids, refs), len(ids) - 1)
+            found = ids[positions] == refs
+            positions = positions[found]
+            self.add(x[positions].astype(np.int64), y[positions].astype(np.int64), flags[found])
+        self.missing += int(len(refs) - found.sum())
+        self.way_refs, self.way_flags = array('q'), array('b')
+
+    def close(self):
+        """Bin the last batches and merge the counts of all batches"""
+        np = self.np
+        self.flush_nodes()
+        self.flush_ways()
+        self.nodes = None
+        self.located = []
+        if self.tiles is not None:
+            self.parts.append(self.tiles)
+        if not self.parts:
+            self.tiles = (np.zeros(0, dtype=np.int64), np.zeros((0, len(COUNTS)), np.int64))
+            return
+        self.fold()
+        self.tiles = self.parts.pop()
+
+    def abort(self):
+        """Nothing is written until save or write_csv, after a completed export"""
+
+    def rows(self):
+        """Yield (zoom, x, y, nodes, ways, buildings, amenities) per tile, by zoom, x, y"""
+        if self.tiles is None:
+            self.close()
+        mask = (1 << MAX_ZOOM) - 1
+        keys, counts = self.tiles
+        for key, row in zip(keys.tolist(), counts.tolist()):
+            yield (key >> 2 * MAX_ZOOM, (key >> MAX_ZOOM) & mask, key & mask) + tuple(row)
+
+    def save(self, db):
+        """Add the counts to the tiles table of a database"""
+        db.executescript(SQL_TILES)
+        db.executemany(SQL_UPSERT_TILES, self.rows())
+        db.commit()
+
+    def write_csv(self, output_dir='.'):
+        """Write the counts to the tiles.csv of output_dir"""
+        with open(os.path.join(output_dir, TILES_PATH), 'w', newline='',
+                  encoding='utf-8') as output:
+            writer = csv.writer(output)
+            writer.writerow(TILES_FIELDS)
+            writer.writerows(self.rows())
+
+    def report(self):
+        """Return the number of tiles per zoom level and the ways not placed"""
+        tiles = dict((zoom, 0) for zoom in self.zooms)
+        for row in self.rows():
+            tiles[row[0]] += 1
+        return {'tiles': tiles, 'ways_missing': self.missing}
+
+
+# ================================================== #
+#               Main Functions                       #
+# ================================================== #
+def aggregate_file(osm_file, zooms=ZOOMS, rules=None, area=None, cache=False):
+    """Count the tiles of every node and way of osm_file without exporting"""
+    tiles = TileAggregator(zooms)
+    for el in data.shaped_file(osm_file, rules, area, cache):
+        tiles.write(el)
+    tiles.close()
+    return tiles
+
+
+def tile_frame(db, zoom):
+    """The tiles of one zoom level as a DataFrame (see analysis.query_frame)"""
+    from . import analysis
+    return analysis.query_frame(db, 'SELECT x, y, nodes, ways, buildings, amenities FROM tiles '
+                                    'WHERE zoom = ? ORDER BY x, y', (zoom,))
+
+
+def test():
+
+    import numpy as np
+    from . import database
+    x, y = tile_xy(np.array([0.0, 89.0, -89.0]), np.array([0.0, -180.0, 180.0]), 1)
+    assert list(x) == [1, 0, 1] and list(y) == [1, 0, 1]
+    minlat, minlon, maxlat, maxlon = tile_bounds(1, 0, 0)
+    assert (minlat, minlon, maxlon) == (0.0, -180.0, 0.0) and abs(maxlat - MAX_LAT) < 1e-9
+
+    db = database.export_db('example.osm', ':memory:')
+    lat, lon = (np.array(column) for column in zip(*db.execute('SELECT lat, lon FROM nodes')))
+    for batch_size in (3, BATCH_SIZE):
+        tiles = TileAggregator((12, 16), batch_size)
+        for el in data.shaped_file('example.osm'):
+            tiles.write(el)
+        tiles.close()
+        rows = list(tiles.rows())
+        for zoom in (12, 16):
+            level = [row for row in rows if row[0] == zoom]
+            assert sum(row[3] for row in level) == 20 and sum(row[4] for row in level) == 1
+            assert sum(row[6] for row in level) == 1  # the fast food node
+            x, y = tile_xy(lat, lon, zoom)
+            assert sorted(set(zip(x.tolist(), y.tolist()))) == [row[1:3] for row in level]
+            for _, x, y, nodes, _, _, _ in level:
+                minlat, minlon, maxlat, maxlon = tile_bounds(zoom, x, y)
+                inside = (lat >= minlat) & (lat < maxlat) & (lon >= minlon) & (lon < maxlon)
+                assert inside.sum() == nodes
+        assert tiles.missing == 0
+
+    tiles.save(db)
+    assert db.execute('SELECT SUM(nodes), SUM(ways) FROM tiles WHERE zoom = 16').fetchone() == (
+        20, 1)
+    tiles.save(db)  # adds to the tiles already there
+    assert db.execute('SELECT SUM(nodes), SUM(ways) FROM tiles WHERE zoom = 16').fetchone() == (
+        40, 2)
+    assert sorted(db.execute('SELECT * FROM tiles')) == [
+        row[:3] + tuple(2 * count for count in row[3:]) for row in rows]
+    frame = tile_frame(db, 12)
+    assert frame['nodes'].sum() == 40 and list(frame.columns[:2]) == ['x', 'y']
+    assert list(aggregate_file('example.osm', (12, 16)).rows()) == rows
+
+    db = database.export_db('example.osm', ':memory:', tiles=TileAggregator((12, 16)))
+    assert db.execute('SELECT COUNT(*) FROM tiles').fetchone() == (len(rows),)
+
+    # folding the batches into running totals does not change the counts
+    tiles = TileAggregator((12, 16), batch_size=1, fold_batches=2)
+    for el in data.shaped_file('example.osm'):
+        tiles.write(el)
+        assert len(tiles.parts) <= 2
+    assert list(tiles.rows()) == rows
+
+
+if __name__ == "__main__":
+    if len(sys.argv) > 2:
+        from . import database
+        db = database.open_db(sys.argv[2])
+        db.execute('DROP TABLE IF EXISTS tiles')
+        aggregate_file(sys.argv[1]).save(db)
+        db.close()
+    else:
+        test()
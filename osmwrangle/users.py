@@ -8,9 +8,14 @@ Created on Fri Jun 19 20:14:47 2020
 
 #!/usr/bin/env python
 # -*- coding: utf-8 -*-
-import xml.etree.cElementTree as ET
+try:
+    import xml.etree.cElementTree as ET
+except ImportError:  # removed in Python 3.9
+    import xml.etree.ElementTree as ET
 import pprint
 import re
+
+from . import fastscan
 """
 Your task is to explore the data a bit more.
 The first task is a fun one - find out how many unique users
@@ -23,8 +28,14 @@ def get_user(element):
     return
 
 
-def process_map(filename):
+def process_map(filename, backend='iterparse'):
+    """Return the set of unique uids; backend is 'iterparse' or 'scan' (see fastscan.py)"""
     users = set()
+    if backend == 'scan':
+        for _, uid in fastscan.iter_attribute(filename, 'uid'):
+            users.add(fastscan.decode(uid))
+        return users
+
     for _, element in ET.iterparse(filename):
         if "uid" in element.attrib:
             users.add(element.attrib["uid"])
@@ -37,6 +48,7 @@ def test():
     users = process_map('example.osm')
     pprint.pprint(users)
     assert len(users) == 6
+    assert process_map('example.osm', backend='scan') == users
 
 
 